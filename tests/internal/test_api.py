@@ -0,0 +1,73 @@
+import sys
+import utils
+
+utils.append_home_to_path(__file__)
+
+import pytest
+import tomahawk
+from tomahawk.api import Result, default_options
+from tomahawk.expect import CommandWithExpect
+
+def test_00_run(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', [ 'daemon', '--unknown-option' ])
+    def mock_execute(self):
+        if '127.0.0.1' in self.expect.args:
+            return 1, 'failed'
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    results = list(tomahawk.run([ 'localhost', '127.0.0.1' ], 'uptime', parallel = 2))
+    assert stdout.stop().value() == ''
+    assert stderr.stop().value() == ''
+
+    results = dict([ (r.host, r) for r in results ])
+    assert results['localhost'].succeeded
+    assert results['localhost'].output == 'mock execute'
+    assert results['localhost'].command == 'uptime'
+    assert not results['127.0.0.1'].succeeded
+    assert results['127.0.0.1'].exit_status == 1
+
+def test_01_run_async(monkeypatch):
+    asyncio = pytest.importorskip('asyncio')
+    def mock_execute(self):
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    # iterate like "async for"
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    async_results = tomahawk.run_async([ 'localhost', '127.0.0.1' ], 'uptime').__aiter__()
+    results = []
+    try:
+        while True:
+            results.append(loop.run_until_complete(async_results.__anext__()))
+    except StopAsyncIteration:
+        pass
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    assert sorted([ r.host for r in results ]) == [ '127.0.0.1', 'localhost' ]
+    assert all([ isinstance(r, Result) and r.succeeded for r in results ])
+
+def test_02_unknown_option():
+    with pytest.raises(TypeError):
+        tomahawk.run([ 'localhost' ], 'uptime', no_such_option = True)
+    with pytest.raises(TypeError):
+        tomahawk.run([ 'localhost' ], 'uptime', hosts_files = 'hosts')
+    with pytest.raises(ValueError):
+        tomahawk.run([], 'uptime')
+
+def test_03_default_options():
+    options = default_options()
+    assert options['parallel'] == 1
+    assert 'command' not in options
+    assert 'hosts' not in options
+
+def test_04_cli_only_options():
+    for name, value in [ ('gather', True), ('script', 'setup.sh'), ('stdin_file', '-') ]:
+        with pytest.raises(TypeError):
+            tomahawk.run([ 'localhost' ], 'uptime', **{ name: value })
+    options = default_options()
+    assert 'gather' not in options
+    assert 'stdin_file' not in options
@@ -0,0 +1,61 @@
+import json
+import os
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.breaker import CircuitBreaker
+
+def test_00_record_and_suppress(tmpdir):
+    path = os.path.join(str(tmpdir), 'breaker.json')
+    breaker = CircuitBreaker(path, threshold = 2, ttl = 60)
+    breaker.record('host1', 255, False, now = 100)
+    assert not breaker.is_suppressed('host1', now = 100)
+    breaker.record('host1', 1, True, now = 110)
+    assert breaker.is_suppressed('host1', now = 110)
+    assert not breaker.is_suppressed('host1', now = 171)
+    assert breaker.suppressed_hosts(now = 120) == [ ('host1', 2, 50) ]
+
+def test_01_record_success_closes_circuit(tmpdir):
+    path = os.path.join(str(tmpdir), 'breaker.json')
+    breaker = CircuitBreaker(path, threshold = 1, ttl = 60)
+    breaker.record('host1', 255, False, now = 100)
+    assert breaker.is_suppressed('host1', now = 100)
+    breaker.record('host1', 1, False, now = 101) # command failure is not a connection failure
+    assert not breaker.is_suppressed('host1', now = 101)
+
+def test_02_save_and_load(tmpdir):
+    path = os.path.join(str(tmpdir), 'state', 'breaker.json')
+    breaker = CircuitBreaker(path, threshold = 1, ttl = 60)
+    breaker.record('host1', 255, False)
+    breaker.save()
+    assert json.load(open(path))['hosts']['host1']['failures'] == 1
+    assert CircuitBreaker(path, threshold = 1, ttl = 60).is_suppressed('host1')
+
+def test_03_load_broken_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'breaker.json')
+    f = open(path, 'w')
+    f.write('{ broken')
+    f.close()
+    assert CircuitBreaker(path).hosts == {}
+
+def test_04_save_concurrent_runs(tmpdir):
+    path = os.path.join(str(tmpdir), 'breaker.json')
+    breaker = CircuitBreaker(path, threshold = 1, ttl = 60)
+    breaker.record('host1', 255, False, now = 100)
+    breaker.record('host2', 255, False, now = 100)
+    breaker.save()
+    # two runs started with the same state
+    run1 = CircuitBreaker(path, threshold = 1, ttl = 60)
+    run2 = CircuitBreaker(path, threshold = 1, ttl = 60)
+    run1.record('host1', 255, False, now = 110)
+    run1.record('host3', 255, False, now = 110)
+    run2.record('host1', 255, False, now = 120)
+    run2.record('host2', 0, False, now = 120)
+    run1.save()
+    run2.save()
+    hosts = json.load(open(path))['hosts']
+    assert hosts == {
+        'host1': { 'failures': 3, 'last_failure': 120 },
+        'host3': { 'failures': 1, 'last_failure': 110 },
+    }
+    assert run2.hosts == hosts
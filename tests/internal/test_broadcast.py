@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.broadcast import StdinBroadcaster
+from tomahawk.constants import TimeoutError
+from tomahawk.pipe import CommandWithPipe
+
+DATA = os.urandom(1024 * 1024 + 123)
+
+def read_all(path, results, key):
+    f = open(path, 'rb')
+    try:
+        results[key] = f.read()
+    finally:
+        f.close()
+
+def broadcast(input, readers):
+    # a small buffer so that readers fall behind it
+    broadcaster = StdinBroadcaster(input, buffer_size = 128 * 1024)
+    paths = [ broadcaster.add_reader('host%d' % i) for i in range(readers) ]
+    broadcaster.start()
+    results = {}
+    threads = [ threading.Thread(target = read_all, args = (p, results, i)) for i, p in enumerate(paths) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    broadcaster.stop()
+    assert not os.path.exists(broadcaster.dir)
+    return broadcaster, results
+
+def test_00_file():
+    f = tempfile.TemporaryFile()
+    f.write(DATA)
+    f.seek(0)
+    broadcaster, results = broadcast(f, 3)
+    assert [ results[i] == DATA for i in range(3) ] == [ True ] * 3
+    # the input is read once
+    assert broadcaster.read_chunks == len(DATA) // 65536 + 1
+
+def test_01_pipe():
+    r, w = os.pipe()
+    def write():
+        view = memoryview(DATA)
+        written = 0
+        while written < len(DATA):
+            written += os.write(w, view[written:written + 100000])
+        os.close(w)
+    threading.Thread(target = write).start()
+    broadcaster, results = broadcast(os.fdopen(r, 'rb'), 3)
+    assert [ results[i] == DATA for i in range(3) ] == [ True ] * 3
+
+def test_02_command():
+    f = tempfile.TemporaryFile()
+    f.write(DATA)
+    f.seek(0)
+    broadcaster = StdinBroadcaster(f)
+    read_all_path = broadcaster.add_reader('localhost')
+    exit_early_path = broadcaster.add_reader('127.0.0.1')
+    broadcaster.start()
+    try:
+        status, output = CommandWithPipe('/bin/sh', [ '-c', 'head -c 10 > /dev/null; echo done' ], stdin_path = exit_early_path).execute()
+        assert (status, output) == (0, 'done')
+        status, output = CommandWithPipe('/bin/sh', [ '-c', 'wc -c' ], stdin_path = read_all_path).execute()
+        assert (status, output.strip()) == (0, str(len(DATA)))
+    finally:
+        broadcaster.stop()
+
+def test_03_late_readers():
+    data = DATA[:10 * 65536]
+    r, w = os.pipe()
+    def write():
+        os.write(w, data)
+        os.close(w)
+    threading.Thread(target = write).start()
+    broadcaster = StdinBroadcaster(os.fdopen(r, 'rb'), buffer_size = 2 * 65536)
+    # the first reader moves the buffer to the end of input
+    assert b''.join([ broadcaster.get_chunk(i) for i in range(11) ]) == data
+    assert broadcaster.spool_reads == 0
+    # readers started later share chunks read from the spool
+    for i in range(11):
+        for reader in range(3):
+            assert broadcaster.get_chunk(i) == data[i * 65536:(i + 1) * 65536]
+    # each chunk is read once from the input and once from the spool, not per reader
+    assert broadcaster.read_chunks == 11
+    assert broadcaster.spool_reads == 11
+    broadcaster.close()
+
+def test_04_fifo_without_writer():
+    broadcaster = StdinBroadcaster(tempfile.TemporaryFile())
+    path = broadcaster.add_reader('localhost')
+    # the broadcaster is not started, so nobody writes the fifo
+    try:
+        CommandWithPipe('/bin/cat', [], timeout = 1, stdin_path = path).execute()
+        assert False
+    except TimeoutError:
+        pass
+    finally:
+        broadcaster.close()
@@ -0,0 +1,36 @@
+import os
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.cache import ResultCache
+
+def test_00_get_put(tmpdir):
+    cache = ResultCache(str(tmpdir), 60)
+    assert cache.get('web01', 'uname -r', '-l tomahawk') is None
+    cache.put('web01', 'uname -r', '-l tomahawk', 0, '3.10.0', now = 100)
+    assert cache.get('web01', 'uname -r', '-l tomahawk', now = 159) == (0, '3.10.0')
+    assert cache.get('web01', 'uname -r', '-l tomahawk', now = 160) is None
+    assert cache.get('web01', 'uname -r', '-l root', now = 100) is None
+    # another port may be another host
+    assert cache.get('web01', 'uname -r', '-p 2222 -l tomahawk', now = 100) is None
+    assert cache.get('web02', 'uname -r', '-l tomahawk', now = 100) is None
+
+def test_01_connection_error_is_not_cached(tmpdir):
+    cache = ResultCache(str(tmpdir), 60)
+    cache.put('web01', 'uname -r', '', 255, 'ssh: connect to host web01 port 22: Connection refused')
+    assert cache.get('web01', 'uname -r', '') is None
+
+def test_02_evict(tmpdir):
+    cache = ResultCache(str(tmpdir), 60, max_entries = 2, max_age = 90)
+    for i, host in enumerate([ 'web01', 'web02', 'web03' ]):
+        cache.put(host, 'uname -r', '', 0, '3.10.0')
+        path = cache.path(host, 'uname -r', '')
+        os.utime(path, (1000 + i, 1000 + i))
+    cache.evict(now = 1010)
+    assert not os.path.exists(cache.path('web01', 'uname -r', ''))
+    assert os.path.exists(cache.path('web03', 'uname -r', ''))
+    # entries expired for ttl are kept for runs with longer ttl
+    cache.evict(now = 1080)
+    assert os.path.exists(cache.path('web03', 'uname -r', ''))
+    cache.evict(now = 1100)
+    assert os.listdir(str(tmpdir)) == []
@@ -1,13 +1,22 @@
 import argparse
 import datetime
+import hashlib
+import os
+import pytest
 import re
+import resource
+import subprocess
+import time
 import utils
 
 utils.append_home_to_path(__file__)
 
-from tomahawk.command import CommandMain
+import tomahawk.base
+from tomahawk.breaker import CircuitBreaker
+from tomahawk.command import CommandExecutor, CommandMain
 from tomahawk.constants import TimeoutError
 from tomahawk.expect import CommandWithExpect
+from tomahawk.pipe import CommandWithPipe
 
 def test_00_run(monkeypatch):
     EXPECTED = {
@@ -391,3 +400,666 @@ def test_61_verify_output_ng(monkeypatch):
     main = CommandMain('tomahawk')
     status = main.run()
     assert status != 0
+
+def test_70_preflight_unreachable(monkeypatch):
+    stdout, stderr = utils.capture_stdout_stderr()
+
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            preflight = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_probe_hosts(hosts, port, timeout):
+        return { '127.0.0.1': 'ssh: connect to host 127.0.0.1 port 22: Connection refused' }
+    monkeypatch.setattr(tomahawk.base, 'probe_hosts', mock_probe_hosts)
+
+    def mock_execute(self):
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    main = CommandMain('tomahawk')
+    status = main.run()
+    out = stdout.stop().value()
+    err = stderr.stop().value()
+    assert status == 1
+    assert re.search(r'Connection refused', out)
+    assert re.search(r'failed on following hosts\n  127.0.0.1', err)
+
+def test_71_circuit_breaker(monkeypatch, tmpdir):
+    stdout, stderr = utils.capture_stdout_stderr()
+    breaker_file = os.path.join(str(tmpdir), 'breaker.json')
+    breaker = CircuitBreaker(breaker_file, threshold = 1)
+    breaker.record('127.0.0.1', 255, False)
+    breaker.save()
+
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            circuit_breaker = True,
+            breaker_file = breaker_file,
+            breaker_threshold = 1,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 255, 'ssh: connect to host localhost port 22: Connection refused'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    main = CommandMain('tomahawk')
+    status = main.run()
+    out = stdout.stop().value()
+    assert status == 1
+    assert re.search(r'Skipped by the circuit breaker', out)
+    breaker = CircuitBreaker(breaker_file, threshold = 1)
+    # a suppressed host is not counted again
+    assert breaker.hosts['127.0.0.1']['failures'] == 1
+    assert breaker.hosts['localhost']['failures'] == 1
+
+def test_72_no_pty(monkeypatch):
+    stdout, stderr = utils.capture_stdout_stderr()
+
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            no_pty = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, ' '.join(self.command_args)
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_execute)
+
+    main = CommandMain('tomahawk')
+    status = main.run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r'-l tomahawk localhost /bin/sh -c "uptime"', out)
+    assert not re.search(r' -t ', out)
+
+def test_73_digest(monkeypatch):
+    stdout, stderr = utils.capture_stdout_stderr()
+
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'cat /etc/hosts' ],
+            hosts = 'localhost,127.0.0.1,127.0.0.2',
+            digest = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        different = '127.0.0.2' in self.expect.args
+        if 'TOMAHAWK-DIGEST' in ' '.join(self.expect.args):
+            return 0, 'TOMAHAWK-DIGEST %s 5 ccc 0' % ('bbb' if different else 'aaa')
+        return 0, 'full output'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    main = CommandMain('tomahawk')
+    status = main.run()
+    out = stdout.stop().value()
+    err = stderr.stop().value()
+    assert status == 3
+    assert re.search(r'digest: aaa \(5 bytes\)', out)
+    assert re.search(r'majority \(digest: aaa \(5 bytes\)\) on following hosts.\n  127.0.0.2', err)
+    # full output is fetched only from the different host
+    assert re.findall(r'@(\S+) % cat /etc/hosts\nfull output', out) == [ '127.0.0.2' ]
+
+def test_74_cache_ttl(monkeypatch, tmpdir):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'date' ],
+            hosts = 'localhost,127.0.0.1',
+            read_only = True,
+            cache_ttl = 60,
+            cache_dir = str(tmpdir),
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, str(datetime.datetime.now())
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    outputs = []
+    for i in range(2):
+        stdout, stderr = utils.capture_stdout_stderr()
+        main = CommandMain('tomahawk')
+        status = main.run()
+        outputs.append(stdout.stop().value())
+        assert status == 0
+    assert outputs[0] == outputs[1]
+
+def test_75_journal_resume(monkeypatch, tmpdir):
+    journal = os.path.join(str(tmpdir), 'journal')
+    resume = [ False ]
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'date' ],
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            journal = journal,
+            resume = resume[0],
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        if '127.0.0.1' in self.expect.args:
+            return 1, 'failed'
+        return 0, str(datetime.datetime.now())
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    assert CommandMain('tomahawk').run() == 1
+    first = stdout.stop().value()
+
+    resume[0] = True
+    stdout, stderr = utils.capture_stdout_stderr()
+    assert CommandMain('tomahawk').run() == 1
+    second = stdout.stop().value()
+    # the succeeded host is not executed again
+    assert first.split('\n')[0:2] == second.split('\n')[0:2]
+    assert len(open(journal).readlines()) == 3
+
+def test_76_retries(monkeypatch, tmpdir):
+    attempts_file = os.path.join(str(tmpdir), 'attempts')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            retries = 2,
+            retry_backoff = 0.01,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        # executed in worker processes, so count attempts with a file
+        f = open(attempts_file, 'a')
+        f.write('.')
+        f.close()
+        if len(open(attempts_file).read()) == 1:
+            return 255, 'ssh: connect to host localhost port 22: Connection refused'
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r'mock execute\n\(2 attempts\)', out)
+
+def test_77_retries_not_for_command_failure(monkeypatch, tmpdir):
+    attempts_file = os.path.join(str(tmpdir), 'attempts')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'false' ],
+            retries = 2,
+            retry_backoff = 0.01,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        f = open(attempts_file, 'a')
+        f.write('.')
+        f.close()
+        return 1, ''
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    stdout.stop()
+    assert status == 1
+    assert open(attempts_file).read() == '.'
+
+def test_78_script(monkeypatch, tmpdir):
+    script = os.path.join(str(tmpdir), 'setup.sh')
+    f = open(script, 'w')
+    f.write('echo "$1"\n')
+    f.close()
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'hello world' ],
+            script = script,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, '%s\n%s' % (' '.join(self.command_args), self.input.decode('utf-8'))
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r'% ' + re.escape(script) + r" 'hello world'", out)
+    assert re.search(r'''/bin/sh -c "/bin/sh -s -- 'hello world'"''', out)
+    assert re.search(r'echo "\$1"', out)
+
+def test_79_order_input(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1,127.0.0.2',
+            parallel = 3,
+            order = 'input',
+            reorder_buffer = 2,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        if 'localhost' in self.expect.args:
+            # the first host finishes last
+            time.sleep(0.5)
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    hosts = re.findall(r'^tomahawk@(\S+) %', out, re.M)
+    assert hosts == [ 'localhost', '127.0.0.1', '127.0.0.2' ]
+
+def test_80_progress(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1',
+            progress = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    stdout.stop()
+    err = stderr.stop().value()
+    assert status == 0
+    # not shown because stderr is not a terminal
+    assert 'done' not in err
+
+def test_81_metrics_textfile(monkeypatch, tmpdir):
+    path = os.path.join(str(tmpdir), 'tomahawk.prom')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            metrics_textfile = path,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        if '127.0.0.1' in self.expect.args:
+            return 1, 'failed'
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    stdout.stop(), stderr.stop()
+    assert status == 1
+    text = open(path).read()
+    assert 'tomahawk_hosts_total{program="command",result="succeeded"} 1\n' in text
+    assert 'tomahawk_hosts_total{program="command",result="failed"} 1\n' in text
+    assert 'tomahawk_host_duration_seconds_count{program="command"} 2\n' in text
+
+def test_82_pipeline(monkeypatch, tmpdir):
+    executed_file = os.path.join(str(tmpdir), 'executed')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'step1', 'step2' ],
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            parallel = 2,
+            pipeline = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        args = ' '.join(self.expect.args)
+        host = '127.0.0.1' if '127.0.0.1' in args else 'localhost'
+        step = 'step2' if 'step2' in args else 'step1'
+        # executed in worker processes, so record steps with a file
+        f = open(executed_file, 'a')
+        f.write('%s %s\n' % (host, step))
+        f.close()
+        if host == '127.0.0.1':
+            return 1, 'failed'
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    stderr.stop()
+    assert status == 1
+    # step2 is not executed on the host where step1 failed
+    assert sorted(open(executed_file).read().splitlines()) == [
+        '127.0.0.1 step1', 'localhost step1', 'localhost step2'
+    ]
+    assert not re.search(r'127\.0\.0\.1 % .*step2', out)
+
+def test_83_shard_items(monkeypatch, tmpdir):
+    items = os.path.join(str(tmpdir), 'items')
+    f = open(items, 'w')
+    f.write('a\nb\nc\n')
+    f.close()
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'process $TOMAHAWK_SHARD_ITEMS' ],
+            hosts = 'localhost,127.0.0.1',
+            shard_items = items,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, ' '.join(self.expect.args)
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r"export TOMAHAWK_HOST=localhost TOMAHAWK_SHARD_INDEX=0 TOMAHAWK_SHARD_COUNT=2 TOMAHAWK_SHARD_ITEMS='a\nb'; process \\\$TOMAHAWK_SHARD_ITEMS", out)
+    assert re.search(r"export TOMAHAWK_HOST=127\.0\.0\.1 TOMAHAWK_SHARD_INDEX=1 TOMAHAWK_SHARD_COUNT=2 TOMAHAWK_SHARD_ITEMS=c;", out)
+    # labels of commands are not changed
+    assert re.search(r'^tomahawk@localhost % process \$TOMAHAWK_SHARD_ITEMS$', out, re.M)
+
+def test_84_reduce(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uname -r' ],
+            hosts = 'localhost,127.0.0.1,127.0.0.2',
+            reduce = 'count-distinct',
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        if '127.0.0.2' in self.expect.args:
+            return 0, '4.18.0'
+        return 0, '3.10.0'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert 'tomahawk@' not in out
+    assert re.search(r'uname -r.* \(count-distinct of 3 hosts\)\n2  3\.10\.0\n1  4\.18\.0\n', out)
+
+def test_85_reduce_with_failure(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uname -r' ],
+            hosts = 'localhost,127.0.0.1,127.0.0.2',
+            reduce = 'count-distinct',
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        if 'localhost' in self.expect.args:
+            return 1, 'failed'
+        return 0, '3.10.0'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    err = stderr.stop().value()
+    assert status == 1
+    # results of other hosts are aggregated without -c
+    assert re.search(r'\(count-distinct of 2 hosts\)\n2  3\.10\.0\n', out)
+    assert re.search(r'failed on following hosts\n  localhost', err)
+
+def test_86_shard_duplicated_hosts(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'uptime' ],
+            hosts = 'localhost,127.0.0.1,localhost',
+            shard = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    try:
+        with pytest.raises(RuntimeError) as e:
+            CommandMain('tomahawk').run()
+    finally:
+        stdout.stop(), stderr.stop()
+    assert '--shard requires unique hosts: localhost' in str(e.value)
+
+def mock_gather_popen(monkeypatch, scripts):
+    """
+    Replace ssh of --gather with a local shell script of each host.
+    """
+    popen = subprocess.Popen
+    def mock_popen(args, **kwargs):
+        if args[0] == 'ssh':
+            args = [ '/bin/sh', '-c', scripts[args[-2]] ]
+        return popen(args, **kwargs)
+    monkeypatch.setattr(subprocess, 'Popen', mock_popen)
+
+def test_87_gather(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'cat app.log' ],
+            hosts = 'web01,web02,web03',
+            gather = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+    mock_gather_popen(monkeypatch, {
+        'web01': 'echo "2014-05-01 00:00:01 a"; echo "2014-05-01 00:00:03 c"',
+        'web02': 'echo "2014-05-01 00:00:02 b"',
+        'web03': 'echo "No such file" >&2; exit 1',
+    })
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    err = stderr.stop().value()
+    assert status == 1
+    assert re.findall(r'\[(web\d+)\] 2014-05-01 00:00:0\d (\w)', out) == [
+        ('web01', 'a'), ('web02', 'b'), ('web01', 'c'),
+    ]
+    assert 'Command failed on host "web03" (status = 1) No such file' in err
+
+def test_88_gather_timeout(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'tail -f app.log' ],
+            hosts = 'web01,web02',
+            gather = True,
+            timeout = 1,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+    mock_gather_popen(monkeypatch, {
+        'web01': 'echo "2014-05-01 00:00:01 a"; exec sleep 30',
+        'web02': 'echo "2014-05-01 00:00:02 b"',
+    })
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    started_at = time.time()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    err = stderr.stop().value()
+    assert time.time() - started_at < 10
+    assert status == 1
+    assert re.findall(r'\[(web\d+)\]', out) == [ 'web01', 'web02' ]
+    assert 'Command timed out on host "web01" after 1 seconds' in err
+    assert 'web02' not in err
+
+def test_89_gather_file_descriptors(monkeypatch):
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'cat app.log' ],
+            hosts = ','.join([ 'web%02d' % i for i in range(100) ]),
+            gather = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+    monkeypatch.setattr(resource, 'getrlimit', lambda resource: (64, 64))
+    mock_gather_popen(monkeypatch, {})
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    try:
+        with pytest.raises(RuntimeError) as e:
+            CommandMain('tomahawk').run()
+    finally:
+        stdout.stop(), stderr.stop()
+    assert '--gather requires 232 file descriptors for 100 hosts, but the limit is 64' in str(e.value)
+
+def run_remote_command(command_args):
+    """
+    Execute arguments after the host like sshd, which joins them and executes them by a shell.
+    """
+    remote_command = ' '.join(command_args[command_args.index('localhost') + 1:])
+    process = subprocess.Popen([ '/bin/sh', '-c', remote_command ], stdout = subprocess.PIPE)
+    output = process.communicate()[0].decode('utf-8')
+    return process.returncode, output.rstrip('\n')
+
+def test_90_nested_quotes(monkeypatch):
+    command = """printf '%s|' "a \\"b\\" 'c'" 'd "e" $HOME' `echo f`"""
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(command = [ command ], no_pty = True)
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+    def mock_execute(self):
+        return run_remote_command(self.command_args)
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert 'a "b" \'c\'|d "e" $HOME|f|' in out
+
+def test_91_digest_nested_quotes(monkeypatch):
+    command = """echo "a 'b'"; echo 'c "d"' >&2"""
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(command = [ command ], no_pty = True, digest = True)
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+    def mock_execute(self):
+        return run_remote_command(self.command_args)
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert 'digest: %s (6 bytes), stderr digest: %s (6 bytes)' % (
+        hashlib.sha256(b"a 'b'\n").hexdigest(), hashlib.sha256(b'c "d"\n').hexdigest()
+    ) in out
+
+def test_92_pipeline_retries_within_parallel(monkeypatch, tmpdir):
+    attempts_file = os.path.join(str(tmpdir), 'attempts')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'step1', 'step2' ],
+            hosts = 'localhost,127.0.0.1',
+            parallel = 1,
+            pipeline = True,
+            retries = 1,
+            retry_backoff = 0.01,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        args = ' '.join(self.expect.args)
+        if '127.0.0.1' not in args and 'step1' in args:
+            f = open(attempts_file, 'a')
+            f.write('.')
+            f.close()
+            if len(open(attempts_file).read()) == 1:
+                return 255, 'ssh: connect to host localhost port 22: Connection refused'
+        time.sleep(0.2)
+        return 0, 'mock execute'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    # tasks submitted to the process pool and not finished when a task is submitted
+    running = []
+    submitted = []
+    resubmit = CommandExecutor.resubmit
+    def mock_resubmit(self, entry):
+        running.append(len([ e for e in submitted if e['async_result'] is not None and 'finished_at' not in e ]))
+        submitted.append(entry)
+        return resubmit(self, entry)
+    monkeypatch.setattr(CommandExecutor, 'resubmit', mock_resubmit)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    stdout.stop(), stderr.stop()
+    assert status == 0
+    assert open(attempts_file).read() == '..'
+    # a retry waits for a free worker like other steps
+    assert len(running) == 5
+    assert max(running) == 0
+
+def test_93_digest_refetch_metrics(monkeypatch, tmpdir):
+    path = os.path.join(str(tmpdir), 'tomahawk.prom')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [ 'cat /etc/hosts' ],
+            hosts = 'localhost,127.0.0.1,127.0.0.2',
+            digest = True,
+            metrics_textfile = path,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        different = '127.0.0.2' in self.expect.args
+        if 'TOMAHAWK-DIGEST' in ' '.join(self.expect.args):
+            return 0, 'TOMAHAWK-DIGEST %s 5 ccc 0' % ('bbb' if different else 'aaa')
+        return 0, 'full output'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    created = []
+    original_metrics = tomahawk.base.Metrics
+    def mock_metrics(*args, **kwargs):
+        created.append(args)
+        return original_metrics(*args, **kwargs)
+    monkeypatch.setattr(tomahawk.base, 'Metrics', mock_metrics)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = CommandMain('tomahawk').run()
+    stdout.stop(), stderr.stop()
+    assert status == 3
+    # the refetch of the different host is not counted again
+    assert len(created) == 1
+    text = open(path).read()
+    assert 'tomahawk_hosts_total{program="command",result="succeeded"} 3\n' in text
+
+def test_94_cache_ttl_script(monkeypatch, tmpdir):
+    script = os.path.join(str(tmpdir), 'setup.sh')
+    def mock_parse_args(self, args):
+        return utils.create_command_namespace(
+            command = [],
+            hosts = 'localhost,127.0.0.1',
+            script = script,
+            read_only = True,
+            cache_ttl = 60,
+            cache_dir = os.path.join(str(tmpdir), 'cache'),
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        return 0, self.input.decode('utf-8')
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_execute)
+
+    outputs = []
+    for content in [ 'echo 1\n', 'echo 1\n', 'echo 2\n' ]:
+        f = open(script, 'w')
+        f.write(content)
+        f.close()
+        stdout, stderr = utils.capture_stdout_stderr()
+        status = CommandMain('tomahawk').run()
+        outputs.append(stdout.stop().value())
+        assert status == 0
+    # the result is cached until the script is edited
+    assert outputs[0] == outputs[1]
+    assert 'echo 2' not in outputs[1]
+    assert 'echo 2' in outputs[2]
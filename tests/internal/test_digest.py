@@ -0,0 +1,42 @@
+import hashlib
+import subprocess
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.base import FinishedResult
+from tomahawk.digest import (
+    DigestResult,
+    create_digest_command,
+    find_different_hosts,
+    parse_digest_output,
+)
+
+def test_00_digest_command():
+    command = 'echo "hello  world"; echo error >&2; exit 3'
+    process = subprocess.Popen(
+        [ '/bin/sh', '-c', create_digest_command(command) ],
+        stdout = subprocess.PIPE
+    )
+    output = process.communicate()[0].decode('utf-8')
+    assert process.returncode == 3
+    # stdout and stderr are hashed separately
+    assert parse_digest_output(output) == (
+        hashlib.sha256(b"hello  world\n").hexdigest(), 13,
+        hashlib.sha256(b"error\n").hexdigest(), 6
+    )
+
+def test_01_parse_digest_output():
+    assert parse_digest_output("motd\nTOMAHAWK-DIGEST abc 10 def 0\n") == ('abc', 10, 'def', 0)
+    assert parse_digest_output("no digest") is None
+
+def test_02_find_different_hosts():
+    outputs = { 'web01': 'a', 'web02': 'b', 'web03': 'b', 'web04': 'c' }
+    assert find_different_hosts([ 'web01', 'web02', 'web03', 'web04' ], outputs) == \
+        ('b', [ 'web01', 'web04' ])
+
+def test_03_digest_result():
+    result = DigestResult(FinishedResult((0, "TOMAHAWK-DIGEST abc 10 def 0")))
+    assert result.ready()
+    assert result.get() == (0, 'digest: abc (10 bytes)')
+    result = DigestResult(FinishedResult((1, "TOMAHAWK-DIGEST abc 10 def 6")))
+    assert result.get() == (1, 'digest: abc (10 bytes), stderr digest: def (6 bytes)')
@@ -6,7 +6,7 @@ import pytest
 import utils
 utils.append_home_to_path(__file__)
 
-from tomahawk.expect import CommandWithExpect
+from tomahawk.expect import CommandWithExpect, OutputSanitizer
 from tomahawk.constants import TimeoutError
 
 def test_00_execute():
@@ -39,3 +39,36 @@ def create_object(expect_out):
         expect = expect, expect_out = expect_out
     )
 
+
+def test_02_output_sanitizer():
+    """Prompts and passwords split over chunks are removed"""
+    sanitizer = OutputSanitizer([ 'password1', None ])
+    data = b"[sudo] pass" + b"word for tomahawk: \r\npassword1\r\nhel" + b"lo\r\n\r\nwor" + b"ld\r\n" \
+        + b"Connection to localhost closed.\r\nlast"
+    for i in range(0, len(data), 3):
+        sanitizer.write(data[i:i + 3])
+    assert sanitizer.getvalue() == "hello\nworld\nlast"
+
+def test_03_execute_with_sanitizer():
+    expect_out = OutputSanitizer([ 'password1', 'password2' ])
+    target = create_object(expect_out)
+    expect_out.write(b"Password: \r\n")
+    expect_out.write(b"hello world\r\n")
+    status, output = target.execute()
+    assert status == 0
+    assert output == "hello world"
+
+def test_04_execute_no_output_lost():
+    """Output and exit status are complete without expect_delay"""
+    script = 'i=0; while [ $i -lt 2000 ]; do echo "line $i"; i=$((i+1)); done; printf last; exit 7'
+    for i in range(5):
+        target = CommandWithExpect(
+            '/bin/sh', [ '-c', script ], None, None, timeout = 10, expect_delay = 0
+        )
+        status, output = target.execute()
+        lines = output.split('\n')
+        assert status == 7
+        assert len(lines) == 2001
+        assert lines[0] == 'line 0'
+        assert lines[1999] == 'line 1999'
+        assert lines[2000] == 'last'
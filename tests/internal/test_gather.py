@@ -0,0 +1,47 @@
+import datetime
+import io
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.gather import TimestampParser, merge_by_timestamp, read_lines
+
+def test_00_timestamp_parser():
+    parser = TimestampParser()
+    assert parser.parse('2014-05-01 12:34:56,789 INFO start') == '2014-05-01 12:34:56,789'
+    assert parser.parse('  at Foo.bar()') is None
+
+    parser = TimestampParser(r'^(\w{3} +\d+ \d\d:\d\d:\d\d)', '%b %d %H:%M:%S')
+    assert parser.parse('May  1 12:34:56 web01 sshd[1]: Accepted') == datetime.datetime(1900, 5, 1, 12, 34, 56)
+    assert parser.parse('Foo  1 12:34:56 web01') is None
+
+def test_01_merge_by_timestamp():
+    sources = [
+        ('web01', [ 'header', '2014-05-01 00:00:01 a', '2014-05-01 00:00:04 b', '  trace b' ]),
+        ('web02', [ '2014-05-01 00:00:02 c', '2014-05-01 00:00:03 d' ]),
+        ('web03', []),
+    ]
+    assert list(merge_by_timestamp(sources, TimestampParser())) == [
+        ('web01', 'header'),
+        ('web01', '2014-05-01 00:00:01 a'),
+        ('web02', '2014-05-01 00:00:02 c'),
+        ('web02', '2014-05-01 00:00:03 d'),
+        ('web01', '2014-05-01 00:00:04 b'),
+        ('web01', '  trace b'),
+    ]
+
+def test_02_merge_is_streaming():
+    read = []
+    def lines(name, count):
+        for i in range(count):
+            read.append(name)
+            yield '2014-05-01 00:00:%02d %s' % (i, name)
+    merged = merge_by_timestamp([ ('a', lines('a', 1000)), ('b', lines('b', 1000)) ], TimestampParser())
+    next(merged)
+    # only a line of each source is read before the first line is merged
+    assert read == [ 'a', 'b' ]
+    next(merged)
+    assert read == [ 'a', 'b', 'a' ]
+
+def test_03_read_lines():
+    stream = io.BytesIO(b'line 1\r\nline 2\n\xffline 3')
+    assert list(read_lines(stream)) == [ 'line 1', 'line 2', u'\ufffdline 3' ]
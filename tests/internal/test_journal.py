@@ -0,0 +1,39 @@
+import os
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.journal import Journal, read_succeeded_results
+
+def test_00_append_and_read(tmpdir):
+    path = os.path.join(str(tmpdir), 'journal')
+    journal = Journal(path, sync_records = 2)
+    journal.append('web01', 'uptime', 0, 'up 1 day', False)
+    journal.append('web02', 'uptime', 1, 'error', False)
+    journal.append('web03', 'uptime', 1, '', True)
+    journal.append('web04', 'uptime', 0, 'up 2 days', False)
+    journal.append('web04', 'uptime', 255, 'Connection refused', False)
+    journal.close()
+    # half-written record by interruption
+    f = open(path, 'a')
+    f.write('{"host": "web05", "comm')
+    f.close()
+
+    assert read_succeeded_results(path) == { ('web01', 'uptime'): (0, 'up 1 day') }
+
+def test_01_read_not_exists(tmpdir):
+    assert read_succeeded_results(os.path.join(str(tmpdir), 'journal')) == {}
+
+def test_02_append_after_half_written(tmpdir):
+    path = os.path.join(str(tmpdir), 'journal')
+    f = open(path, 'w')
+    f.write('{"host": "web01", "command": "uptime", "exit_status": 0, "output": "up 1 day", "timeout": false}\n')
+    f.write('{"host": "web02", "comm')
+    f.close()
+    journal = Journal(path)
+    journal.append('web02', 'uptime', 0, 'up 2 days', False)
+    journal.close()
+
+    assert read_succeeded_results(path) == {
+        ('web01', 'uptime'): (0, 'up 1 day'),
+        ('web02', 'uptime'): (0, 'up 2 days'),
+    }
@@ -0,0 +1,66 @@
+import os
+import pytest
+import socket
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.metrics import Histogram, Metrics, parse_address
+
+def test_00_parse_address():
+    assert parse_address('localhost:8125') == ('localhost', 8125)
+    assert parse_address('[::1]:8125') == ('::1', 8125)
+    for address in ('localhost', ':8125', 'localhost:port'):
+        with pytest.raises(ValueError):
+            parse_address(address)
+
+def test_01_histogram():
+    histogram = Histogram((1, 5, 10))
+    for value in (0.5, 1, 3, 20):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [ 2, 3, 3 ]
+    assert histogram.count == 4
+    assert histogram.sum == 24.5
+
+def test_02_textfile(tmpdir):
+    path = os.path.join(str(tmpdir), 'tomahawk.prom')
+    metrics = Metrics('command', textfile = path)
+    metrics.observe(0, False, 0.3, 'ok')
+    metrics.observe(1, False, 2.0, 'error')
+    metrics.observe(1, True, None, '')
+    metrics.close()
+    text = open(path).read()
+    assert 'tomahawk_hosts_total{program="command",result="succeeded"} 1\n' in text
+    assert 'tomahawk_hosts_total{program="command",result="failed"} 1\n' in text
+    assert 'tomahawk_hosts_total{program="command",result="timed_out"} 1\n' in text
+    assert 'tomahawk_host_duration_seconds_bucket{program="command",le="0.5"} 1\n' in text
+    assert 'tomahawk_host_duration_seconds_bucket{program="command",le="+Inf"} 2\n' in text
+    assert 'tomahawk_output_bytes_total{program="command"} 7\n' in text
+    assert 'tomahawk_run_finished{program="command"} 1\n' in text
+    assert os.listdir(str(tmpdir)) == [ 'tomahawk.prom' ]
+
+def test_03_statsd():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    metrics = Metrics('rsync', statsd = '127.0.0.1:%d' % (server.getsockname()[1]))
+    metrics.observe(0, False, 1.5, 'ok')
+    metrics.close()
+    lines = server.recv(65536).decode('utf-8').split('\n')
+    server.close()
+    assert lines[0:3] == [
+        'tomahawk.rsync.hosts.succeeded:1|c',
+        'tomahawk.rsync.output_bytes:2|c',
+        'tomahawk.rsync.host_duration:1500|ms',
+    ]
+    assert lines[3].startswith('tomahawk.rsync.run_duration:')
+
+def test_04_statsd_not_listening():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    server.close()
+    metrics = Metrics('command', statsd = '127.0.0.1:%d' % (port))
+    for i in range(3):
+        metrics.observe(0, False, 0.1, 'ok')
+        metrics.statsd.flush()
+    metrics.close()
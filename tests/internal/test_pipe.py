@@ -0,0 +1,25 @@
+import pytest
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.pipe import CommandWithPipe
+from tomahawk.constants import TimeoutError
+
+def test_00_execute():
+    """stdout and stderr are kept separately"""
+    target = CommandWithPipe('/bin/sh', [ '-c', 'echo hello; echo error >&2; echo world; exit 3' ])
+    status, output = target.execute()
+    assert status == 3
+    assert output == "hello\nworld\nerror"
+    assert target.stdout == b"hello\nworld\n"
+    assert target.stderr == b"error\n"
+
+def test_01_execute_input():
+    data = b"x" * 200000
+    status, output = CommandWithPipe('/bin/sh', [ '-c', 'wc -c' ], input = data).execute()
+    assert status == 0
+    assert output.strip() == "200000"
+
+def test_02_execute_timeout():
+    target = CommandWithPipe('/bin/sh', [ '-c', 'sleep 5' ], timeout = 1)
+    pytest.raises(TimeoutError, target.execute)
@@ -0,0 +1,36 @@
+import os
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.command import CommandContext, CommandExecutor
+from tomahawk.log import create_logger
+from tomahawk.pool import (
+    create_process_pool,
+    get_shared_pool,
+    terminate_shared_pools,
+)
+
+def test_00_create_process_pool_forkserver():
+    pool = create_process_pool(2, True, 10)
+    try:
+        pid = pool.apply(os.getpid)
+        assert pid != os.getpid()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def test_01_shared_pool():
+    try:
+        pool = get_shared_pool(2)
+        assert get_shared_pool(2) is pool
+        # pools with other settings are not shared
+        assert get_shared_pool(2, max_tasks_per_child = 1) is not pool
+        assert get_shared_pool(2, forkserver = False) is not pool
+        context = CommandContext([ 'uptime' ], { 'parallel': 2 }, None, None)
+        executor = CommandExecutor(context, create_logger(), [ 'localhost' ], process_pool = pool)
+        assert executor.process_pool is pool
+        executor.terminate_processes()
+        # the shared pool is still available
+        assert pool.apply(os.getpid) != os.getpid()
+    finally:
+        terminate_shared_pools()
@@ -0,0 +1,96 @@
+import errno
+import socket
+import time
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.preflight import probe_hosts
+
+def test_00_probe_hosts_reachable():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    try:
+        port = server.getsockname()[1]
+        assert probe_hosts([ '127.0.0.1', '127.0.0.1' ], port, 1) == {}
+    finally:
+        server.close()
+
+def test_01_probe_hosts_unreachable():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    unreachable = probe_hosts([ '127.0.0.1' ], port, 1)
+    assert list(unreachable.keys()) == [ '127.0.0.1' ]
+    assert unreachable['127.0.0.1'].startswith('ssh: connect to host 127.0.0.1 port %d' % (port))
+
+def test_02_probe_hosts_unknown_host():
+    unreachable = probe_hosts([ 'host.invalid' ], 22, 1)
+    assert 'host.invalid' in unreachable
+
+def test_03_probe_hosts_next_address(monkeypatch):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    try:
+        open_port = server.getsockname()[1]
+        # the first address refuses connections
+        def getaddrinfo(host, port, family = 0, socktype = 0):
+            return [
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', closed_port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', open_port)),
+            ]
+        monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+        assert probe_hosts([ 'web01' ], open_port, 1) == {}
+    finally:
+        server.close()
+
+def test_04_probe_hosts_slow_resolution(monkeypatch):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    getaddrinfo = socket.getaddrinfo
+    def slow_getaddrinfo(host, port, family = 0, socktype = 0):
+        if host == 'slow':
+            time.sleep(5)
+        return getaddrinfo('127.0.0.1', port, family, socktype)
+    monkeypatch.setattr(socket, 'getaddrinfo', slow_getaddrinfo)
+    try:
+        started_at = time.time()
+        unreachable = probe_hosts([ 'slow', 'web01', 'web02' ], server.getsockname()[1], 1)
+        assert time.time() - started_at < 3
+        assert list(unreachable.keys()) == [ 'slow' ]
+        assert 'Name resolution timed out' in unreachable['slow']
+    finally:
+        server.close()
+
+def test_05_probe_hosts_without_file_descriptors(monkeypatch):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(64)
+    getaddrinfo = socket.getaddrinfo
+    monkeypatch.setattr(socket, 'getaddrinfo', lambda host, port, family = 0, socktype = 0: getaddrinfo('127.0.0.1', port, family, socktype))
+    # only 4 sockets can be opened at once
+    opened = [ 0 ]
+    class LimitedSocket(socket.socket):
+        def __init__(self, *args):
+            if opened[0] >= 4:
+                raise socket.error(errno.EMFILE, 'Too many open files')
+            super(LimitedSocket, self).__init__(*args)
+            opened[0] += 1
+        def close(self):
+            if self.fileno() != -1:
+                opened[0] -= 1
+            super(LimitedSocket, self).close()
+    monkeypatch.setattr(socket, 'socket', LimitedSocket)
+    try:
+        hosts = [ 'web%02d' % i for i in range(30) ]
+        assert probe_hosts(hosts, server.getsockname()[1], 3) == {}
+    finally:
+        server.close()
@@ -0,0 +1,53 @@
+import utils
+utils.append_home_to_path(__file__)
+
+from six.moves import StringIO
+
+from tomahawk.command import CommandContext, CommandExecutor
+from tomahawk.log import create_logger
+from tomahawk.progress import Progress, format_duration
+
+class TerminalStringIO(StringIO):
+    def isatty(self):
+        return True
+
+def test_00_format():
+    progress = Progress(StringIO(), 100, 10)
+    progress.started_at -= 10
+    for i in range(20):
+        progress.finished(i % 10 != 0)
+    line = progress.format(progress.started_at + 10, 30)
+    assert line == 'done 20/100, failed 2, running 10, queued 70 | 2.0 hosts/s, ETA 40s | workers 10/10'
+
+def test_01_update_and_clear():
+    stream = StringIO()
+    progress = Progress(stream, 2, 1, interval = 60)
+    progress.update(1)
+    # redrawn at most once per interval
+    progress.update(1)
+    assert stream.getvalue().count('done 0/2') == 1
+    progress.clear()
+    assert stream.getvalue().endswith('\r\033[K')
+    progress.clear()
+    assert stream.getvalue().count('\r\033[K') == 2
+
+def test_02_format_duration():
+    assert format_duration(59.9) == '59s'
+    assert format_duration(125) == '2m05s'
+    assert format_duration(7300) == '2h01m'
+
+def test_03_create_progress():
+    def create_progress(options, err):
+        context = CommandContext([ 'uptime' ], options, StringIO(), err)
+        executor = CommandExecutor(context, create_logger(), [ 'localhost' ])
+        try:
+            return executor.create_progress(3)
+        finally:
+            executor.terminate_processes()
+
+    progress = create_progress({ 'parallel': 2, 'progress': True }, TerminalStringIO())
+    assert isinstance(progress, Progress)
+    assert (progress.total, progress.workers) == (3, 2)
+    # not drawn when stderr is not a terminal
+    assert create_progress({ 'parallel': 2, 'progress': True }, StringIO()) is None
+    assert create_progress({ 'parallel': 2 }, TerminalStringIO()) is None
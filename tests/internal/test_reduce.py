@@ -0,0 +1,52 @@
+import pytest
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.reduce import create_reducer
+
+def test_00_count_distinct():
+    reducer = create_reducer('count-distinct')
+    for host, output in (('web01', '3.10.0\r\n'), ('web02', '4.18.0'), ('web03', '3.10.0')):
+        reducer.add(host, output)
+    assert reducer.format() == [ '2  3.10.0', '1  4.18.0' ]
+
+def test_01_histogram():
+    reducer = create_reducer('histogram')
+    reducer.add('web01', '0.5\n3\n')
+    reducer.add('web02', '8\nnot a number\n-1')
+    assert reducer.format() == [
+        '[-inf, 0)  1  ########################################',
+        '[0, 1)     1  ########################################',
+        '[2, 4)     1  ########################################',
+        '[8, 16)    1  ########################################',
+        '(1 lines without numbers are ignored)',
+    ]
+    reducer = create_reducer('histogram:10')
+    reducer.add('web01', '5\n15\n19')
+    assert reducer.format() == [
+        '[0, 10)   1  ####################',
+        '[10, 20)  2  ########################################',
+    ]
+
+def test_02_sum_min_max():
+    outputs = (('web01', '10\n2.5'), ('web02', '-3 days'))
+    results = []
+    for spec in ('sum', 'min', 'max'):
+        reducer = create_reducer(spec)
+        for host, output in outputs:
+            reducer.add(host, output)
+        results.append(reducer.format())
+    assert results == [ [ 'sum: 9.5 (3 values)' ], [ 'min: -3 (web02)' ], [ 'max: 10 (web01)' ] ]
+    assert create_reducer('max').format() == [ 'max: no values' ]
+
+def test_03_top():
+    reducer = create_reducer('top:2:2')
+    reducer.add('web01', '/home/a 10\n/home/b 300\n')
+    reducer.add('web02', '/home/c 20\n/home/d 300\n')
+    reducer.add('web03', '/home/e 1')
+    assert reducer.format() == [ 'web01  /home/b 300', 'web02  /home/d 300' ]
+
+def test_04_invalid_spec():
+    for spec in ('median', 'sum:1', 'top', 'top:0', 'top:1:2:3', 'histogram:-1', 'histogram:x'):
+        with pytest.raises(ValueError):
+            create_reducer(spec)
@@ -0,0 +1,111 @@
+import os
+import stat
+import time
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk import relay
+from tomahawk.constants import TimeoutError
+from tomahawk.log import create_logger
+from tomahawk.relay import (
+    RelayExecution,
+    RelayHostResult,
+    RelayResultParser,
+    group_hosts_by_relay,
+    read_relays_file,
+)
+
+# An ssh which executes a command on localhost
+FAKE_SSH = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o|-l|-p) shift 2 ;;
+    -*) shift ;;
+    *) break ;;
+  esac
+done
+FAKE_SSH_HOST=$1
+export FAKE_SSH_HOST
+shift
+exec /bin/sh -c "$*"
+"""
+
+def test_00_read_relays_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'relays')
+    f = open(path, 'w')
+    f.write("bastion1 web01 web02\n#bastion2 web03\nbastion3 web04\n")
+    f.close()
+    relays = read_relays_file(path)
+    assert relays == { 'web01': 'bastion1', 'web02': 'bastion1', 'web04': 'bastion3' }
+    groups, direct_hosts = group_hosts_by_relay([ 'web01', 'web03', 'web04', 'web02' ], relays)
+    assert groups == [ ('bastion1', [ 'web01', 'web02' ]), ('bastion3', [ 'web04' ]) ]
+    assert direct_hosts == [ 'web03' ]
+
+def test_01_parse_results():
+    parser = RelayResultParser()
+    data = b"motd\nTOMAHAWK-RELAY-RESULT 1 0 6 exited\nhello\nTOMAHAWK-RELAY-RESULT 0 143 0 timeout\n"
+    results = []
+    for i in range(len(data)):
+        results.extend(parser.feed(data[i:i + 1]))
+    assert results == [ (1, 0, False, b"hello\n"), (0, 143, True, b"") ]
+
+def install_ssh(tmpdir, monkeypatch, script):
+    ssh = os.path.join(str(tmpdir), 'ssh')
+    f = open(ssh, 'w')
+    f.write(script)
+    f.close()
+    os.chmod(ssh, stat.S_IRWXU)
+    monkeypatch.setenv('PATH', str(tmpdir) + os.pathsep + os.environ['PATH'])
+
+def test_02_relay_execution(tmpdir, monkeypatch):
+    install_ssh(tmpdir, monkeypatch, FAKE_SSH)
+
+    hosts = [ 'web01', 'web02', 'web03' ]
+    execution = RelayExecution(
+        'bastion1', hosts,
+        "/bin/sh -c 'echo \"$FAKE_SSH_HOST\"; test \"$FAKE_SSH_HOST\" != web02'",
+        [ '-l', 'tomahawk' ], 2, 10, create_logger()
+    )
+    execution.start()
+    execution.join(10)
+    results = [ RelayHostResult(execution, h) for h in hosts ]
+    assert [ r.ready() for r in results ] == [ True, True, True ]
+    assert [ r.get() for r in results ] == [ (0, 'web01'), (1, 'web02'), (0, 'web03') ]
+
+def test_03_relay_host_timeout(tmpdir, monkeypatch):
+    install_ssh(tmpdir, monkeypatch, FAKE_SSH)
+    hosts = [ 'web01', 'web02' ]
+    # exit status 124 of a command is not a timeout
+    execution = RelayExecution(
+        'bastion1', hosts,
+        "/bin/sh -c 'if [ \"$FAKE_SSH_HOST\" = web01 ]; then sleep 5; fi; exit 124'",
+        [], 2, 1, create_logger()
+    )
+    execution.start()
+    execution.join(10)
+    results = [ RelayHostResult(execution, h) for h in hosts ]
+    assert [ r.ready() for r in results ] == [ True, True ]
+    try:
+        results[0].get()
+        assert False
+    except TimeoutError:
+        pass
+    assert results[1].get() == (124, '')
+
+def test_04_relay_deadline(tmpdir, monkeypatch):
+    # a relay which never responds
+    install_ssh(tmpdir, monkeypatch, "#!/bin/sh\necho 'slow relay' >&2\nexec sleep 30\n")
+    monkeypatch.setattr(relay, 'RELAY_DEADLINE_MARGIN', 0)
+    execution = RelayExecution('bastion1', [ 'web01' ], 'uptime', [], 1, 1, create_logger())
+    started_at = time.time()
+    execution.start()
+    execution.join(10)
+    assert time.time() - started_at < 10
+    result = RelayHostResult(execution, 'web01')
+    assert result.ready()
+    try:
+        result.get()
+        assert False
+    except TimeoutError:
+        pass
+    assert execution.results['web01'][1] == 'Failed to execute through relay "bastion1": slow relay'
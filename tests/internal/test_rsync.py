@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import re
 import shutil
@@ -9,6 +10,7 @@ utils.append_home_to_path(__file__)
 from tomahawk.rsync import RsyncMain
 from tomahawk.constants import TimeoutError
 from tomahawk.expect import CommandWithExpect
+from tomahawk.pipe import CommandWithPipe
 
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
 TMP_DIR = os.path.join(utils.get_home_dir(__file__), 'tmp')
@@ -204,3 +206,171 @@ def test_21_run_option_continue_on_error(monkeypatch):
     err = stderr.stop().value()
     assert status == EXPECTED['exit_status']
     assert len(err.split('\n')) == 4
+
+def test_30_run_option_manifest(monkeypatch, tmpdir):
+    manifest = os.path.join(str(tmpdir), 'manifest')
+    f = open(manifest, 'w')
+    f.write('# deploy\n%s /tmp/a\n%s /tmp/b --checksum\n' % (hello_file, hello_file))
+    f.close()
+    executed = os.path.join(str(tmpdir), 'executed')
+
+    def mock_parse_args(self, args):
+        return utils.create_rsync_namespace(
+            manifest = manifest,
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        # executed in worker processes, so record commands with a file
+        command = ' '.join(self.expect.args)
+        f = open(executed, 'a')
+        f.write(command + '\n')
+        f.close()
+        if '127.0.0.1:/tmp/a' in command:
+            return 23, 'rsync error'
+        return 0, ''
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+    def mock_pipe_execute(self):
+        f = open(executed, 'a')
+        f.write(' '.join([ self.command ] + self.command_args) + '\n')
+        f.close()
+        return 0, ''
+    monkeypatch.setattr(CommandWithPipe, 'execute', mock_pipe_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = RsyncMain('tomahawk-rsync').run()
+    out = stdout.stop().value()
+    assert status == 1
+    assert re.search(r'/tmp/a && rsync --checksum', out)
+    assert re.search(r'rsync failed ! \(status = 23\)', out)
+    commands = open(executed).read()
+    # the 2nd entry is not executed after the 1st entry failed
+    assert not re.search(r'127\.0\.0\.1:/tmp/b', commands)
+    assert re.search(r'localhost:/tmp/b', commands)
+    assert len(re.findall(r'ControlMaster=auto', commands)) == 3
+    assert len(re.findall(r'-O exit', commands)) == 2
+
+def test_31_run_option_stats_json(monkeypatch, tmpdir):
+    stats_json = os.path.join(str(tmpdir), 'stats.json')
+    def mock_parse_args(self, args):
+        return utils.create_rsync_namespace(
+            source = hello_file,
+            destination = hello_file_copied,
+            hosts = 'localhost,127.0.0.1',
+            stats = True,
+            stats_json = stats_json,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        assert '--stats' in self.expect.args
+        return 0, """Number of files: 1
+Number of files transferred: 1
+Total file size: 11 bytes
+Total transferred file size: 11 bytes
+Literal data: 11 bytes
+Matched data: 0 bytes
+Total bytes sent: 100
+Total bytes received: 35
+
+sent 100 bytes  received 35 bytes  270.00 bytes/sec"""
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = RsyncMain('tomahawk-rsync').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r'rsync stats of 2 hosts\n  files transferred: 2 / 2', out)
+    stats = json.load(open(stats_json))
+    assert sorted(stats['hosts'].keys()) == [ '127.0.0.1', 'localhost' ]
+    assert stats['hosts']['localhost']['seconds'] == 0.5
+    assert stats['summary']['totals']['literal_bytes'] == 22
+
+def test_32_run_option_streams(monkeypatch, tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    os.makedirs(os.path.join(source, 'dir'))
+    for name, size in (('a', 300), ('b', 200), ('dir/c', 100)):
+        f = open(os.path.join(source, name), 'w')
+        f.write('x' * size)
+        f.close()
+    executed = os.path.join(str(tmpdir), 'executed')
+
+    def mock_parse_args(self, args):
+        return utils.create_rsync_namespace(
+            source = source + '/',
+            destination = '/tmp/dest/',
+            hosts = 'localhost,127.0.0.1',
+            parallel = 2,
+            streams = 2,
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        # executed in worker processes, so record file lists with a file
+        files_from = [ a for a in self.expect.args if a.startswith('--files-from=') ][0]
+        names = open(files_from[len('--files-from='):]).read().strip('\0').split('\0')
+        f = open(executed, 'a')
+        f.write('%s %s\n' % (self.expect.args[-1], ' '.join(names)))
+        f.close()
+        return 0, 'stream of %d files' % (len(names))
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    status = RsyncMain('tomahawk-rsync').run()
+    out = stdout.stop().value()
+    assert status == 0
+    assert re.search(r'% rsync -av ' + re.escape(source) + r'/ tomahawk@localhost:/tmp/dest/ \(2 streams\)', out)
+    assert re.search(r'stream of 2 files\nstream of 2 files', out)
+    assert sorted(open(executed).read().splitlines()) == [
+        'tomahawk@127.0.0.1:/tmp/dest/ a dir',
+        'tomahawk@127.0.0.1:/tmp/dest/ b dir/c',
+        'tomahawk@localhost:/tmp/dest/ a dir',
+        'tomahawk@localhost:/tmp/dest/ b dir/c',
+    ]
+
+def test_33_run_option_streams_resume(monkeypatch, tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    os.makedirs(source)
+    for name in ('a', 'b'):
+        f = open(os.path.join(source, name), 'w')
+        f.write('x' * 100)
+        f.close()
+    journal = os.path.join(str(tmpdir), 'journal')
+    executed = os.path.join(str(tmpdir), 'executed')
+    resume = [ False ]
+
+    def mock_parse_args(self, args):
+        return utils.create_rsync_namespace(
+            source = source + '/',
+            destination = '/tmp/dest/',
+            hosts = 'localhost,127.0.0.1',
+            continue_on_error = True,
+            parallel = 2,
+            streams = 2,
+            journal = journal,
+            resume = resume[0],
+        )
+    monkeypatch.setattr(argparse.ArgumentParser, 'parse_args', mock_parse_args)
+
+    def mock_execute(self):
+        f = open(executed, 'a')
+        f.write(self.expect.args[-1] + '\n')
+        f.close()
+        if '127.0.0.1' in self.expect.args[-1]:
+            return 1, 'failed'
+        return 0, 'copied'
+    monkeypatch.setattr(CommandWithExpect, 'execute', mock_execute)
+
+    stdout, stderr = utils.capture_stdout_stderr()
+    assert RsyncMain('tomahawk-rsync').run() == 1
+    stdout.stop(), stderr.stop()
+    os.remove(executed)
+
+    resume[0] = True
+    stdout, stderr = utils.capture_stdout_stderr()
+    assert RsyncMain('tomahawk-rsync').run() == 1
+    stdout.stop(), stderr.stop()
+    # the succeeded host is not executed again
+    assert sorted(set(open(executed).read().splitlines())) == [ 'tomahawk@127.0.0.1:/tmp/dest/' ]
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.shard import create_shard_command, read_items, split_items
+
+def test_00_split_items():
+    items = [ str(i) for i in range(10) ]
+    assert split_items(items, 3) == [ [ '0', '1', '2', '3' ], [ '4', '5', '6' ], [ '7', '8', '9' ] ]
+    assert split_items([ 'a' ], 3) == [ [ 'a' ], [], [] ]
+    assert sum(split_items(items, 4), []) == items
+
+def test_01_read_items(tmpdir):
+    path = os.path.join(str(tmpdir), 'items')
+    f = open(path, 'w')
+    f.write('2014-05-01\n\n2014-05-02\r\n')
+    f.close()
+    assert read_items(path) == [ '2014-05-01', '2014-05-02' ]
+
+def test_02_create_shard_command():
+    command = create_shard_command(
+        'echo "$TOMAHAWK_HOST $TOMAHAWK_SHARD_INDEX/$TOMAHAWK_SHARD_COUNT"; echo "$TOMAHAWK_SHARD_ITEMS"',
+        'web01', 1, 3, [ "it's", 'b c' ]
+    )
+    output = subprocess.check_output([ '/bin/sh', '-c', command ]).decode('utf-8')
+    assert output == "web01 1/3\nit's\nb c\n"
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.stamp import (
+    HashCache,
+    create_read_stamps_command,
+    create_stamp,
+    create_write_stamps_command,
+    parse_stamps,
+    tree_hash,
+)
+
+def write(path, content):
+    f = open(path, 'w')
+    f.write(content)
+    f.close()
+
+def test_00_tree_hash(tmpdir):
+    source = os.path.join(str(tmpdir), 'src')
+    os.makedirs(os.path.join(source, 'sub'))
+    write(os.path.join(source, 'a'), 'a')
+    write(os.path.join(source, 'sub', 'b'), 'b')
+    cache = HashCache(os.path.join(str(tmpdir), 'hashes.json'))
+    first = tree_hash(source, cache)
+    assert first == tree_hash(source, cache)
+
+    write(os.path.join(source, 'sub', 'b'), 'c')
+    os.utime(os.path.join(source, 'sub', 'b'), (0, 0))
+    second = tree_hash(source, cache)
+    assert second != first
+    os.rename(os.path.join(source, 'sub', 'b'), os.path.join(source, 'sub', 'c'))
+    assert tree_hash(source, cache) != second
+
+def test_01_hash_cache(tmpdir):
+    path = os.path.join(str(tmpdir), 'file')
+    write(path, 'content')
+    cache_file = os.path.join(str(tmpdir), 'cache', 'hashes.json')
+    cache = HashCache(cache_file)
+    expected = cache.file_hash(path, os.stat(path))
+    cache.save()
+
+    cache = HashCache(cache_file)
+    assert path in cache.entries
+    # a cached hash is used while size and mtime are the same
+    cache.entries[path][2] = 'cached'
+    assert cache.file_hash(path, os.stat(path)) == 'cached'
+    os.utime(path, (0, 0))
+    assert cache.file_hash(path, os.stat(path)) == expected
+
+def test_02_remote_stamps(tmpdir):
+    source = os.path.join(str(tmpdir), 'src')
+    write(source, 'a')
+    cache = HashCache(os.path.join(str(tmpdir), 'hashes.json'))
+    stamps = [ create_stamp(source, '/srv/a', '-av', cache), create_stamp(source, '/srv/b', '-av', cache) ]
+    assert stamps[0][0] != stamps[1][0]
+
+    def sh(command):
+        return subprocess.Popen([ '/bin/sh', '-c', command ], cwd = str(tmpdir), stdout = subprocess.PIPE).communicate()[0].decode('utf-8')
+    keys = [ k for k, v in stamps ]
+    assert parse_stamps(sh(create_read_stamps_command(keys))) == dict([ (k, '') for k in keys ])
+    sh(create_write_stamps_command(stamps[0:1]))
+    assert parse_stamps(sh(create_read_stamps_command(keys))) == { keys[0]: stamps[0][1], keys[1]: '' }
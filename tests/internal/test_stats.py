@@ -0,0 +1,86 @@
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.stats import aggregate_stats, format_summary, parse_number, parse_rsync_stats
+
+RSYNC_31_OUTPUT = """sending incremental file list
+app.tar.gz
+
+Number of files: 3 (reg: 2, dir: 1)
+Number of created files: 0
+Number of deleted files: 0
+Number of regular files transferred: 1
+Total file size: 1,048,576 bytes
+Total transferred file size: 1,048,576 bytes
+Literal data: 1,024 bytes
+Matched data: 1,047,552 bytes
+File list size: 0
+File list generation time: 0.001 seconds
+File list transfer time: 0.000 seconds
+Total bytes sent: 2,000
+Total bytes received: 500
+
+sent 2,000 bytes  received 500 bytes  1,000.00 bytes/sec
+total size is 1,048,576  speedup is 419.43"""
+
+RSYNC_30_OUTPUT = """
+Number of files: 2
+Number of files transferred: 1
+Total file size: 1.00M bytes
+Total transferred file size: 1.00M bytes
+Literal data: 1.00M bytes
+Matched data: 0 bytes
+File list size: 43
+Total bytes sent: 1.00M
+Total bytes received: 31
+
+sent 1.00M bytes  received 31 bytes  699.05K bytes/sec
+total size is 1.00M  speedup is 1.00
+"""
+
+def test_00_parse_number():
+    assert parse_number('1,234') == 1234
+    assert parse_number('1.50K') == 1536
+
+def test_01_parse_rsync_stats():
+    stats = parse_rsync_stats(RSYNC_31_OUTPUT)
+    assert stats['files'] == 3
+    assert stats['files_transferred'] == 1
+    assert stats['literal_bytes'] == 1024
+    assert stats['matched_bytes'] == 1047552
+    assert stats['seconds'] == 2.5
+    assert stats['speedup'] == 419.43
+    assert stats['literal_ratio'] == 0.001
+
+    stats = parse_rsync_stats(RSYNC_30_OUTPUT)
+    assert stats['files_transferred'] == 1
+    assert stats['literal_ratio'] == 1.0
+
+    assert parse_rsync_stats('rsync: connection unexpectedly closed') is None
+
+def test_02_parse_rsync_stats_of_manifest():
+    stats = parse_rsync_stats(RSYNC_31_OUTPUT + '\n' + RSYNC_31_OUTPUT)
+    assert stats['files_transferred'] == 2
+    assert stats['seconds'] == 5.0
+    assert stats['bytes_per_second'] == 1000.0
+
+def test_03_aggregate_stats():
+    host_stats = [
+        ('web01', parse_rsync_stats(RSYNC_31_OUTPUT)),
+        ('web02', parse_rsync_stats(RSYNC_31_OUTPUT)),
+        ('web03', parse_rsync_stats(RSYNC_30_OUTPUT)),
+    ]
+    summary = aggregate_stats(host_stats, slowest = 2)
+    assert summary['hosts'] == 3
+    assert summary['totals']['files_transferred'] == 3
+    assert [ h['host'] for h in summary['slowest_hosts'] ] == [ 'web02', 'web01' ]
+    assert summary['median_literal_ratio'] == 0.001
+    assert summary['abnormal_literal_ratio_hosts'] == [ { 'host': 'web03', 'literal_ratio': 1.0 } ]
+    assert 'web03 (100.00%)' in format_summary(summary)
+
+def test_04_parse_rsync_stats_of_streams():
+    stats = parse_rsync_stats(RSYNC_31_OUTPUT + '\n' + RSYNC_31_OUTPUT, concurrent = True)
+    assert stats['files_transferred'] == 2
+    # streams run at the same time
+    assert stats['seconds'] == 2.5
+    assert stats['bytes_per_second'] == 2000.0
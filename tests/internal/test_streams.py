@@ -0,0 +1,35 @@
+import os
+import utils
+utils.append_home_to_path(__file__)
+
+from tomahawk.streams import list_files, partition_files, write_file_lists
+
+def create_file(path, size):
+    f = open(path, 'w')
+    f.write('x' * size)
+    f.close()
+
+def test_00_list_files(tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    os.makedirs(os.path.join(source, 'dir'))
+    create_file(os.path.join(source, 'a'), 10)
+    create_file(os.path.join(source, 'dir', 'b'), 20)
+    os.symlink('a', os.path.join(source, 'link'))
+
+    base, files = list_files(source + '/')
+    assert base == source + '/'
+    assert sorted(files) == [ ('a', 10), ('dir', 0), ('dir/b', 20), ('link', 0) ]
+    # without a trailing slash, the directory itself is transferred
+    base, files = list_files(source)
+    assert base == str(tmpdir)
+    assert sorted(files) == [ ('source', 0), ('source/a', 10), ('source/dir', 0), ('source/dir/b', 20), ('source/link', 0) ]
+
+def test_01_partition_files():
+    files = [ ('dir', 0), ('a', 70), ('b', 50), ('c', 40), ('d', 30), ('e', 10) ]
+    assert partition_files(files, 2) == [ [ 'a', 'd', 'dir' ], [ 'b', 'c', 'e' ] ]
+    # empty partitions are removed
+    assert partition_files([ ('a', 1) ], 3) == [ [ 'a' ] ]
+
+def test_02_write_file_lists(tmpdir):
+    paths = write_file_lists([ [ 'a', 'new\nline' ], [ 'b' ] ], str(tmpdir))
+    assert [ open(p, 'rb').read() for p in paths ] == [ b'a\0new\nline\0', b'b\0' ]
@@ -4,7 +4,9 @@ import utils
 utils.append_home_to_path(__file__)
 
 from tomahawk.utils import (
-    get_options_from_conf
+    get_options_from_conf,
+    raise_file_limit,
+    wait_writable,
 )
 
 def test_00_get_options_from_conf(tmpdir):
@@ -33,3 +35,17 @@ def test_01_get_options_from_conf_no_options(tmpdir):
     conf_options = get_options_from_conf('tomahawk', path)
     assert conf_options == []
 
+
+def test_02_wait_writable_large_fd():
+    # fds over FD_SETSIZE (1024) cannot be passed to select()
+    limit = raise_file_limit(2048)
+    if limit is not None and limit < 2048:
+        return
+    r, w = os.pipe()
+    large = os.dup2(w, 1500)
+    try:
+        assert wait_writable([ large ], 1) == [ large ]
+    finally:
+        os.close(large)
+        os.close(r)
+        os.close(w)
@@ -128,6 +128,12 @@ class MockPexpect(object):
     def close(self):
         pass
 
+    def isalive(self):
+        return False
+
+    def wait(self):
+        return self._exitstatus
+
     def get_exitstatus(self):
         return self._exitstatus
 
@@ -8,4 +8,21 @@ __version__ = '0.7.2'
 __maintainer__ = 'Kazuhiro Oinuma'
 __status__ = 'Production/Stable'
 
-__all__ = [ 'TimeoutError', 'CommandError', 'FatalError' ]
+__all__ = [ 'TimeoutError', 'CommandError', 'FatalError', 'run', 'run_async' ]
+
+# tomahawk.api is imported lazily because setup.py imports this module
+# before dependencies are installed.
+def run(hosts, command, **options):
+    """
+    Execute a command on hosts and yield results as hosts complete.
+    See tomahawk.api.run
+    """
+    from tomahawk.api import run
+    return run(hosts, command, **options)
+
+def run_async(hosts, command, **options):
+    """
+    asyncio counterpart of run. See tomahawk.api.run_async
+    """
+    from tomahawk.api import run_async
+    return run_async(hosts, command, **options)
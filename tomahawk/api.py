@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Python API to execute commands on hosts without the command line interface.
+
+  import tomahawk
+  for result in tomahawk.run([ 'web01', 'web02' ], 'uptime', parallel = 2):
+      print(result.host, result.exit_status, result.output)
+
+It doesn't touch sys.argv, sys.stdout and the exit status of the process.
+"""
+import logging
+
+from six import string_types
+from six.moves import StringIO
+
+from tomahawk.command import CommandContext, CommandExecutor, CommandMain
+
+# options only for the command line interface
+CLI_OPTIONS = (
+    'hosts', 'hosts_files', 'command', 'conf', 'profile', 'output_format',
+    'prompt_login_password', 'login_password_stdin',
+    'prompt_sudo_password', 'sudo_password_stdin',
+    'verify_output', 'breaker_report', 'reduce',
+    # not supported because results are collected by the API and stdin is not read
+    'gather', 'script', 'stdin_file',
+)
+# passed to CommandExecutor as keyword arguments
+EXECUTOR_ARGUMENTS = ( 'login_password', 'sudo_password', 'process_pool' )
+
+class Result(object):
+    """
+    A result of a command on a host.
+    """
+    def __init__(self, host, command, exit_status, output, timed_out = False, attempts = 1):
+        self.host = host
+        self.command = command
+        self.exit_status = exit_status
+        self.output = output
+        self.timed_out = timed_out
+        self.attempts = attempts
+
+    @property
+    def succeeded(self):
+        return self.exit_status == 0 and not self.timed_out
+
+    def __repr__(self):
+        return 'Result(host=%r, command=%r, exit_status=%r, timed_out=%r)' \
+            % (self.host, self.command, self.exit_status, self.timed_out)
+
+def default_options():
+    """
+    Returns: a dict of default values of tomahawk command line options
+    """
+    parser = CommandMain.create_argument_parser('tomahawk')
+    options = vars(parser.parse_args([]))
+    for name in CLI_OPTIONS:
+        options.pop(name, None)
+    return options
+
+def create_options(hosts, options):
+    """
+    Returns: (options of CommandContext, keyword arguments of CommandExecutor)
+    """
+    if isinstance(hosts, string_types):
+        raise TypeError('hosts must be a list of host names')
+    if len(hosts) == 0:
+        raise ValueError('hosts must not be empty')
+
+    context_options = default_options()
+    kwargs = {}
+    for name, value in options.items():
+        if name in EXECUTOR_ARGUMENTS:
+            kwargs[name] = value
+        elif name in context_options:
+            context_options[name] = value
+        else:
+            raise TypeError('Unknown option "%s"' % (name))
+    # results are always returned for all hosts
+    context_options['continue_on_error'] = True
+    context_options['parallel'] = min(context_options['parallel'], len(hosts))
+    return context_options, kwargs
+
+def run(hosts, command, **options):
+    """
+    Execute a command on hosts.
+
+    Args:
+    hosts -- a list of host names
+    command -- a command or a list of commands
+    options -- options of tomahawk command (e.g. parallel = 10, timeout = 30, ssh_user = 'deploy'),
+      login_password, sudo_password and process_pool
+
+    Returns: a generator of Result in order of completion, or in order of hosts with order = 'input'
+    """
+    if isinstance(command, string_types):
+        commands = [ command ]
+    else:
+        commands = list(command)
+    context_options, kwargs = create_options(list(hosts), options)
+    return _iterate_results(list(hosts), commands, context_options, kwargs)
+
+def _iterate_results(hosts, commands, options, kwargs):
+    out = StringIO()
+    context = CommandContext(commands, options, out, out)
+    executor = CommandExecutor(context, logging.getLogger('tomahawk'), hosts, **kwargs)
+    try:
+        async_results = executor.submit_commands(commands)
+        for entry, exit_status, output, timeout_detail in executor.wait_results(async_results):
+            if timeout_detail is not None:
+                output = timeout_detail
+            yield Result(
+                entry['host'], entry['command'], exit_status, output,
+                timeout_detail is not None, entry['attempts']
+            )
+    finally:
+        executor.finish_execution()
+        executor.terminate_processes()
+
+class AsyncResults(object):
+    """
+    Results of run_async. Results are waited in a thread of the default executor of the event loop.
+
+      async for result in tomahawk.run_async(hosts, 'uptime'):
+          ...
+    """
+    def __init__(self, results):
+        self.results = results
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        return asyncio.get_event_loop().run_in_executor(None, self._next)
+
+    def _next(self):
+        try:
+            return next(self.results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def aclose(self):
+        """
+        Stop executing commands on hosts which are not finished.
+        """
+        import asyncio
+        return asyncio.get_event_loop().run_in_executor(None, self.results.close)
+
+def run_async(hosts, command, **options):
+    """
+    asyncio counterpart of run. (Python 3.5 or later)
+
+    Returns: AsyncResults which is iterated with "async for"
+    """
+    return AsyncResults(run(hosts, command, **options))
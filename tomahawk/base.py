@@ -1,27 +1,48 @@
 # -*- coding: utf-8 -*-
 import multiprocessing
 import os
+import random
 import re
 import platform
+import socket
 from six import print_
 import string
 import sys
+import time
 
 from tomahawk import (
     __version__,
     TimeoutError,
 )
+from tomahawk.breaker import CircuitBreaker
 from tomahawk.color import (
     create_coloring_object
 )
 from tomahawk.constants import (
+    CONNECTION_ERROR_EXIT_STATUS,
+    DEFAULT_BREAKER_FILE,
+    DEFAULT_BREAKER_THRESHOLD,
+    DEFAULT_BREAKER_TTL,
     DEFAULT_TIMEOUT,
     DEFAULT_COMMAND_OUTPUT_FORMAT,
     DEFAULT_EXPECT_DELAY,
     DEFAULT_EXPECT_ENCODING,
+    DEFAULT_MAX_TASKS_PER_CHILD,
+    DEFAULT_PREFLIGHT_PORT,
+    DEFAULT_PREFLIGHT_TIMEOUT,
+    DEFAULT_REORDER_BUFFER,
+    DEFAULT_RETRY_BACKOFF,
+    MAX_RETRY_BACKOFF,
     OUTPUT_FORMAT_CONTROLL_CHARS,
+    POLL_INTERVAL,
 )
+from tomahawk.journal import Journal, read_succeeded_results
 from tomahawk.log import create_logger
+from tomahawk.metrics import Metrics, parse_address
+from tomahawk.pool import create_process_pool
+from tomahawk.preflight import probe_hosts
+from tomahawk.progress import Progress
+from tomahawk.reduce import create_reducer
 from tomahawk.utils import (
     check_hosts,
     get_options_from_conf,
@@ -52,6 +73,14 @@ class BaseMain(object):
             # Re-parse command line options because conf_options added
             self.options = self.arg_parser.parse_args(args)
 
+        if getattr(self.options, 'resume', False) and not getattr(self.options, 'journal', None):
+            self.arg_parser.error('--resume requires --journal')
+        if getattr(self.options, 'statsd', None):
+            try:
+                parse_address(self.options.statsd)
+            except ValueError:
+                self.arg_parser.error('--statsd requires HOST:PORT')
+
         self.log = create_logger(
             None,
             self.options.debug or self.options.deep_debug,
@@ -84,6 +113,24 @@ class BaseMain(object):
     def check_hosts(self):
         return check_hosts(self.options.__dict__, self.log, self.arg_parser.format_usage)
 
+    def report_circuit_breaker(self):
+        """
+        Print hosts suppressed by the circuit breaker.
+        """
+        options = self.options
+        breaker = CircuitBreaker(
+            options.breaker_file, options.breaker_threshold,
+            options.breaker_ttl, self.log
+        )
+        suppressed = breaker.suppressed_hosts()
+        if len(suppressed) == 0:
+            print_('No hosts are suppressed by the circuit breaker.')
+            return 0
+        print_('Following hosts are suppressed by the circuit breaker.')
+        for host, failures, remaining in suppressed:
+            print_('  %s (%d failures, retry after %d seconds)' % (host, failures, remaining))
+        return 0
+
     def confirm_execution_on_production(self, message):
         if os.environ.get('TOMAHAWK_ENV') != 'production':
             return
@@ -139,7 +186,91 @@ class BaseMain(object):
         )
         parser.add_argument(
             '--expect-delay', type=float, default=DEFAULT_EXPECT_DELAY,
-            help='Expect delay time in seconds. (default: 0.05)'
+            help='DEPRECATED. Not used any more. (Will be deleted in v0.8.0)'
+        )
+        parser.add_argument(
+            '--forkserver', action='store_true', default=False,
+            help='Create worker processes from a forkserver which preloads tomahawk and pexpect.'
+        )
+        parser.add_argument(
+            '--max-tasks-per-child', metavar='NUM', type=int, default=None,
+            help='Recycle a worker process after it executes NUM tasks. (default: %d with --forkserver)' % (DEFAULT_MAX_TASKS_PER_CHILD)
+        )
+        parser.add_argument(
+            '--no-pty', action='store_true', default=False,
+            help='Execute through pipes without pty and expect when no password is required.'
+        )
+        parser.add_argument(
+            '--preflight', action='store_true', default=False,
+            help='Probe ssh port of all hosts before execution and skip unreachable hosts.'
+        )
+        parser.add_argument(
+            '--preflight-port', metavar='PORT', type=int, default=DEFAULT_PREFLIGHT_PORT,
+            help='Port number probed by --preflight. (default: %d)' % (DEFAULT_PREFLIGHT_PORT)
+        )
+        parser.add_argument(
+            '--preflight-timeout', metavar='SECONDS', type=float, default=DEFAULT_PREFLIGHT_TIMEOUT,
+            help='Timeout in seconds for --preflight. (default: %d)' % (DEFAULT_PREFLIGHT_TIMEOUT)
+        )
+        parser.add_argument(
+            '--retries', metavar='NUM', type=int, default=0,
+            help='Retry NUM times when connecting to a host failed. (default: 0)'
+        )
+        parser.add_argument(
+            '--retry-backoff', metavar='SECONDS', type=float, default=DEFAULT_RETRY_BACKOFF,
+            help='Initial delay of retries, doubled for each retry. (default: %s)' % (DEFAULT_RETRY_BACKOFF)
+        )
+        parser.add_argument(
+            '--progress', action='store_true', default=False,
+            help='Show a progress line on stderr when it is a terminal.'
+        )
+        parser.add_argument(
+            '--order', choices=('completion', 'input'), default='completion',
+            help='Print results as hosts complete, or in order of hosts. (default: completion)'
+        )
+        parser.add_argument(
+            '--reorder-buffer', metavar='NUM', type=int, default=DEFAULT_REORDER_BUFFER,
+            help='Max number of hosts executed ahead of the first unfinished host with --order=input. (default: %d)' % (DEFAULT_REORDER_BUFFER)
+        )
+        parser.add_argument(
+            '--journal', metavar='FILE', default=None,
+            help='Append a result of each host to FILE as it completes.'
+        )
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip hosts which already succeeded in --journal FILE.'
+        )
+        parser.add_argument(
+            '--metrics-textfile', metavar='FILE', default=None,
+            help='Write metrics of the run to FILE in Prometheus text format.'
+        )
+        parser.add_argument(
+            '--statsd', metavar='HOST:PORT', default=None,
+            help='Send metrics of the run to a StatsD server with UDP.'
+        )
+        parser.add_argument(
+            '--circuit-breaker', action='store_true', default=False,
+            help='Skip hosts which failed to connect repeatedly in previous runs.'
+        )
+        parser.add_argument(
+            '--breaker-file', metavar='FILE', default=DEFAULT_BREAKER_FILE,
+            help='State file of the circuit breaker. (default: %s)' % (DEFAULT_BREAKER_FILE)
+        )
+        parser.add_argument(
+            '--breaker-threshold', metavar='NUM', type=int, default=DEFAULT_BREAKER_THRESHOLD,
+            help='Number of connection failures to suppress a host. (default: %d)' % (DEFAULT_BREAKER_THRESHOLD)
+        )
+        parser.add_argument(
+            '--breaker-ttl', metavar='SECONDS', type=int, default=DEFAULT_BREAKER_TTL,
+            help='Seconds to suppress a host. (default: %d)' % (DEFAULT_BREAKER_TTL)
+        )
+        parser.add_argument(
+            '--breaker-force', action='store_true', default=False,
+            help='Execute on suppressed hosts after other hosts.'
+        )
+        parser.add_argument(
+            '--breaker-report', action='store_true', default=False,
+            help='Show hosts suppressed by the circuit breaker and exit.'
         )
         parser.add_argument(
             '-C', '--conf', metavar='FILE', default=None,
@@ -164,10 +295,27 @@ class BaseMain(object):
         )
         return parser
 
+class FinishedResult(object):
+    """
+    A result which is available without executing a process.
+    It behaves like multiprocessing.pool.AsyncResult.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self, timeout = None):
+        return self.value
+
 class BaseExecutor(object):
     """
     A base class for CommandExecutor, RsyncExecutor
     """
+    # a label of metrics. e.g. "command", "rsync"
+    metrics_name = None
+
     def __init__(self, context, log, hosts=[], **kwargs):
         """
         Constructor
@@ -176,6 +324,8 @@ class BaseExecutor(object):
         context -- context
         log -- log
         hosts -- target hosts
+        process_pool -- (optional) a process pool shared with other executors.
+                        e.g. tomahawk.pool.get_shared_pool(). It isn't terminated by the executor.
         """
         self.processes_terminated = False
         if context is None:
@@ -208,14 +358,362 @@ class BaseExecutor(object):
         self.context = context
         self.log = log
         self.hosts = hosts
+        # hosts in the given order, which is not changed by --breaker-force
+        self.given_hosts = list(hosts)
         self.login_password = login_password
         self.sudo_password = sudo_password
+        # Passwords need expect to answer prompts
+        self.use_pipe = bool(options.get('no_pty')) \
+            and login_password is None and sudo_password is None
         self.raise_error = True
-        if options.get('continue_on_error'):
+        if options.get('continue_on_error') or options.get('reduce'):
+            # --reduce needs results of all hosts to aggregate them
             self.raise_error = False
-        self.process_pool = multiprocessing.Pool(processes = options.get('parallel', 1))
+        # with --order=input, commands are submitted only within this window from
+        # the first unfinished host, so the reorder buffer is bounded
+        self.submit_window = None
+        if options.get('order') == 'input':
+            self.submit_window = max(1, options.get('reorder_buffer') or DEFAULT_REORDER_BUFFER)
+        self.pipeline = bool(options.get('pipeline'))
+        # max number of tasks submitted to the process pool at once, or None for no limit.
+        # with --pipeline, commands are submitted only when a worker is free,
+        # so a next step of a host doesn't wait for steps of other hosts queued before it
+        self.max_running = None
+        if self.pipeline:
+            self.max_running = options.get('parallel') or 1
+        self.circuit_breaker = None
+        self.suppressed_hosts = set()
+        # set by sub classes which support caching results
+        self.result_cache = None
+        self.cache_ssh_options = None
+        # command -> command in the cache key, if the result depends on more than the command
+        self.cache_commands = {}
+        # (host, command) whose results are replayed from the journal or the cache
+        self.replayed_results = set()
+        self.journal = None
+        self.resumed_results = {}
+        if options.get('journal'):
+            if options.get('resume'):
+                self.resumed_results = read_succeeded_results(options['journal'])
+            self.journal = Journal(options['journal'])
+        if options.get('circuit_breaker'):
+            self.circuit_breaker = CircuitBreaker(
+                options.get('breaker_file') or DEFAULT_BREAKER_FILE,
+                options.get('breaker_threshold') or DEFAULT_BREAKER_THRESHOLD,
+                options.get('breaker_ttl') or DEFAULT_BREAKER_TTL,
+                log
+            )
+            self.apply_circuit_breaker()
+        self.metrics = None
+        if options.get('metrics_textfile') or options.get('statsd'):
+            try:
+                self.metrics = Metrics(self.metrics_name, options.get('metrics_textfile'), options.get('statsd'))
+            except (ValueError, socket.error):
+                raise RuntimeError('[error] Cannot send metrics to StatsD: ' + str(sys.exc_info()[1]))
+        # submitted tasks and times when tasks of the process pool are finished,
+        # to estimate when each task is started by a worker
+        self.submissions = 0
+        self.pool_completions = []
+        if kwargs.get('process_pool') is not None:
+            self.process_pool = kwargs['process_pool']
+            self.owns_process_pool = False
+        else:
+            max_tasks_per_child = options.get('max_tasks_per_child')
+            if options.get('forkserver') and max_tasks_per_child is None:
+                max_tasks_per_child = DEFAULT_MAX_TASKS_PER_CHILD
+            self.process_pool = create_process_pool(
+                options.get('parallel', 1),
+                options.get('forkserver', False),
+                max_tasks_per_child
+            )
+            self.owns_process_pool = True
+
+    def apply_circuit_breaker(self):
+        """
+        Find hosts suppressed by the circuit breaker.
+        With --breaker-force, suppressed hosts are executed after other hosts.
+        """
+        suppressed = [ h for h in self.hosts if self.circuit_breaker.is_suppressed(h) ]
+        if len(suppressed) == 0:
+            return
+        self.log.debug("circuit breaker: suppressed hosts = %s" % (str(suppressed)))
+        if self.context.options.get('breaker_force'):
+            self.hosts = [ h for h in self.hosts if h not in suppressed ] + suppressed
+        else:
+            self.suppressed_hosts = set(suppressed)
+
+    def submit(self, host, command, func, args, wrapper = None):
+        """
+        Execute func with args in the process pool.
+        wrapper converts an AsyncResult (e.g. DigestResult) if specified.
+
+        Returns: an entry of async_results given to process_async_results
+        """
+        entry = {
+            'host': host,
+            'command': command,
+            'func': func,
+            'args': args,
+            'wrapper': wrapper,
+            'attempts': 0,
+        }
+        if self.submit_window is None and self.max_running is None:
+            self.resubmit(entry)
+        else:
+            # submitted by wait_results when it enters the window
+            entry['async_result'] = None
+            entry['deferred'] = True
+        return entry
 
-    def process_async_results(
+    def resubmit(self, entry):
+        async_result = self.process_pool.apply_async(entry['func'], entry['args'])
+        if entry['wrapper'] is not None:
+            async_result = entry['wrapper'](async_result)
+        entry['async_result'] = async_result
+        entry['attempts'] += 1
+        entry['submission'] = self.submissions
+        entry['submitted_at'] = time.time()
+        self.submissions += 1
+
+    def execution_seconds(self, entry):
+        """
+        Estimate execution time of the last attempt of entry, excluding time waiting for a worker.
+        Workers of the process pool take tasks in order of submission, so the N-th task
+        is started when a worker finishes the (N - parallel)-th task.
+
+        Returns: seconds or None if entry is not executed in the process pool
+        """
+        if 'submission' not in entry:
+            return None
+        started_at = entry['submitted_at']
+        previous = entry['submission'] - (self.context.options.get('parallel') or 1)
+        if 0 <= previous < len(self.pool_completions):
+            started_at = max(started_at, self.pool_completions[previous])
+        return max(0.0, entry['finished_at'] - started_at)
+
+    def is_transient_failure(self, exit_status):
+        """
+        Returns: True if exit_status means a connection-level failure, not a failure of a command
+        """
+        return exit_status == CONNECTION_ERROR_EXIT_STATUS
+
+    def retry_delay(self, attempts):
+        """
+        Exponential backoff with jitter.
+
+        Returns: seconds until the next attempt
+        """
+        backoff = self.context.options.get('retry_backoff')
+        if backoff is None:
+            backoff = DEFAULT_RETRY_BACKOFF
+        delay = min(MAX_RETRY_BACKOFF, backoff * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def find_resumed_result(self, host, command):
+        """
+        Returns: a succeeded result in the journal when --resume is specified, or None
+        """
+        result = self.resumed_results.get((host, command))
+        if result is not None:
+            self.replayed_results.add((host, command))
+        return result
+
+    def find_skipped_hosts(self, preflight_hosts = None):
+        """
+        Find hosts which are not executed because of the circuit breaker or --preflight.
+
+        Args:
+        preflight_hosts -- hosts probed by --preflight. (default: all hosts)
+
+        Returns: a dict which maps a skipped host to (exit_status, error message)
+        """
+        skipped = {}
+        for host in self.suppressed_hosts:
+            skipped[host] = (
+                CONNECTION_ERROR_EXIT_STATUS,
+                'Skipped by the circuit breaker. Use --breaker-force to execute.'
+            )
+
+        options = self.context.options
+        if not options.get('preflight'):
+            return skipped
+        if preflight_hosts is None:
+            preflight_hosts = self.hosts
+        unreachable = probe_hosts(
+            [ h for h in preflight_hosts if h not in skipped ],
+            options.get('preflight_port') or DEFAULT_PREFLIGHT_PORT,
+            options.get('preflight_timeout') or DEFAULT_PREFLIGHT_TIMEOUT
+        )
+        for host in sorted(unreachable.keys()):
+            self.log.debug("preflight: %s" % (unreachable[host]))
+            skipped[host] = (CONNECTION_ERROR_EXIT_STATUS, unreachable[host])
+        return skipped
+
+    def record_result(self, host, command, exit_status, command_output, timed_out):
+        """
+        Called when execution on a host is finished.
+        """
+        if (host, command) in self.replayed_results:
+            # not executed actually
+            return
+        if self.journal:
+            self.journal.append(host, command, exit_status, command_output, timed_out)
+        if self.circuit_breaker and host not in self.suppressed_hosts:
+            self.circuit_breaker.record(host, exit_status, timed_out)
+        if self.result_cache and not timed_out:
+            self.result_cache.put(
+                host, self.cache_commands.get(command, command), self.cache_ssh_options,
+                exit_status, command_output
+            )
+
+    def finish_execution(self):
+        """
+        Called when process_async_results is finished or interrupted.
+        """
+        if self.circuit_breaker:
+            self.circuit_breaker.save()
+        if self.result_cache:
+            self.result_cache.evict()
+        if self.journal:
+            self.journal.close()
+        if self.metrics:
+            self.metrics.close()
+
+    def wait_results(self, async_results):
+        """
+        Wait results in async_results and yield them as hosts complete.
+        With --order=input, results are yielded in order of async_results through
+        a reorder buffer, which is flushed as soon as the first unfinished entry completes.
+        An entry with 'after' (the previous step of a pipeline on the host) is submitted
+        after the previous step succeeded, and skipped when it failed.
+        Failures to connect are retried with --retries.
+
+        Returns: a generator of (entry of async_results, exit_status, command_output, timeout_detail)
+        """
+        options = self.context.options
+        timeout = options.get('timeout', DEFAULT_TIMEOUT)
+        retries = options.get('retries') or 0
+        for index, dict in enumerate(async_results):
+            dict['index'] = index
+        progress = self.create_progress(len(async_results))
+        # tasks being executed or waiting for a worker in the process pool
+        running = len([ d for d in async_results if 'submission' in d and d['async_result'] is not None ])
+        # index of the first entry which is not yielded yet
+        head = 0
+        # index -> a result, or None for a skipped step of a pipeline
+        reorder_buffer = {}
+        try:
+            while len(async_results) > 0:
+                finished = False
+                for dict in list(async_results):
+                    host = dict['host']
+                    async_result = dict['async_result']
+                    if async_result is None:
+                        after = dict.get('after')
+                        if after is not None and after.get('succeeded') is False:
+                            # a previous step of the pipeline failed on the host
+                            async_results.remove(dict)
+                            finished = True
+                            dict['succeeded'] = False
+                            reorder_buffer[dict['index']] = None
+                            if progress is not None:
+                                progress.total -= 1
+                        elif dict.get('deferred'):
+                            if (after is None or after.get('succeeded')) \
+                                    and (self.submit_window is None or dict['index'] < head + self.submit_window) \
+                                    and (self.max_running is None or running < self.max_running):
+                                dict['deferred'] = False
+                                self.resubmit(dict)
+                                running += 1
+                        elif time.time() >= dict['retry_at'] \
+                                and (self.max_running is None or running < self.max_running):
+                            # waiting for a retry
+                            self.resubmit(dict)
+                            running += 1
+                        continue
+                    if not async_result.ready():
+                        continue
+                    if 'submission' in dict and 'finished_at' not in dict:
+                        dict['finished_at'] = time.time()
+                        self.pool_completions.append(dict['finished_at'])
+                        running -= 1
+
+                    exit_status = 1
+                    command_output = ''
+                    timeout_detail = None
+                    try:
+                        exit_status, command_output = async_result.get(timeout = timeout)
+                        self.log.debug("host = %s, exit_status = %d" % (host, exit_status))
+                    except (TimeoutError, multiprocessing.TimeoutError):
+                        error = sys.exc_info()[1]
+                        timeout_detail = str(error)
+
+                    dict.setdefault('attempts', 1)
+                    if timeout_detail is None and 'func' in dict \
+                            and dict['attempts'] <= retries \
+                            and self.is_transient_failure(exit_status):
+                        delay = self.retry_delay(dict['attempts'])
+                        self.log.debug("host = %s, retry after %.2f seconds" % (host, delay))
+                        dict['async_result'] = None
+                        dict['retry_at'] = time.time() + delay
+                        del dict['finished_at']
+                        continue
+
+                    async_results.remove(dict)
+                    finished = True
+                    dict['succeeded'] = exit_status == 0 and timeout_detail is None
+                    self.record_result(host, dict['command'], exit_status, command_output, timeout_detail is not None)
+                    if progress is not None:
+                        progress.finished(dict['succeeded'])
+                    if self.metrics is not None and (host, dict['command']) not in self.replayed_results:
+                        self.metrics.observe(
+                            exit_status, timeout_detail is not None,
+                            self.execution_seconds(dict), command_output
+                        )
+                    result = (dict, exit_status, command_output, timeout_detail)
+                    if options.get('order') != 'input':
+                        if progress is not None:
+                            progress.clear()
+                        yield result
+                    else:
+                        reorder_buffer[dict['index']] = result
+
+                while head in reorder_buffer:
+                    result = reorder_buffer.pop(head)
+                    head += 1
+                    if result is not None:
+                        if progress is not None:
+                            progress.clear()
+                        yield result
+                if progress is not None:
+                    progress.update(running)
+                if self.metrics is not None:
+                    self.metrics.update()
+                if not finished:
+                    time.sleep(POLL_INTERVAL)
+        finally:
+            if progress is not None:
+                progress.clear()
+
+    def create_progress(self, total):
+        """
+        Returns: Progress with --progress, or None if it's disabled or stderr is not a terminal
+        """
+        options = self.context.options
+        err = self.context.err
+        if not options.get('progress'):
+            return None
+        if not hasattr(err, 'isatty') or not err.isatty():
+            return None
+        return Progress(err, total, options.get('parallel') or 1)
+
+    def process_async_results(self, async_results, *callbacks):
+        try:
+            return self._process_async_results(async_results, *callbacks)
+        finally:
+            self.finish_execution()
+
+    def _process_async_results(
         self,
         async_results,
         create_output,
@@ -228,77 +726,85 @@ class BaseExecutor(object):
         out, err = self.context.out, self.context.err
         color = create_coloring_object(out)
         options = self.context.options
-        hosts_count = len(self.hosts)
-        finished = 0
         error_hosts_count = 0
         output_format_template = string.Template(self.output_format(options.get('output_format', DEFAULT_COMMAND_OUTPUT_FORMAT)))
         timeout = options.get('timeout', DEFAULT_TIMEOUT)
         error_prefix = color.red(color.bold('[error]')) # insert newline for error messages
 
         execution_info = {}
-        # Main loop continues until all processes are done
-        while finished < hosts_count:
-            for dict in async_results:
-                host = dict['host']
-                command = dict['command']
-                async_result = dict['async_result']
-                if not async_result.ready():
-                    continue
-
-                exit_status = 1
-                command_output = ''
-                timeout_detail = None
-                try:
-                    exit_status, command_output = async_result.get(timeout = timeout)
-                    self.log.debug("host = %s, exit_status = %d" % (host, exit_status))
-                except (TimeoutError, multiprocessing.TimeoutError):
-                    error = sys.exc_info()[1]
-                    timeout_detail = str(error)
-                    execution_info[host] = { 'timeout': 1 }
-                async_results.remove(dict)
-                finished += 1
-
-                output = create_output(color, output_format_template, command, host, exit_status, command_output)
+        # command -> a reducer of --reduce, which folds output of succeeded hosts
+        reducers = {}
+        reduced_commands = []
+        for dict, exit_status, command_output, timeout_detail in self.wait_results(async_results):
+            host = dict['host']
+            command = dict['command']
+            attempts = dict['attempts']
+            if options.get('reduce') and exit_status == 0 and timeout_detail is None:
+                if command not in reducers:
+                    reducers[command] = create_reducer(options['reduce'])
+                    reduced_commands.append(command)
+                reducers[command].add(host, command_output)
+                # output is not kept
                 execution_info[host] = {
                     'exit_status': exit_status,
-                    'command_output': command_output,
+                    'command_output': None,
                     'timeout': False,
+                    'attempts': attempts,
                 }
-                if command_output == '':
-                    # if command_output is empty, chomp last newline character for ugly output
-                    output = re.sub(os.linesep + r'\Z', '', output)
+                continue
+            output = create_output(color, output_format_template, command, host, exit_status, command_output)
+            execution_info[host] = {
+                'exit_status': exit_status,
+                'command_output': command_output,
+                'timeout': False,
+                'attempts': attempts,
+            }
+            if command_output == '':
+                # if command_output is empty, chomp last newline character for ugly output
+                output = re.sub(os.linesep + r'\Z', '', output)
+            if attempts > 1:
+                if not output.endswith('\n'):
+                    output += '\n'
+                output += '(%d attempts)\n' % (attempts)
 
-                if exit_status == 0:
-                    print_(output, file=out)
-                elif timeout_detail is not None:
+            if exit_status == 0:
+                print_(output, file=out)
+            elif timeout_detail is not None:
+                print_('%s %s\n' % (
+                    error_prefix,
+                    create_timeout_message(color, output, timeout)
+                ), file=out)
+                execution_info[host]['timeout'] = True
+                error_hosts_count += 1
+                if self.raise_error:
                     print_('%s %s\n' % (
                         error_prefix,
-                        create_timeout_message(color, output, timeout)
-                    ), file=out)
-                    execution_info[host]['timeout'] = True
-                    error_hosts_count += 1
-                    if self.raise_error:
-                        print_('%s %s\n' % (
-                            error_prefix,
-                            create_timeout_raise_error_message(color, command, host, timeout)
-                        ), file=err)
-                        return 1
-                else:
-                    print_('%s %s\n' % (
+                        create_timeout_raise_error_message(color, command, host, timeout)
+                    ), file=err)
+                    return 1
+            else:
+                print_('%s %s\n' % (
+                    error_prefix,
+                    create_failure_message(color, output, exit_status)
+                ), file=out)
+                error_hosts_count += 1
+                if self.raise_error:
+                    print_('%s %s' % (
                         error_prefix,
-                        create_failure_message(color, output, exit_status)
-                    ), file=out)
-                    error_hosts_count += 1
-                    if self.raise_error:
-                        print_('%s %s' % (
-                            error_prefix,
-                            create_failure_raise_error_message(color, command, host)
-                        ), file=err)
-                        return 1
+                        create_failure_raise_error_message(color, command, host)
+                    ), file=err)
+                    return 1
         
         # Free process pool
         self.terminate_processes()
 
+        for command in reduced_commands:
+            reducer = reducers[command]
+            print_('%s (%s of %d hosts)' % (
+                color.green(command), options['reduce'], reducer.hosts
+            ), file=out)
+            print_('\n'.join(reducer.format()) + '\n', file=out)
+
         if error_hosts_count > 0:
             hosts = ''
             for h in self.hosts:
@@ -311,26 +817,36 @@ class BaseExecutor(object):
             ), file=err)
             return 1
 
-        if options.get('verify_output'):
-            has_different_output = False
-            prev_output = None
-            hosts = ''
-            for h in self.hosts:
-                output = execution_info[h]['command_output']
-                self.log.debug("host: '%s', prev_output: '%s', output = '%s'" % (h, prev_output, output))
-                if prev_output != None and output != prev_output:
-                    hosts += '  %s\n' % (h)
-                    has_different_output = True
-                prev_output = output
-            hosts = hosts.rstrip()
+        if options.get('verify_output') or options.get('digest'):
+            return self.verify_outputs(execution_info, color, error_prefix)
 
-            if has_different_output:
-                print_("%s Detected different command output on following hosts.\n%s" \
-                    % (color.red(error_prefix), hosts), file=err)
-                return 3
-            else:
-                print_(color.green('Verified output of all hosts.'), file=out)
+        return 0
+
+    def verify_outputs(self, execution_info, color, error_prefix):
+        """
+        Verify command output of all hosts is the same.
+
+        Returns: 0 when verified, 3 when different output detected
+        """
+        out, err = self.context.out, self.context.err
+        has_different_output = False
+        prev_output = None
+        hosts = ''
+        for h in self.hosts:
+            output = execution_info[h]['command_output']
+            self.log.debug("host: '%s', prev_output: '%s', output = '%s'" % (h, prev_output, output))
+            if prev_output != None and output != prev_output:
+                hosts += '  %s\n' % (h)
+                has_different_output = True
+            prev_output = output
+        hosts = hosts.rstrip()
 
+        if has_different_output:
+            print_("%s Detected different command output on following hosts.\n%s" \
+                % (color.red(error_prefix), hosts), file=err)
+            return 3
+        else:
+            print_(color.green('Verified output of all hosts.'), file=out)
         return 0
 
     def output_format(self, format):
@@ -354,6 +870,9 @@ class BaseExecutor(object):
         return ''.join(seq)
 
     def terminate_processes(self):
+        if not getattr(self, 'owns_process_pool', False):
+            # a shared process pool is terminated by its owner
+            return
         if hasattr(self, 'process_pool') and not self.processes_terminated:
             #self.process_pool.close()
             self.log.debug("terminating processes")
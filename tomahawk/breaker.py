@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tomahawk.constants import (
+    CONNECTION_ERROR_EXIT_STATUS,
+    DEFAULT_BREAKER_THRESHOLD,
+    DEFAULT_BREAKER_TTL,
+)
+
+class CircuitBreaker(object):
+    """
+    Records connection-level failures (exit status 255, timeouts) of hosts
+    in a local state file across runs. Hosts which failed repeatedly are
+    suppressed until the TTL expires.
+    """
+    def __init__(
+        self, path, threshold = DEFAULT_BREAKER_THRESHOLD,
+        ttl = DEFAULT_BREAKER_TTL, log = None
+    ):
+        self.path = os.path.expanduser(path)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.log = log
+        # changes in this run, which are merged into the state file on save:
+        # host -> { 'reset': closed the circuit, 'failures': added failures, 'last_failure': time }
+        self.changes = {}
+        self.hosts = self.load()
+
+    def load(self):
+        """
+        Returns: states of hosts in the state file
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            f = open(self.path)
+            try:
+                return json.load(f).get('hosts', {})
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # A broken state file must not stop command execution
+            e = sys.exc_info()[1]
+            if self.log:
+                self.log.debug('Failed to load circuit breaker state "%s": %s' % (self.path, e))
+            return {}
+
+    def save(self):
+        """
+        Merge changes of this run into the state file. The file is reloaded under a lock,
+        so changes of concurrent runs are not overwritten.
+        """
+        if len(self.changes) == 0:
+            return
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        lock = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            self.hosts = self.merge(self.load())
+            fd, tmp_path = tempfile.mkstemp(dir = dir or '.', prefix = '.breaker')
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump({ 'hosts': self.hosts }, f, indent = 2, sort_keys = True)
+            finally:
+                f.close()
+            # rename is atomic, a concurrent run never reads a half-written file
+            os.rename(tmp_path, self.path)
+        finally:
+            # closing the file releases the lock
+            lock.close()
+        self.changes = {}
+
+    def merge(self, hosts):
+        """
+        Returns: hosts with changes of this run applied
+        """
+        for host, change in self.changes.items():
+            state = hosts.get(host)
+            if change['reset']:
+                state = None
+            if change['failures'] > 0:
+                if state is None:
+                    state = { 'failures': 0, 'last_failure': change['last_failure'] }
+                state['failures'] += change['failures']
+                state['last_failure'] = max(state['last_failure'], change['last_failure'])
+            if state is None:
+                hosts.pop(host, None)
+            else:
+                hosts[host] = state
+        return hosts
+
+    def is_suppressed(self, host, now = None):
+        state = self.hosts.get(host)
+        if state is None or state['failures'] < self.threshold:
+            return False
+        if now is None:
+            now = time.time()
+        return now - state['last_failure'] < self.ttl
+
+    def suppressed_hosts(self, now = None):
+        """
+        Returns: a list of (host, failures, seconds until retry) sorted by host
+        """
+        if now is None:
+            now = time.time()
+        suppressed = []
+        for host in sorted(self.hosts.keys()):
+            if self.is_suppressed(host, now):
+                state = self.hosts[host]
+                remaining = int(self.ttl - (now - state['last_failure']))
+                suppressed.append((host, state['failures'], remaining))
+        return suppressed
+
+    def record(self, host, exit_status, timed_out, now = None):
+        if timed_out or exit_status == CONNECTION_ERROR_EXIT_STATUS:
+            if now is None:
+                now = time.time()
+            state = self.hosts.setdefault(host, { 'failures': 0, 'last_failure': now })
+            state['failures'] += 1
+            state['last_failure'] = now
+            change = self.changes.setdefault(host, { 'reset': False, 'failures': 0, 'last_failure': now })
+            change['failures'] += 1
+            change['last_failure'] = now
+        elif host in self.hosts:
+            # connected successfully, close the circuit
+            del self.hosts[host]
+            self.changes[host] = { 'reset': True, 'failures': 0, 'last_failure': now }
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import collections
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from tomahawk.constants import DEFAULT_STDIN_BUFFER_SIZE
+from tomahawk.pipe import READ_SIZE
+from tomahawk.utils import wait_writable
+
+# seconds to wait before trying to open fifos whose readers are not started
+OPEN_INTERVAL = 0.05
+
+def is_seekable(fd):
+    try:
+        os.lseek(fd, 0, os.SEEK_CUR)
+        return True
+    except OSError:
+        return False
+
+class StdinBroadcaster(threading.Thread):
+    """
+    Write local input to stdin of commands on all hosts.
+
+    Each command reads its stdin from a fifo created by add_reader().
+    The input is read once. Recently used chunks are kept in memory up to
+    buffer_size bytes, so readers running concurrently share them.
+    A chunk which is evicted from the buffer is read again from the input file
+    (or a spool file when the input is not seekable, e.g. a pipe) when a reader
+    falls behind, and it is kept in the buffer again, so readers started later
+    share the reads of the spool as well.
+    Each fifo is written only when it is writable, so a slow host doesn't
+    block other hosts.
+    """
+    def __init__(self, input, buffer_size = DEFAULT_STDIN_BUFFER_SIZE, log = None):
+        super(StdinBroadcaster, self).__init__()
+        self.daemon = True
+        self.input = input
+        self.input_fd = input.fileno()
+        self.log = log
+        self.dir = tempfile.mkdtemp(prefix = 'tomahawk-stdin.')
+        self.spool = None
+        if not is_seekable(self.input_fd):
+            self.spool = tempfile.TemporaryFile(dir = self.dir)
+        self.max_chunks = max(1, buffer_size // READ_SIZE)
+        # index -> chunk, in order of last use
+        self.chunks = collections.OrderedDict()
+        # number of chunks read from the input
+        self.read_chunks = 0
+        # number of chunks read again from the input file or the spool
+        self.spool_reads = 0
+        self.last_chunk = None
+        # path of a fifo -> { 'fd': write fd or None, 'offset': bytes written }
+        self.readers = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def add_reader(self, name):
+        """
+        Returns: path of a new fifo which is used as stdin of a command
+        """
+        self.lock.acquire()
+        try:
+            path = os.path.join(self.dir, '%d.fifo' % (len(self.readers)))
+            os.mkfifo(path)
+            if self.log:
+                self.log.debug("stdin of %s: %s" % (name, path))
+            self.readers[path] = { 'fd': None, 'offset': 0 }
+            return path
+        finally:
+            self.lock.release()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                self.lock.acquire()
+                try:
+                    readers = [ (path, r) for path, r in self.readers.items() if r is not None ]
+                finally:
+                    self.lock.release()
+
+                for path, reader in readers:
+                    if reader['fd'] is None:
+                        self.open_reader(path, reader)
+                fds = dict([ (r['fd'], (path, r)) for path, r in readers if r['fd'] is not None ])
+                if len(fds) == 0:
+                    self.stopped.wait(OPEN_INTERVAL)
+                    continue
+                for fd in wait_writable(list(fds.keys()), OPEN_INTERVAL):
+                    path, reader = fds[fd]
+                    self.write(path, reader)
+        finally:
+            self.close()
+
+    def open_reader(self, path, reader):
+        try:
+            reader['fd'] = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.errno != errno.ENXIO:
+                raise
+            # the command is not started yet
+
+    def write(self, path, reader):
+        index, position = divmod(reader['offset'], READ_SIZE)
+        data = self.get_chunk(index)[position:]
+        try:
+            if len(data) > 0:
+                reader['offset'] += os.write(reader['fd'], data)
+                return
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.errno == errno.EAGAIN:
+                return
+            if e.errno != errno.EPIPE:
+                raise
+            # the command exited without reading all input
+        # the end of input
+        os.close(reader['fd'])
+        self.lock.acquire()
+        try:
+            self.readers[path] = None
+        finally:
+            self.lock.release()
+
+    def get_chunk(self, index):
+        """
+        Returns: READ_SIZE bytes at index * READ_SIZE of the input. Shorter at the end of input.
+        """
+        if index in self.chunks:
+            data = self.chunks.pop(index)
+            self.chunks[index] = data
+            return data
+        if self.last_chunk is not None and index > self.last_chunk:
+            return b''
+        if index < self.read_chunks:
+            # evicted from the buffer
+            fd = self.input_fd
+            if self.spool is not None:
+                fd = self.spool.fileno()
+            os.lseek(fd, index * READ_SIZE, os.SEEK_SET)
+            data = read_fully(fd, READ_SIZE)
+            if self.spool is None:
+                os.lseek(fd, self.read_chunks * READ_SIZE, os.SEEK_SET)
+            self.spool_reads += 1
+            self.keep_chunk(index, data)
+            return data
+
+        while self.read_chunks <= index:
+            data = read_fully(self.input_fd, READ_SIZE)
+            if self.spool is not None:
+                spool_fd = self.spool.fileno()
+                # the position may be moved by reading
+                os.lseek(spool_fd, 0, os.SEEK_END)
+                written = 0
+                while written < len(data):
+                    written += os.write(spool_fd, data[written:])
+            self.keep_chunk(self.read_chunks, data)
+            if len(data) < READ_SIZE:
+                self.last_chunk = self.read_chunks
+            self.read_chunks += 1
+            if self.last_chunk is not None:
+                break
+        return self.chunks.get(index, b'')
+
+    def keep_chunk(self, index, data):
+        self.chunks[index] = data
+        if len(self.chunks) > self.max_chunks:
+            # the least recently used chunk
+            self.chunks.popitem(last = False)
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.close()
+
+    def close(self):
+        for path, reader in self.readers.items():
+            if reader is None:
+                continue
+            if reader['fd'] is None:
+                # wake up a command waiting for a writer of the fifo
+                try:
+                    reader['fd'] = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+                except OSError:
+                    continue
+            os.close(reader['fd'])
+            reader['fd'] = None
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        shutil.rmtree(self.dir, ignore_errors = True)
+
+def read_fully(fd, size):
+    """
+    Read size bytes from fd unless it reaches EOF.
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = os.read(fd, remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tomahawk.constants import (
+    CONNECTION_ERROR_EXIT_STATUS,
+    DEFAULT_CACHE_MAX_AGE,
+    DEFAULT_CACHE_MAX_ENTRIES,
+)
+
+class ResultCache(object):
+    """
+    A local cache of command results keyed by (host, command, ssh options).
+    ssh options (e.g. -l, -p, -o) are a part of the key because they may change the remote host or user.
+    Each result is stored in a file of the cache directory and expires after ttl seconds.
+    Files are removed after max_age seconds regardless of ttl, because runs may use different ttl.
+    """
+    def __init__(
+        self, dir, ttl, max_entries = DEFAULT_CACHE_MAX_ENTRIES,
+        max_age = DEFAULT_CACHE_MAX_AGE, log = None
+    ):
+        self.dir = os.path.expanduser(dir)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.log = log
+
+    def path(self, host, command, ssh_options):
+        key = '\0'.join([ host, command, ssh_options or '' ]).encode('utf-8')
+        return os.path.join(self.dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    def get(self, host, command, ssh_options, now = None):
+        """
+        Returns: (exit_status, output) or None if not cached or expired
+        """
+        path = self.path(host, command, ssh_options)
+        try:
+            f = open(path)
+            try:
+                entry = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if now is None:
+            now = time.time()
+        if now - entry['time'] >= self.ttl:
+            return None
+        if (entry['host'], entry['command'], entry.get('ssh_options')) != (host, command, ssh_options or ''):
+            return None
+        return entry['exit_status'], entry['output']
+
+    def put(self, host, command, ssh_options, exit_status, output, now = None):
+        if exit_status == CONNECTION_ERROR_EXIT_STATUS:
+            # not a result of the command
+            return
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        entry = {
+            'host': host,
+            'command': command,
+            'ssh_options': ssh_options or '',
+            'time': now or time.time(),
+            'exit_status': exit_status,
+            'output': output,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir = self.dir, prefix = '.entry')
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(entry, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path(host, command, ssh_options))
+
+    def evict(self, now = None):
+        """
+        Remove entries older than max_age, and oldest entries over max_entries.
+        """
+        if not os.path.exists(self.dir):
+            return
+        if now is None:
+            now = time.time()
+        entries = []
+        for name in os.listdir(self.dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime >= self.max_age:
+                    os.remove(path)
+                else:
+                    entries.append((mtime, path))
+            except OSError:
+                # removed by another process
+                continue
+        entries.sort()
+        for mtime, path in entries[0:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                e = sys.exc_info()[1]
+                if self.log:
+                    self.log.debug('Failed to remove cache "%s": %s' % (path, e))
@@ -1,19 +1,51 @@
 # -*- coding: utf-8 -*-
 import argparse
 import getpass
+import hashlib
 import os
 import signal
+import subprocess
 import sys
+import tempfile
+import threading
 import time
 
-from tomahawk.base import BaseContext, BaseExecutor, BaseMain
+from six import print_
+from six.moves import shlex_quote
+
+from tomahawk.base import BaseContext, BaseExecutor, BaseMain, FinishedResult
+from tomahawk.broadcast import StdinBroadcaster
 from tomahawk.color import (
     create_coloring_object
 )
+from tomahawk.cache import ResultCache
 from tomahawk.constants import (
-    DEFAULT_COMMAND_OUTPUT_FORMAT
+    DEFAULT_CACHE_DIR,
+    DEFAULT_COMMAND_OUTPUT_FORMAT,
+    DEFAULT_TIMEOUT
+)
+from tomahawk.digest import (
+    DigestResult,
+    create_digest_command,
+    find_different_hosts
 )
 from tomahawk.expect import CommandWithExpect
+from tomahawk.gather import (
+    DEFAULT_TIMESTAMP_PATTERN,
+    TimestampParser,
+    check_file_descriptors,
+    merge_by_timestamp,
+    read_lines
+)
+from tomahawk.pipe import CommandWithPipe, kill
+from tomahawk.relay import (
+    RelayExecution,
+    RelayHostResult,
+    group_hosts_by_relay,
+    read_relays_file
+)
+from tomahawk.reduce import create_reducer
+from tomahawk.shard import create_shard_command, read_items, split_items
 from tomahawk.utils import (
     shutdown_by_signal,
     check_required_command
@@ -37,6 +69,14 @@ class CommandMain(BaseMain):
         super(CommandMain, self).__init__(file)
         self.log.debug("options = " + str(self.options))
         self.log.debug("arguments = " + str(self.options.command))
+        options = self.options.__dict__
+        if options.get('reduce'):
+            try:
+                create_reducer(options['reduce'])
+            except ValueError:
+                self.arg_parser.error(str(sys.exc_info()[1]))
+            if options.get('verify_output') or options.get('digest') or options.get('gather'):
+                self.arg_parser.error('--reduce cannot be used with --verify-output, --digest and --gather')
 
     def do_run(self):
         self.context = CommandContext(
@@ -45,17 +85,24 @@ class CommandMain(BaseMain):
             sys.stdout,
             sys.stderr
         )
+        if self.context.options.get('breaker_report'):
+            return self.report_circuit_breaker()
         check_required_command('ssh')
         hosts = self.check_hosts()
 
         color = create_coloring_object(sys.stdout)
+        command = ' '.join(self.context.arguments)
+        if self.context.options.get('script'):
+            command = create_script_command(self.context.options['script'], self.context.arguments)[0]
         # prompt when production environment
         self.confirm_execution_on_production(
             'Command "%s" will be executed to %s hosts. Are you sure? [yes/NO]: '
-            % (color.green(' '.join(self.context.arguments)), color.green(len(hosts)))
+            % (color.green(command), color.green(len(hosts)))
         )
 
         executor = CommandExecutor(self.context, self.log, hosts)
+        if self.context.options.get('gather'):
+            return executor.gather(self.context.arguments)
         return executor.execute(self.context.arguments)
 
     @classmethod
@@ -67,7 +114,39 @@ class CommandMain(BaseMain):
         )
         parser.add_argument(
             'command', metavar='command', nargs='*',
-            help='Command executed on remote hosts.',
+            help='Command executed on remote hosts. (arguments of the script with --script)',
+        )
+        parser.add_argument(
+            '--script', metavar='FILE',
+            help='Execute a local script FILE on remote hosts. The script is sent to "sh -s" through stdin of ssh.'
+        )
+        parser.add_argument(
+            '--stdin-file', metavar='FILE',
+            help='Write FILE to stdin of the command on all hosts. "-" means stdin of tomahawk.'
+        )
+        parser.add_argument(
+            '--shard', action='store_true',
+            help='Export TOMAHAWK_HOST, TOMAHAWK_SHARD_INDEX and TOMAHAWK_SHARD_COUNT to the command on each host.'
+        )
+        parser.add_argument(
+            '--shard-items', metavar='FILE',
+            help='Split lines of FILE into chunks of hosts and export them as TOMAHAWK_SHARD_ITEMS. (implies --shard)'
+        )
+        parser.add_argument(
+            '--pipeline', action='store_true',
+            help='Execute commands on each host in order and stop at the first failure, without waiting for other hosts.'
+        )
+        parser.add_argument(
+            '--gather', action='store_true',
+            help='Stream output of the command (e.g. "cat app.log") from all hosts and merge lines by timestamps.'
+        )
+        parser.add_argument(
+            '--timestamp-pattern', metavar='REGEX', default=DEFAULT_TIMESTAMP_PATTERN,
+            help='Regular expression whose 1st group is a timestamp of a line for --gather. (default: ISO 8601)'
+        )
+        parser.add_argument(
+            '--timestamp-format', metavar='FORMAT',
+            help='strptime(3) format of timestamps for --gather. Timestamps are compared as strings if not specified.'
         )
         parser.add_argument(
             '--ssh', default='ssh', help='ssh program. (default: "ssh")'
@@ -94,6 +173,34 @@ class CommandMain(BaseMain):
             '-V', '--verify-output', action='store_true',
             help="Verify command output of all hosts."
         )
+        parser.add_argument(
+            '--digest', action='store_true',
+            help="Verify command output of all hosts by digests computed on remote hosts."
+        )
+        parser.add_argument(
+            '--reduce', metavar='REDUCER',
+            help="Aggregate output of all hosts instead of printing it. REDUCER is one of count-distinct, histogram[:WIDTH], sum, min, max and top:K[:FIELD]."
+        )
+        parser.add_argument(
+            '--read-only', action='store_true',
+            help="Mark commands as read-only. Results of read-only commands can be cached with --cache-ttl."
+        )
+        parser.add_argument(
+            '--cache-ttl', metavar='SECONDS', type=int, default=None,
+            help="Use cached results of read-only commands which are newer than SECONDS."
+        )
+        parser.add_argument(
+            '--cache-dir', metavar='DIR', default=DEFAULT_CACHE_DIR,
+            help="Directory of cached results. (default: %s)" % (DEFAULT_CACHE_DIR)
+        )
+        parser.add_argument(
+            '--relays-file', metavar='FILE',
+            help='Execute commands on hosts through relay hosts listed in FILE.'
+        )
+        parser.add_argument(
+            '--relay-parallel', metavar='NUM', type=int, default=None,
+            help='Process numbers for parallel command execution on each relay host. (default: same as --parallel)'
+        )
         cls.add_common_arguments(parser)
         return parser
 
@@ -117,6 +224,32 @@ def _command(
         print_tb(sys.exc_info()[2])
         raise
 
+def create_script_command(path, arguments):
+    """
+    Returns: (command shown in output, command which reads a script from stdin on remote hosts)
+    """
+    quoted_arguments = [ shlex_quote(a) for a in arguments ]
+    label = ' '.join([ path ] + quoted_arguments)
+    return label, ' '.join([ '/bin/sh', '-s', '--' ] + quoted_arguments)
+
+def _command_with_pipe(command, command_args, timeout, debug_enabled, input = None, stdin_path = None):
+    """
+    Execute a command without pty and expect.
+    input or a file at stdin_path is written to stdin of the command if specified.
+    """
+    # Trap SIGINT(Ctrl-C) to quit executing a command
+    signal.signal(signal.SIGINT, shutdown_by_signal)
+
+    try:
+        return CommandWithPipe(
+            command, command_args, timeout, debug_enabled, input, stdin_path
+        ).execute()
+    except:
+        from traceback import print_tb
+        print("""%s: %s""" % (sys.exc_info()[0], sys.exc_info()[1]))
+        print_tb(sys.exc_info()[2])
+        raise
+
 class CommandExecutor(BaseExecutor):
     """
     Execute commands.
@@ -126,53 +259,14 @@ class CommandExecutor(BaseExecutor):
     
     Returns: when rsync succeeds, return 0. When errors, return 1
     """
-    def execute(self, commands):
-        if len(commands) == 0:
-            raise RuntimeError("[error] Too few arguments")
+    metrics_name = 'command'
+    # writes --stdin-file to all hosts
+    broadcaster = None
 
+    def execute(self, commands):
         options = self.context.options
-        #ssh = options.get('ssh') or 'ssh'
-        
         ssh_user = options.get('ssh_user') or ''
-        ssh_options = ''
-        if options.get('ssh_options'):
-            ssh_options = options['ssh_options'] + ' '
-        if ssh_user:
-            ssh_options += '-l ' + ssh_user
-        if ssh_options.find('-T') == -1:
-            # if '-T' isn't specified, turn 'pseudo-tty allocation' on
-            ssh_options += ' -t'
-
-        async_results = []
-        for host in self.hosts:
-            for command in commands:
-                command_args = []
-                for option in ssh_options.split(' '):
-                    #  remove left and right whitespaces
-                    option = option.strip()
-                    if len(option) > 0:
-                        command_args.append(option)
-
-                command_args.append(host)
-                # Escape shell special chars
-                c = command.replace('\\', '\\\\') \
-                        .replace('"', '\"') \
-                        .replace('$', '\$') \
-                        .replace('`', '\`')
-
-                # execute a command with shell because we want to use pipe(|) and so on.
-                command_args.extend([ '/bin/sh', '-c', '"%s"' % (c) ])
-
-                # host, command, ssh_user, ssh_option, login_password, sudo_password
-                async_result = self.process_pool.apply_async(
-                    _command,
-                    ( 'ssh', command_args, self.login_password, self.sudo_password,
-                      options['timeout'], options['expect_delay'], options['debug'] ),
-                )
-                async_results.append({ 'host': host, 'command': command, 'async_result': async_result })
-
-                if options['delay'] != 0:
-                    time.sleep(options['delay'])
+        async_results = self.submit_commands(commands)
 
         #######################
         # callbacks
@@ -216,3 +310,347 @@ class CommandExecutor(BaseExecutor):
             create_failure_raise_error_message,
             create_failure_last_message
         )
+
+    def submit_commands(self, commands):
+        """
+        Start executing commands on all hosts.
+        With --script, commands are arguments of the script.
+
+        Returns: async_results given to process_async_results or wait_results
+        """
+        options = self.context.options
+        self.arguments = commands
+        # commands executed on remote hosts
+        remote_commands = {}
+        script = None
+        if options.get('script'):
+            if self.login_password or self.sudo_password:
+                raise RuntimeError("[error] --script cannot be used with passwords")
+            if options.get('relays_file'):
+                raise RuntimeError("[error] --script cannot be used with --relays-file")
+            f = open(options['script'], 'rb')
+            try:
+                script = f.read()
+            finally:
+                f.close()
+            command, remote_command = create_script_command(options['script'], commands)
+            remote_commands[command] = remote_command
+            commands = [ command ]
+            # cached results are stale once the script is edited
+            self.cache_commands[command] = '%s (sha256: %s)' % (command, hashlib.sha256(script).hexdigest())
+            # the script is sent through stdin, so a pty must not be allocated
+            self.use_pipe = True
+        elif len(commands) == 0:
+            raise RuntimeError("[error] Too few arguments")
+        else:
+            for command in commands:
+                remote_commands[command] = command
+        if options.get('digest'):
+            for command in commands:
+                remote_commands[command] = create_digest_command(remote_commands[command])
+        if options.get('stdin_file'):
+            if script is not None:
+                raise RuntimeError("[error] --stdin-file cannot be used with --script")
+            if self.login_password or self.sudo_password:
+                raise RuntimeError("[error] --stdin-file cannot be used with passwords")
+            if options.get('relays_file'):
+                raise RuntimeError("[error] --stdin-file cannot be used with --relays-file")
+            if options['stdin_file'] == '-':
+                input = getattr(sys.stdin, 'buffer', sys.stdin)
+            else:
+                input = open(options['stdin_file'], 'rb')
+            self.broadcaster = StdinBroadcaster(input, log = self.log)
+            self.broadcaster.start()
+            self.use_pipe = True
+
+        self.commands = commands
+        #ssh = options.get('ssh') or 'ssh'
+
+        # host -> (index, items) of the shard
+        shards = None
+        if options.get('shard') or options.get('shard_items'):
+            duplicated_hosts = sorted(set([ h for h in self.given_hosts if self.given_hosts.count(h) > 1 ]))
+            if len(duplicated_hosts) > 0:
+                # a duplicated host would take 2 shards, and the other shard would be lost
+                raise RuntimeError("[error] --shard requires unique hosts: " + ', '.join(duplicated_hosts))
+            chunks = [ None ] * len(self.given_hosts)
+            if options.get('shard_items'):
+                chunks = split_items(read_items(options['shard_items']), len(self.given_hosts))
+            shards = dict([ (h, (i, chunks[i])) for i, h in enumerate(self.given_hosts) ])
+
+        ssh_user = options.get('ssh_user') or ''
+        ssh_option_args = self.create_ssh_option_args()
+
+        if options.get('cache_ttl') and options.get('read_only') and not options.get('digest'):
+            self.result_cache = ResultCache(
+                options.get('cache_dir') or DEFAULT_CACHE_DIR, options['cache_ttl'], log = self.log
+            )
+            # a user and a port of ssh options identify the remote host too
+            self.cache_ssh_options = ' '.join(ssh_option_args)
+        replayed_results = {}
+        for host in self.hosts:
+            for command in commands:
+                cached = self.find_resumed_result(host, command)
+                if cached is None and self.result_cache:
+                    cached = self.result_cache.get(
+                        host, self.cache_commands.get(command, command), self.cache_ssh_options
+                    )
+                if cached is not None:
+                    replayed_results[(host, command)] = cached
+        self.replayed_results = set(replayed_results.keys())
+        self.log.debug("%d results are replayed from the journal or the cache" % (len(replayed_results)))
+        # hosts which need no connection
+        cached_hosts = set()
+        for host in self.hosts:
+            if len([ c for c in commands if (host, c) in replayed_results ]) == len(commands):
+                cached_hosts.add(host)
+
+        relay_groups, direct_hosts = [], [ h for h in self.hosts if h not in cached_hosts ]
+        if options.get('relays_file'):
+            if self.login_password or self.sudo_password:
+                raise RuntimeError("[error] --relays-file cannot be used with passwords")
+            if self.pipeline:
+                raise RuntimeError("[error] --pipeline cannot be used with --relays-file")
+            if options.get('shard') or options.get('shard_items'):
+                raise RuntimeError("[error] --shard cannot be used with --relays-file")
+            relay_groups, direct_hosts = group_hosts_by_relay(
+                [ h for h in direct_hosts if h not in self.suppressed_hosts ],
+                read_relays_file(options['relays_file'])
+            )
+
+        relay_results = {}
+        for relay, relay_hosts in relay_groups:
+            for command in commands:
+                execution = RelayExecution(
+                    relay, relay_hosts, '/bin/sh -c ' + shlex_quote(remote_commands[command]),
+                    [ o for o in ssh_option_args if o != '-t' ],
+                    options.get('relay_parallel') or options.get('parallel', 1),
+                    options['timeout'], self.log
+                )
+                execution.start()
+                for host in relay_hosts:
+                    async_result = RelayHostResult(execution, host)
+                    if options.get('digest'):
+                        async_result = DigestResult(async_result)
+                    relay_results[(host, command)] = async_result
+
+        skipped_hosts = self.find_skipped_hosts(direct_hosts)
+        async_results = []
+        for host in self.hosts:
+            for command in commands:
+                if (host, command) in replayed_results:
+                    async_result = FinishedResult(replayed_results[(host, command)])
+                    async_results.append({ 'host': host, 'command': command, 'async_result': async_result })
+                    continue
+                if host in skipped_hosts:
+                    async_result = FinishedResult(skipped_hosts[host])
+                    async_results.append({ 'host': host, 'command': command, 'async_result': async_result })
+                    continue
+                if (host, command) in relay_results:
+                    async_result = relay_results[(host, command)]
+                    async_results.append({ 'host': host, 'command': command, 'async_result': async_result })
+                    continue
+
+                command_args = list(ssh_option_args)
+                command_args.append(host)
+                remote_command = remote_commands[command]
+                if shards is not None:
+                    index, items = shards[host]
+                    remote_command = create_shard_command(remote_command, host, index, len(shards), items)
+                # Escape shell special chars
+                c = remote_command.replace('\\', '\\\\') \
+                        .replace('"', '\\"') \
+                        .replace('$', '\$') \
+                        .replace('`', '\`')
+
+                # execute a command with shell because we want to use pipe(|) and so on.
+                command_args.extend([ '/bin/sh', '-c', '"%s"' % (c) ])
+
+                wrapper = None
+                if options.get('digest'):
+                    wrapper = DigestResult
+                if self.use_pipe:
+                    stdin_path = None
+                    if self.broadcaster is not None:
+                        stdin_path = self.broadcaster.add_reader(host)
+                    async_results.append(self.submit(
+                        host, command, _command_with_pipe,
+                        ( 'ssh', command_args, options['timeout'], options['debug'], script, stdin_path ),
+                        wrapper
+                    ))
+                else:
+                    # host, command, ssh_user, ssh_option, login_password, sudo_password
+                    async_results.append(self.submit(
+                        host, command, _command,
+                        ( 'ssh', command_args, self.login_password, self.sudo_password,
+                          options['timeout'], options['expect_delay'], options['debug'] ),
+                        wrapper
+                    ))
+
+                if options['delay'] != 0:
+                    time.sleep(options['delay'])
+
+        if self.pipeline:
+            # each command waits for the previous command on the same host
+            previous = {}
+            for entry in async_results:
+                entry['after'] = previous.get(entry['host'])
+                previous[entry['host']] = entry
+        return async_results
+
+    def gather(self, commands):
+        """
+        Execute a command on all hosts at once, and print lines of output merged by timestamps.
+        Output is read as lines are merged, so memory usage doesn't depend on size of output.
+        Commands still running after --timeout seconds are killed.
+
+        Returns: 0 when the command succeeds on all hosts, otherwise 1
+        """
+        if len(commands) != 1:
+            raise RuntimeError("[error] --gather requires one command")
+        if self.login_password or self.sudo_password:
+            raise RuntimeError("[error] --gather cannot be used with passwords")
+        options = self.context.options
+        out, err = self.context.out, self.context.err
+        color = create_coloring_object(out)
+        parser = TimestampParser(
+            options.get('timestamp_pattern') or DEFAULT_TIMESTAMP_PATTERN,
+            options.get('timestamp_format')
+        )
+        # all hosts are executed at once because the merge needs a line of every host
+        check_file_descriptors(self.hosts)
+        self.terminate_processes()
+        self.use_pipe = True
+        timeout = options.get('timeout') or DEFAULT_TIMEOUT
+        ssh_option_args = self.create_ssh_option_args() + [ '-o', 'ConnectTimeout=%d' % (timeout) ]
+
+        processes = []
+        error_hosts = []
+        timed_out_hosts = set()
+        def kill_running():
+            for host, process, stderr in processes:
+                if process.poll() is None:
+                    timed_out_hosts.add(host)
+                    # stdout is being read by the merge, so it's closed by EOF
+                    try:
+                        os.kill(process.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+        deadline = threading.Timer(timeout, kill_running)
+        deadline.daemon = True
+        devnull = open(os.devnull, 'rb')
+        try:
+            for host in self.hosts:
+                stderr = tempfile.TemporaryFile()
+                process = subprocess.Popen(
+                    [ 'ssh' ] + ssh_option_args + [ host, commands[0] ],
+                    stdin = devnull, stdout = subprocess.PIPE, stderr = stderr,
+                    close_fds = True
+                )
+                processes.append((host, process, stderr))
+            deadline.start()
+
+            sources = [ (host, read_lines(process.stdout)) for host, process, stderr in processes ]
+            for host, line in merge_by_timestamp(sources, parser):
+                print_('%s %s' % (color.green('[%s]' % (host)), line), file=out)
+
+            for host, process, stderr in processes:
+                exit_status = process.wait()
+                stderr.seek(0)
+                error = stderr.read().decode('utf-8', 'replace').rstrip()
+                timed_out = host in timed_out_hosts
+                self.record_result(host, commands[0], exit_status, error, timed_out)
+                if self.metrics is not None:
+                    # output is not kept by --gather
+                    self.metrics.observe(exit_status, timed_out, None, error)
+                if timed_out:
+                    error_hosts.append(host)
+                    print_('%s Command timed out on host "%s" after %d seconds' \
+                        % (color.red('[error]'), host, timeout), file=err)
+                elif exit_status != 0:
+                    error_hosts.append(host)
+                    print_('%s Command failed on host "%s" (status = %d) %s' \
+                        % (color.red('[error]'), host, exit_status, error), file=err)
+        finally:
+            deadline.cancel()
+            devnull.close()
+            for host, process, stderr in processes:
+                if process.poll() is None:
+                    kill(process)
+                stderr.close()
+            self.finish_execution()
+        if len(error_hosts) > 0:
+            return 1
+        return 0
+
+    def create_ssh_option_args(self):
+        """
+        Returns: a list of ssh options from -u and -o
+        """
+        options = self.context.options
+        ssh_user = options.get('ssh_user') or ''
+        ssh_options = ''
+        if options.get('ssh_options'):
+            ssh_options = options['ssh_options'] + ' '
+        if ssh_user:
+            ssh_options += '-l ' + ssh_user
+        if not self.use_pipe and ssh_options.find('-T') == -1:
+            # if '-T' isn't specified, turn 'pseudo-tty allocation' on
+            ssh_options += ' -t'
+
+        ssh_option_args = []
+        for option in ssh_options.split(' '):
+            #  remove left and right whitespaces
+            option = option.strip()
+            if len(option) > 0:
+                ssh_option_args.append(option)
+        return ssh_option_args
+
+    def resubmit(self, entry):
+        if self.broadcaster is not None and entry['attempts'] > 0:
+            # stdin of the previous attempt may be consumed, so write input from the beginning again
+            entry['args'] = entry['args'][:-1] + ( self.broadcaster.add_reader(entry['host']), )
+        super(CommandExecutor, self).resubmit(entry)
+
+    def finish_execution(self):
+        if self.broadcaster is not None:
+            self.broadcaster.stop()
+        super(CommandExecutor, self).finish_execution()
+
+    def verify_outputs(self, execution_info, color, error_prefix):
+        """
+        With --digest, compare digests of hosts with the majority and
+        fetch full output only from different hosts.
+        """
+        options = self.context.options
+        if not options.get('digest'):
+            return super(CommandExecutor, self).verify_outputs(execution_info, color, error_prefix)
+
+        out, err = self.context.out, self.context.err
+        outputs = {}
+        for h in self.hosts:
+            outputs[h] = execution_info[h]['command_output']
+        majority, different_hosts = find_different_hosts(self.hosts, outputs)
+        if len(different_hosts) == 0:
+            print_(color.green('Verified output of all hosts.'), file=out)
+            return 0
+
+        print_("%s Detected different command output from majority (%s) on following hosts.\n%s" \
+            % (color.red(error_prefix), majority, '\n'.join([ '  ' + h for h in different_hosts ])), file=err)
+
+        # Fetch full output of different hosts
+        options = dict(options)
+        options['digest'] = False
+        options['verify_output'] = False
+        options['journal'] = None
+        # results of the refetch must not be counted twice
+        options['statsd'] = None
+        options['metrics_textfile'] = None
+        options['parallel'] = min(options.get('parallel', 1), len(different_hosts))
+        context = CommandContext(self.context.arguments, options, out, err)
+        executor = CommandExecutor(
+            context, self.log, different_hosts,
+            login_password = self.login_password, sudo_password = self.sudo_password
+        )
+        executor.execute(self.arguments)
+        return 3
@@ -4,6 +4,40 @@ DEFAULT_EXPECT_ENCODING = 'utf-8'
 DEFAULT_COMMAND_OUTPUT_FORMAT = '${user}@${host} % ${command}\n${output}\n'
 DEFAULT_RSYNC_OUTPUT_FORMAT = '% ${command}\n${output}\n'
 DEFAULT_RSYNC_OPTIONS = '-av'
+DEFAULT_PREFLIGHT_PORT = 22
+DEFAULT_PREFLIGHT_TIMEOUT = 3
+DEFAULT_MAX_TASKS_PER_CHILD = 100
+DEFAULT_CACHE_DIR = '~/.tomahawk/cache'
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+# cached results older than this are removed regardless of --cache-ttl
+DEFAULT_CACHE_MAX_AGE = 7 * 24 * 3600
+# sha256 of files hashed by tomahawk-rsync --skip-synced
+DEFAULT_HASH_CACHE_FILE = '~/.tomahawk/rsync-hashes.json'
+DEFAULT_JOURNAL_SYNC_INTERVAL = 1.0
+DEFAULT_JOURNAL_SYNC_RECORDS = 100
+# seconds to wait when no results are ready
+POLL_INTERVAL = 0.01
+# max number of hosts executed ahead of the first unfinished host with --order=input
+DEFAULT_REORDER_BUFFER = 256
+# seconds between redraws of --progress
+DEFAULT_PROGRESS_INTERVAL = 0.2
+# seconds of recent completions to compute a rate of --progress
+PROGRESS_RATE_WINDOW = 10.0
+# seconds between writes of --metrics-textfile during a run
+DEFAULT_METRICS_INTERVAL = 15.0
+# seconds between flushes of --statsd during a run
+DEFAULT_STATSD_INTERVAL = 1.0
+DEFAULT_RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 60.0
+# bytes of stdin kept in memory by --stdin-file
+DEFAULT_STDIN_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_BREAKER_FILE = '~/.tomahawk/breaker.json'
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_TTL = 3600
+# file descriptors kept for others (e.g. stdio, log files) when a file descriptor is opened for each host
+RESERVED_FDS = 32
+# ssh exits with 255 when a connection error occurs
+CONNECTION_ERROR_EXIT_STATUS = 255
 OUTPUT_FORMAT_CONTROLL_CHARS = {
     'r': '\r',
     'n': '\n',
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import re
+
+from six.moves import shlex_quote
+
+DIGEST_HEADER = 'TOMAHAWK-DIGEST'
+DIGEST_REGEX = re.compile(r'^%s (\S+) (\d+) (\S+) (\d+)$' % (DIGEST_HEADER), re.M)
+
+# Hashes stdout and stderr of a command separately on a remote host and prints only
+# the digests and byte counts, so interleaving of the streams never changes digests.
+# Output is streamed through tee, so it is never stored on the host.
+# Double quotes are not used because of escaping in CommandExecutor.
+DIGEST_COMMAND_TEMPLATE = \
+    "h() { sha256sum 2>/dev/null || shasum -a 256 2>/dev/null || cksum; }; " \
+    "t=$(mktemp -d /tmp/tomahawk-digest.XXXXXX) || exit 255; " \
+    "mkfifo $t/o $t/e $t/E || exit 255; " \
+    "wc -c < $t/o > $t/on & " \
+    "wc -c < $t/E > $t/en & " \
+    "tee $t/E < $t/e | h > $t/ed & " \
+    "{ /bin/sh -c %s 2> $t/e; echo $? > $t/s; } | tee $t/o | h > $t/od; " \
+    "wait; " \
+    "echo " + DIGEST_HEADER + " $(cut -d' ' -f1 < $t/od) $(tr -d ' ' < $t/on)" \
+    " $(cut -d' ' -f1 < $t/ed) $(tr -d ' ' < $t/en); " \
+    "s=$(cat $t/s); rm -rf $t; exit $s"
+
+def create_digest_command(command):
+    return DIGEST_COMMAND_TEMPLATE % (shlex_quote(command))
+
+def parse_digest_output(output):
+    """
+    Returns: (stdout digest, stdout bytes, stderr digest, stderr bytes)
+    or None if output doesn't contain digests
+    """
+    matches = DIGEST_REGEX.findall(output)
+    if len(matches) == 0:
+        return None
+    digest, size, stderr_digest, stderr_size = matches[-1]
+    return digest, int(size), stderr_digest, int(stderr_size)
+
+def format_digest(digest, size, stderr_digest, stderr_size):
+    text = 'digest: %s (%d bytes)' % (digest, size)
+    if stderr_size > 0:
+        text += ', stderr digest: %s (%d bytes)' % (stderr_digest, stderr_size)
+    return text
+
+def find_different_hosts(hosts, outputs):
+    """
+    Find hosts whose output differs from output of the majority of hosts.
+
+    Args:
+    hosts -- hosts in order
+    outputs -- a dict which maps a host to its output
+
+    Returns: (output of the majority, a list of different hosts)
+    """
+    counts = {}
+    for host in hosts:
+        counts[outputs[host]] = counts.get(outputs[host], 0) + 1
+    majority = None
+    for host in hosts:
+        # the first output wins when counts are the same
+        if majority is None or counts[outputs[host]] > counts[majority]:
+            majority = outputs[host]
+    return majority, [ h for h in hosts if outputs[h] != majority ]
+
+class DigestResult(object):
+    """
+    Converts output of a digest command into a digest summary.
+    It behaves like multiprocessing.pool.AsyncResult.
+    """
+    def __init__(self, async_result):
+        self.async_result = async_result
+
+    def ready(self):
+        return self.async_result.ready()
+
+    def get(self, timeout = None):
+        exit_status, output = self.async_result.get(timeout)
+        digest = parse_digest_output(output)
+        if digest is None:
+            return exit_status, output
+        return exit_status, format_digest(*digest)
@@ -1,12 +1,10 @@
 # -*- coding: utf-8 -*-
 from six import print_, reraise
-from six import BytesIO, StringIO
 from six import b, u
 
 import pexpect
 import re
 import sys
-import time
 from tomahawk.constants import (
     DEFAULT_TIMEOUT,
     DEFAULT_EXPECT_DELAY,
@@ -15,6 +13,71 @@ from tomahawk.constants import (
 )
 from tomahawk.log import create_logger
 
+# Compiled once per process, not for every command
+EXPECT_REGEXES = [
+    re.compile(b('^Enter passphrase.+')),
+    re.compile(b('[Pp]assword[^\n]*:')),
+    re.compile(u('パスワード').encode('utf-8')), # TODO: japanese character expected as utf-8
+]
+OUTPUT_FILTER_REGEXES = EXPECT_REGEXES + [ re.compile(b('Connection to .* closed')) ]
+NEWLINE = b('\n')
+NEWLINE_CHARS = b('\r\n')
+
+class OutputSanitizer(object):
+    """
+    A file-like object given to pexpect as logfile.
+    Password prompts and passwords are removed line by line while bytes
+    stream out of the pty, so the output is clean when the command exits.
+    """
+    def __init__(self, passwords = ()):
+        self.passwords = set()
+        for password in passwords:
+            if password:
+                self.passwords.add(password.encode('utf-8'))
+        self.lines = []
+        self.partial = bytearray()
+
+    def write(self, data):
+        start = 0
+        while True:
+            end = data.find(NEWLINE, start)
+            if end == -1:
+                break
+            if self.partial:
+                # join with the remainder of the previous chunk
+                self.partial += data[start:end]
+                self.add_line(bytes(self.partial))
+                del self.partial[:]
+            else:
+                self.add_line(data[start:end])
+            start = end + 1
+        if start < len(data):
+            self.partial += data[start:]
+
+    def add_line(self, line):
+        line = line.strip(NEWLINE_CHARS)
+        if not line or line in self.passwords:
+            return
+        for regex in OUTPUT_FILTER_REGEXES:
+            if regex.search(line):
+                return
+        self.lines.append(line.decode('utf-8', 'replace'))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.partial:
+            self.add_line(bytes(self.partial))
+            del self.partial[:]
+
+    def getvalue(self):
+        """
+        Returns: sanitized output text
+        """
+        self.close()
+        return '\n'.join(self.lines)
+
 class CommandWithExpect(object):
 
     """
@@ -28,16 +91,11 @@ class CommandWithExpect(object):
         self.login_password = login_password
         self.sudo_password = sudo_password
         self.timeout = timeout
-        self.expect_delay = expect_delay
+        self.expect_delay = expect_delay # not used any more, kept for compatibility
         self.log = create_logger(None, debug_enabled)
-        self.expect_patterns = [
-            b('^Enter passphrase.+'),
-            b('[Pp]assword[^\n]*:'),
-            u('パスワード').encode('utf-8'), # TODO: japanese character expected as utf-8
-        ]
+        self.expect_patterns = EXPECT_REGEXES
         if expect_out is None:
-            #expect_out = StringIO()
-            expect_out = BytesIO()
+            expect_out = OutputSanitizer([ login_password, sudo_password ])
         if expect is None:
             self.expect = pexpect.spawn(
                 command,
@@ -93,8 +151,19 @@ class CommandWithExpect(object):
         return self.get_status_and_output(self.expect, self.expect_out)
 
     def get_status_and_output(self, child, expect_out):
-        # Need a litte bit sleep because of failure of expect
-        time.sleep(self.expect_delay)
+        # Read output until EOF and reap the child with waitpid(2) instead of
+        # sleeping, so that no output is lost and the exit status is reliable.
+        try:
+            child.expect(pexpect.EOF)
+        except pexpect.TIMEOUT:
+            self.log.debug("expect.TIMEOUT while waiting for EOF")
+            raise TimeoutError("Execution is timed out after %d seconds" % (self.timeout))
+        if child.isalive():
+            child.wait()
+        # The child is already reaped, no need to wait for the kernel in close()
+        child.delayafterclose = 0
+        if hasattr(child, 'ptyproc'):
+            child.ptyproc.delayafterclose = 0
         child.close()
         self.log.debug("child closed.")
 
@@ -103,39 +172,12 @@ class CommandWithExpect(object):
             exit_status = 1
         self.log.debug("exit_status = %d" % exit_status)
 
-        output_lines = []
-        expect_regexs = [ re.compile(p.decode('utf-8')) for p in self.expect_patterns ]
-        expect_regexs.append(re.compile('Connection to .* closed'))
-
-        passwords = []
-        if self.login_password:
-            passwords.append(self.login_password)
-        if self.sudo_password:
-            passwords.append(self.sudo_password)
-        #print("--- bytes ---")
-        #print(expect_out.getvalue())
-        lines = expect_out.getvalue().decode("utf-8").split('\n')
-        #for line in expect_out.getvalue().split('\n'):
-        for line in lines:
-            line = line.strip('\r\n')
-            if line == '' or line in passwords:
-                continue
-
-            for password in passwords:
-                # for debug output
-                if line == password:
-                    line = line.replace(password, len(password) * '*')
-            self.log.debug("line = " + line)
-
-            append = True
-            for regex in expect_regexs:
-                if regex.search(line):
-                    append = False
-                    continue
-            if append:
-                output_lines.append(line)
-
-        output_text = '\n'.join(output_lines)
+        if not isinstance(expect_out, OutputSanitizer):
+            # expect_out is a plain buffer given by the caller
+            sanitizer = OutputSanitizer([ self.login_password, self.sudo_password ])
+            sanitizer.write(expect_out.getvalue())
+            expect_out = sanitizer
+        output_text = expect_out.getvalue()
         self.log.debug("output_text = " + output_text)
 
         return exit_status, output_text
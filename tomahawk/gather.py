@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import datetime
+import heapq
+import re
+
+from tomahawk.constants import RESERVED_FDS
+from tomahawk.utils import raise_file_limit
+
+# e.g. "2014-05-01 12:34:56", "2014-05-01T12:34:56.789"
+DEFAULT_TIMESTAMP_PATTERN = r'(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?)'
+# file descriptors kept for each host: stdout pipe and stderr file of ssh
+FDS_PER_HOST = 2
+
+def check_file_descriptors(hosts):
+    """
+    All hosts are executed at once, so raise the soft limit of file descriptors
+    up to the hard limit if required, and fail before starting any ssh if it's not enough.
+    """
+    required = len(hosts) * FDS_PER_HOST + RESERVED_FDS
+    limit = raise_file_limit(required)
+    if limit is not None and limit < required:
+        raise RuntimeError(
+            '[error] --gather requires %d file descriptors for %d hosts, but the limit is %d (ulimit -n)' \
+                % (required, len(hosts), limit)
+        )
+
+class TimestampParser(object):
+    """
+    Find a timestamp in a line with the 1st group of pattern.
+    Timestamps are compared as strings, or as datetime if format (for strptime) is specified.
+    """
+    def __init__(self, pattern = DEFAULT_TIMESTAMP_PATTERN, format = None):
+        self.regex = re.compile(pattern)
+        if self.regex.groups == 0:
+            raise RuntimeError('[error] Timestamp pattern must have a group: ' + pattern)
+        self.format = format
+
+    def parse(self, line):
+        """
+        Returns: a timestamp or None if line doesn't have a timestamp
+        """
+        match = self.regex.search(line)
+        if match is None:
+            return None
+        timestamp = match.group(1)
+        if self.format is None:
+            return timestamp
+        try:
+            return datetime.datetime.strptime(timestamp, self.format)
+        except ValueError:
+            return None
+
+def read_lines(stream):
+    """
+    Returns: a generator of lines of stream (bytes) without newlines
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        yield line.decode('utf-8', 'replace').rstrip('\r\n')
+
+def merge_by_timestamp(sources, parser):
+    """
+    Merge lines of sources in order of timestamps with a heap (k-way merge).
+    Only one line of each source is kept in memory, so sources are read as lines are merged.
+    A line without a timestamp (e.g. a stack trace) follows the previous line of the source.
+
+    Args:
+    sources -- a list of (name, iterable of lines). lines of each source are sorted by timestamps.
+    parser -- TimestampParser
+
+    Returns: a generator of (name, line)
+    """
+    heap = []
+    iterators = []
+    keys = []
+
+    def push(index):
+        for line in iterators[index]:
+            timestamp = parser.parse(line)
+            if timestamp is not None:
+                # lines before the first timestamp are merged first
+                keys[index] = (1, timestamp)
+            heapq.heappush(heap, (keys[index], index, line))
+            return
+
+    for index, (name, lines) in enumerate(sources):
+        iterators.append(iter(lines))
+        keys.append((0,))
+        push(index)
+
+    while len(heap) > 0:
+        key, index, line = heapq.heappop(heap)
+        yield sources[index][0], line
+        push(index)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+
+from tomahawk.constants import (
+    DEFAULT_JOURNAL_SYNC_INTERVAL,
+    DEFAULT_JOURNAL_SYNC_RECORDS,
+)
+
+class Journal(object):
+    """
+    Appends a final result of each host to a file as a JSON line.
+    Records are flushed immediately, but fsync(2) is batched by count and time.
+    """
+    def __init__(
+        self, path, sync_interval = DEFAULT_JOURNAL_SYNC_INTERVAL,
+        sync_records = DEFAULT_JOURNAL_SYNC_RECORDS
+    ):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_records = sync_records
+        self.file = open(path, 'a')
+        if not ends_with_newline(path):
+            # terminate a record half-written when interrupted, so the next record is not lost
+            self.file.write('\n')
+            self.file.flush()
+        self.unsynced_records = 0
+        self.synced_at = time.time()
+
+    def append(self, host, command, exit_status, output, timed_out):
+        record = {
+            'host': host,
+            'command': command,
+            'exit_status': exit_status,
+            'output': output,
+            'timeout': timed_out,
+            'time': time.time(),
+        }
+        self.file.write(json.dumps(record, sort_keys = True) + '\n')
+        self.file.flush()
+        self.unsynced_records += 1
+        if self.unsynced_records >= self.sync_records \
+                or time.time() - self.synced_at >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced_records > 0:
+            os.fsync(self.file.fileno())
+            self.unsynced_records = 0
+        self.synced_at = time.time()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        self.sync()
+        self.file.close()
+
+def ends_with_newline(path):
+    """
+    Returns: True if a file is empty or ends with a newline
+    """
+    f = open(path, 'rb')
+    try:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+    finally:
+        f.close()
+
+def read_succeeded_results(path):
+    """
+    Read a journal and find succeeded results.
+    When a host is recorded more than once, the last record wins.
+
+    Returns: a dict which maps (host, command) to (exit_status, output)
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    for line in open(path):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # a record half-written when interrupted
+            continue
+        key = (record['host'], record['command'])
+        if record['exit_status'] == 0 and not record.get('timeout'):
+            results[key] = (record['exit_status'], record['output'])
+        elif key in results:
+            del results[key]
+    return results
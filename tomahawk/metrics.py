@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from tomahawk.constants import (
+    DEFAULT_METRICS_INTERVAL,
+    DEFAULT_STATSD_INTERVAL,
+)
+
+# upper bounds of buckets of durations of hosts in seconds
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# max size of a StatsD packet which fits in an ethernet frame
+STATSD_PACKET_SIZE = 1432
+RESULTS = ('succeeded', 'failed', 'timed_out')
+
+def parse_address(address):
+    """
+    Returns: (host, port) of "HOST:PORT"
+    """
+    host, separator, port = address.rpartition(':')
+    if separator == '' or host == '' or not port.isdigit():
+        raise ValueError('Invalid address (HOST:PORT required): ' + address)
+    return host.strip('[]'), int(port)
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [ 0 ] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+def write_textfile(path, text):
+    """
+    Write a file atomically, so a collector never reads a half-written file.
+    """
+    dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir = dir, prefix = '.' + os.path.basename(path))
+    f = os.fdopen(fd, 'w')
+    try:
+        f.write(text)
+    finally:
+        f.close()
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+
+class StatsdClient(object):
+    """
+    Send metrics with non-blocking UDP. Lines are batched into packets,
+    and a packet which cannot be sent immediately is dropped.
+    """
+    def __init__(self, address, prefix):
+        host, port = parse_address(address)
+        family, type, proto, canonname, sockaddr = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+        self.sockaddr = sockaddr
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.prefix = prefix
+        self.lines = []
+
+    def add(self, name, value, type):
+        self.lines.append('%s.%s:%s|%s' % (self.prefix, name, value, type))
+
+    def flush(self):
+        packet = ''
+        for line in self.lines:
+            if packet and len(packet) + len(line) + 1 > STATSD_PACKET_SIZE:
+                self.send(packet)
+                packet = ''
+            packet = packet + '\n' + line if packet else line
+        if packet:
+            self.send(packet)
+        self.lines = []
+
+    def send(self, packet):
+        try:
+            self.socket.sendto(packet.encode('utf-8'), self.sockaddr)
+        except (socket.error, OSError):
+            e = sys.exc_info()[1]
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED, errno.ENOBUFS):
+                raise
+
+    def close(self):
+        self.flush()
+        self.socket.close()
+
+class Metrics(object):
+    """
+    Metrics of a run, exported to a Prometheus textfile and/or StatsD.
+    Both are flushed at most once per interval during a run and when the run completes.
+    """
+    def __init__(
+        self, name, textfile = None, statsd = None,
+        textfile_interval = DEFAULT_METRICS_INTERVAL, statsd_interval = DEFAULT_STATSD_INTERVAL
+    ):
+        self.name = name
+        self.textfile = textfile
+        self.textfile_interval = textfile_interval
+        self.statsd = None
+        if statsd is not None:
+            self.statsd = StatsdClient(statsd, 'tomahawk.' + name)
+        self.statsd_interval = statsd_interval
+        self.results = dict([ (r, 0) for r in RESULTS ])
+        self.durations = Histogram(DURATION_BUCKETS)
+        self.output_bytes = 0
+        self.started_at = time.time()
+        self.textfile_written_at = self.started_at
+        self.statsd_flushed_at = self.started_at
+
+    def observe(self, exit_status, timed_out, seconds, output):
+        """
+        Args:
+        seconds -- execution time on the host, or None if it's unknown
+        """
+        if timed_out:
+            result = 'timed_out'
+        elif exit_status == 0:
+            result = 'succeeded'
+        else:
+            result = 'failed'
+        self.results[result] += 1
+        size = len(output.encode('utf-8'))
+        self.output_bytes += size
+        if seconds is not None:
+            self.durations.observe(seconds)
+        if self.statsd is not None:
+            self.statsd.add('hosts.' + result, 1, 'c')
+            self.statsd.add('output_bytes', size, 'c')
+            if seconds is not None:
+                self.statsd.add('host_duration', int(seconds * 1000), 'ms')
+
+    def prometheus_text(self, finished):
+        label = 'program="%s"' % (self.name)
+        lines = [
+            '# HELP tomahawk_hosts_total Number of hosts by result.',
+            '# TYPE tomahawk_hosts_total counter',
+        ]
+        for result in RESULTS:
+            lines.append('tomahawk_hosts_total{%s,result="%s"} %d' % (label, result, self.results[result]))
+        lines += [
+            '# HELP tomahawk_host_duration_seconds Execution time on each host.',
+            '# TYPE tomahawk_host_duration_seconds histogram',
+        ]
+        for bound, count in zip(self.durations.buckets, self.durations.cumulative_counts()):
+            lines.append('tomahawk_host_duration_seconds_bucket{%s,le="%s"} %d' % (label, bound, count))
+        lines += [
+            'tomahawk_host_duration_seconds_bucket{%s,le="+Inf"} %d' % (label, self.durations.count),
+            'tomahawk_host_duration_seconds_sum{%s} %.3f' % (label, self.durations.sum),
+            'tomahawk_host_duration_seconds_count{%s} %d' % (label, self.durations.count),
+            '# HELP tomahawk_output_bytes_total Bytes of output of hosts.',
+            '# TYPE tomahawk_output_bytes_total counter',
+            'tomahawk_output_bytes_total{%s} %d' % (label, self.output_bytes),
+            '# HELP tomahawk_run_duration_seconds Elapsed time of the run.',
+            '# TYPE tomahawk_run_duration_seconds gauge',
+            'tomahawk_run_duration_seconds{%s} %.3f' % (label, time.time() - self.started_at),
+            '# HELP tomahawk_run_finished 1 if the run is finished, 0 while running.',
+            '# TYPE tomahawk_run_finished gauge',
+            'tomahawk_run_finished{%s} %d' % (label, int(finished)),
+            '# HELP tomahawk_run_start_time_seconds Start time of the run since epoch.',
+            '# TYPE tomahawk_run_start_time_seconds gauge',
+            'tomahawk_run_start_time_seconds{%s} %.3f' % (label, self.started_at),
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def update(self):
+        """
+        Flush metrics if the interval passed. Called while waiting results.
+        """
+        now = time.time()
+        if self.statsd is not None and now - self.statsd_flushed_at >= self.statsd_interval:
+            self.statsd.flush()
+            self.statsd_flushed_at = now
+        if self.textfile is not None and now - self.textfile_written_at >= self.textfile_interval:
+            write_textfile(self.textfile, self.prometheus_text(False))
+            self.textfile_written_at = now
+
+    def close(self):
+        if self.statsd is not None:
+            self.statsd.add('run_duration', int((time.time() - self.started_at) * 1000), 'ms')
+            self.statsd.close()
+            self.statsd = None
+        if self.textfile is not None:
+            write_textfile(self.textfile, self.prometheus_text(True))
+            self.textfile = None
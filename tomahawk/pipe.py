@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from tomahawk.constants import (
+    DEFAULT_TIMEOUT,
+    TimeoutError
+)
+from tomahawk.log import create_logger
+
+READ_SIZE = 65536
+
+class CommandWithPipe(object):
+    """
+    A command executor through plain pipes without pty and expect.
+    It is used when no password is required, so password prompts are not scanned.
+    stdin of the command is input (bytes) or a file at stdin_path (e.g. a fifo) if specified.
+    """
+    def __init__(
+        self, command, command_args, timeout = DEFAULT_TIMEOUT,
+        debug_enabled = False, input = None, stdin_path = None
+    ):
+        self.command = command
+        self.command_args = command_args
+        self.timeout = timeout
+        self.input = input
+        self.stdin_path = stdin_path
+        self.log = create_logger(None, debug_enabled)
+        self.stdout, self.stderr = b'', b''
+        self.log.debug("command = %s, command_args = %s" % (command, str(command_args)))
+
+    def execute(self):
+        """
+        Execute a command with pipes.
+
+        Returns: command result status, output string
+        """
+        started_at = time.time()
+        stdin = None
+        if self.stdin_path is not None:
+            stdin = open_fifo(self.stdin_path, self.timeout)
+        elif self.input is None:
+            stdin = open(os.devnull, 'rb')
+        process = subprocess.Popen(
+            [ self.command ] + list(self.command_args),
+            stdin = stdin or subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+            close_fds = True
+        )
+        if stdin is not None:
+            stdin.close()
+        try:
+            remaining = self.timeout - (time.time() - started_at)
+            self.stdout, self.stderr = communicate(process, self.input, remaining, self.timeout)
+        except TimeoutError:
+            self.log.debug("pipe timed out")
+            kill(process)
+            raise
+
+        exit_status = process.returncode
+        if exit_status is None or exit_status < 0:
+            # killed by a signal
+            exit_status = 1
+        self.log.debug("exit_status = %d" % exit_status)
+        return exit_status, self.get_output()
+
+    def get_output(self):
+        """
+        Returns: stdout and then stderr of the command, without trailing newlines.
+        """
+        outputs = []
+        for data in (self.stdout, self.stderr):
+            text = data.decode('utf-8', 'replace').replace('\r\n', '\n').rstrip('\n')
+            if text != '':
+                outputs.append(text)
+        output_text = '\n'.join(outputs)
+        self.log.debug("output_text = " + output_text)
+        return output_text
+
+def open_fifo(path, timeout):
+    """
+    Open a fifo for reading. Opening a fifo blocks until a writer opens it,
+    so it is opened in a thread and given up after timeout seconds.
+
+    Returns: file of the fifo
+    """
+    result = []
+    def open_():
+        try:
+            result.append(open(path, 'rb'))
+        except (IOError, OSError):
+            result.append(sys.exc_info()[1])
+    opener = threading.Thread(target = open_)
+    opener.daemon = True
+    opener.start()
+    opener.join(timeout)
+    timed_out = len(result) == 0
+    if timed_out:
+        # open the fifo as a writer to wake up the thread
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+        opener.join()
+    opened = result[0]
+    if isinstance(opened, (IOError, OSError)):
+        raise opened
+    if timed_out:
+        opened.close()
+        raise TimeoutError("Execution is timed out after %d seconds" % (timeout))
+    return opened
+
+def communicate(process, input, remaining, timeout):
+    """
+    Write input to stdin of the process and read its stdout and stderr
+    until the process exits or remaining seconds passed.
+
+    Returns: (stdout bytes, stderr bytes)
+    """
+    deadline = time.time() + remaining
+    stdout_fd, stderr_fd = process.stdout.fileno(), process.stderr.fileno()
+    outputs = { stdout_fd: [], stderr_fd: [] }
+    readers = [ stdout_fd, stderr_fd ]
+    writers = []
+    offset = 0
+    if input is not None:
+        if len(input) > 0:
+            writers.append(process.stdin.fileno())
+        else:
+            process.stdin.close()
+
+    while readers or writers:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("Execution is timed out after %d seconds" % (timeout))
+        try:
+            readable, writable, exceptional = select.select(readers, writers, [], remaining)
+        except (select.error, OSError):
+            e = sys.exc_info()[1]
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd in writable:
+            try:
+                offset += os.write(fd, input[offset:offset + READ_SIZE])
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.errno != errno.EPIPE:
+                    raise
+                # the command exited without reading all input
+                offset = len(input)
+            if offset >= len(input):
+                writers.remove(fd)
+                process.stdin.close()
+
+        for fd in readable:
+            data = os.read(fd, READ_SIZE)
+            if data:
+                outputs[fd].append(data)
+            else:
+                readers.remove(fd)
+
+    # stdout and stderr are closed, so the process is exiting
+    process.wait()
+    process.stdout.close()
+    process.stderr.close()
+    return b''.join(outputs[stdout_fd]), b''.join(outputs[stderr_fd])
+
+def kill(process):
+    try:
+        os.kill(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    process.wait()
+    for f in (process.stdin, process.stdout, process.stderr):
+        if f is not None and not f.closed:
+            f.close()
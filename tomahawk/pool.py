@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+from tomahawk.constants import DEFAULT_MAX_TASKS_PER_CHILD
+
+# Modules loaded once in the forkserver process and shared by all workers
+PRELOAD_MODULES = [
+    'pexpect',
+    'tomahawk.expect',
+    'tomahawk.pipe',
+    'tomahawk.command',
+    'tomahawk.rsync',
+]
+
+# (processes, max_tasks_per_child, forkserver) -> a pool
+_shared_pools = {}
+
+def create_process_pool(processes, forkserver = False, max_tasks_per_child = None):
+    """
+    Create a process pool for executors.
+
+    Args:
+    processes -- number of worker processes
+    forkserver -- create workers from a forkserver which preloads tomahawk and pexpect
+    max_tasks_per_child -- recycle a worker after it executes this number of tasks
+
+    Returns: multiprocessing.Pool
+    """
+    kwargs = { 'processes': processes }
+    if max_tasks_per_child:
+        kwargs['maxtasksperchild'] = max_tasks_per_child
+    if forkserver:
+        context = get_forkserver_context()
+        if context is not None:
+            return context.Pool(**kwargs)
+    return multiprocessing.Pool(**kwargs)
+
+def get_forkserver_context():
+    """
+    Returns: a forkserver context, or None if the platform doesn't support it
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        return None
+    try:
+        context = multiprocessing.get_context('forkserver')
+    except ValueError:
+        return None
+    context.set_forkserver_preload(PRELOAD_MODULES)
+    return context
+
+def get_shared_pool(processes, max_tasks_per_child = DEFAULT_MAX_TASKS_PER_CHILD, forkserver = True):
+    """
+    Returns a pre-warmed forkserver pool shared by executors in this process.
+    Give it to an executor as process_pool keyword argument, then the executor
+    doesn't terminate it. Pools are shared only when all arguments are the same.
+    """
+    key = (processes, max_tasks_per_child, forkserver)
+    pool = _shared_pools.get(key)
+    if pool is None:
+        pool = create_process_pool(processes, forkserver, max_tasks_per_child)
+        _shared_pools[key] = pool
+    return pool
+
+def terminate_shared_pools():
+    for key in list(_shared_pools.keys()):
+        pool = _shared_pools.pop(key)
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import collections
+import errno
+import os
+import socket
+import sys
+import threading
+import time
+
+from six.moves import queue
+
+from tomahawk.constants import (
+    DEFAULT_PREFLIGHT_PORT,
+    DEFAULT_PREFLIGHT_TIMEOUT,
+    RESERVED_FDS,
+)
+from tomahawk.utils import raise_file_limit, wait_writable
+
+IN_PROGRESS_ERRORS = (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK)
+# errors of socket() when too many files are open
+FILE_LIMIT_ERRORS = (errno.EMFILE, errno.ENFILE)
+# threads to resolve host names concurrently, because getaddrinfo(3) blocks
+RESOLVER_THREADS = 16
+# seconds to wait for connections while resolving other hosts
+RESOLVE_POLL_INTERVAL = 0.01
+
+def probe_hosts(hosts, port = DEFAULT_PREFLIGHT_PORT, timeout = DEFAULT_PREFLIGHT_TIMEOUT):
+    """
+    Resolve all hosts concurrently, open non-blocking TCP connections to the ssh port
+    as soon as each host is resolved and wait for them until the deadline.
+    When a host has more than one address, the next address is tried if a connection fails.
+    When no file descriptor is left, hosts wait for other connections to finish.
+
+    Args:
+    hosts -- target hosts
+    port -- port number to connect
+    timeout -- deadline in seconds for all resolutions and connections
+
+    Returns: a dict which maps an unreachable host to an error message
+    """
+    deadline = time.time() + timeout
+    hosts = list(set(hosts))
+    raise_file_limit(len(hosts) + RESERVED_FDS)
+    resolved = _start_resolvers(hosts, port)
+    resolving = len(hosts)
+    unreachable = {}
+    # host -> addresses not tried yet
+    addresses = {}
+    # fd -> (socket, host)
+    pending = {}
+    # hosts waiting for a file descriptor
+    waiting = collections.deque()
+    while resolving > 0 or pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        if resolving > 0:
+            # wait for a resolution only while no connection is pending
+            results = _get_resolved(resolved, len(pending) == 0, remaining)
+            resolving -= len(results)
+            for host, result in results:
+                if isinstance(result, Exception):
+                    unreachable[host] = _message(host, port, _strerror(result))
+                    continue
+                addresses[host] = result
+                if len(waiting) > 0:
+                    waiting.append(host)
+                else:
+                    _connect_next(host, port, addresses, pending, unreachable, waiting, None)
+            if len(pending) == 0:
+                continue
+            remaining = min(remaining, RESOLVE_POLL_INTERVAL)
+        for fd in wait_writable(list(pending.keys()), remaining):
+            sock, host = pending.pop(fd)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            sock.close()
+            if error != 0:
+                _connect_next(host, port, addresses, pending, unreachable, waiting, os.strerror(error))
+        # file descriptors of finished connections are available
+        while len(waiting) > 0:
+            if _connect_next(waiting.popleft(), port, addresses, pending, unreachable, waiting, None):
+                break
+
+    timed_out_hosts = [ host for sock, host in pending.values() ] + list(waiting)
+    for sock, host in pending.values():
+        sock.close()
+    for host in timed_out_hosts:
+        unreachable[host] = _message(host, port, 'Connection timed out after %s seconds' % (timeout))
+    for host in hosts:
+        if host not in addresses and host not in unreachable:
+            unreachable[host] = _message(host, port, 'Name resolution timed out after %s seconds' % (timeout))
+
+    return unreachable
+
+def _start_resolvers(hosts, port):
+    """
+    Resolve hosts in daemon threads, so a slow DNS server never delays the deadline.
+
+    Returns: a queue of (host, a list of addresses or an exception)
+    """
+    requests, resolved = queue.Queue(), queue.Queue()
+    for host in hosts:
+        requests.put(host)
+    def resolve():
+        while True:
+            try:
+                host = requests.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = [ info[:3] + info[4:] for info in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM) ]
+            except (socket.error, socket.gaierror):
+                result = sys.exc_info()[1]
+            resolved.put((host, result))
+    for i in range(min(RESOLVER_THREADS, len(hosts))):
+        thread = threading.Thread(target = resolve)
+        thread.daemon = True
+        thread.start()
+    return resolved
+
+def _get_resolved(resolved, block, timeout):
+    """
+    Returns: a list of (host, result) resolved so far. Waits for one if block is True.
+    """
+    results = []
+    try:
+        if block:
+            results.append(resolved.get(True, timeout))
+        while True:
+            results.append(resolved.get_nowait())
+    except queue.Empty:
+        pass
+    return results
+
+def _connect_next(host, port, addresses, pending, unreachable, waiting, error):
+    """
+    Start a connection to the next address of host.
+    The host is unreachable when no address is left.
+    When no file descriptor is left, the host is appended to waiting
+    unless no connection is pending, which would release one.
+
+    Args:
+    error -- an error message of the last address
+
+    Returns: True if the host is appended to waiting
+    """
+    while len(addresses[host]) > 0:
+        family, socktype, proto, address = addresses[host][0]
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(0)
+            result = sock.connect_ex(address)
+        except socket.error:
+            e = sys.exc_info()[1]
+            if sock is None and e.args[0] in FILE_LIMIT_ERRORS and len(pending) > 0:
+                waiting.appendleft(host)
+                return True
+            addresses[host].pop(0)
+            error = _strerror(e)
+            if sock is not None:
+                sock.close()
+            continue
+        addresses[host].pop(0)
+        if result == 0:
+            sock.close()
+            return False
+        if result in IN_PROGRESS_ERRORS:
+            pending[sock.fileno()] = (sock, host)
+            return False
+        error = os.strerror(result)
+        sock.close()
+    unreachable[host] = _message(host, port, error or 'No address')
+    return False
+
+def _message(host, port, reason):
+    return 'ssh: connect to host %s port %d: %s' % (host, port, reason)
+
+def _strerror(e):
+    if len(getattr(e, 'args', ())) > 1:
+        return str(e.args[1])
+    return str(e)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+
+from tomahawk.constants import (
+    DEFAULT_PROGRESS_INTERVAL,
+    PROGRESS_RATE_WINDOW,
+)
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%dh%02dm' % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % (seconds)
+
+class Progress(object):
+    """
+    A status line of an execution on a terminal.
+    Results only update counters, and the line is redrawn at most once per interval
+    while waiting results.
+    """
+    def __init__(
+        self, stream, total, workers,
+        interval = DEFAULT_PROGRESS_INTERVAL, rate_window = PROGRESS_RATE_WINDOW
+    ):
+        self.stream = stream
+        self.total = total
+        self.workers = workers
+        self.interval = interval
+        self.rate_window = rate_window
+        self.succeeded = 0
+        self.failed = 0
+        # times of recent completions to compute the current rate
+        self.completions = collections.deque()
+        self.started_at = time.time()
+        self.drawn_at = 0
+        self.drawn = False
+
+    def finished(self, succeeded):
+        if succeeded:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.completions.append(time.time())
+
+    def rate(self, now):
+        """
+        Returns: completions per second in the last rate_window seconds
+        """
+        while len(self.completions) > 0 and now - self.completions[0] > self.rate_window:
+            self.completions.popleft()
+        elapsed = min(self.rate_window, now - self.started_at)
+        if elapsed <= 0:
+            return 0.0
+        return len(self.completions) / elapsed
+
+    def format(self, now, submitted):
+        """
+        Args:
+        now -- current time
+        submitted -- number of unfinished hosts which are submitted to the process pool
+        """
+        remaining = self.total - self.succeeded - self.failed
+        running = min(submitted, self.workers)
+        rate = self.rate(now)
+        eta = '-'
+        if rate > 0:
+            eta = format_duration(remaining / rate)
+        return 'done %d/%d, failed %d, running %d, queued %d | %.1f hosts/s, ETA %s | workers %d/%d' % (
+            self.succeeded + self.failed, self.total, self.failed,
+            running, remaining - running, rate, eta, running, self.workers
+        )
+
+    def update(self, submitted):
+        now = time.time()
+        if now - self.drawn_at < self.interval:
+            return
+        self.stream.write('\r\033[K' + self.format(now, submitted))
+        self.stream.flush()
+        self.drawn_at = now
+        self.drawn = True
+
+    def clear(self):
+        """
+        Erase the line before other output is written.
+        """
+        if not self.drawn:
+            return
+        self.stream.write('\r\033[K')
+        self.stream.flush()
+        self.drawn = False
+        # redraw after the next interval to avoid flickering
+        self.drawn_at = time.time()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reducers of --reduce. Output of each host is folded as it arrives,
+so memory usage depends on size of the answer, not on number of hosts.
+"""
+import heapq
+import math
+
+HISTOGRAM_BAR_WIDTH = 40
+
+def format_number(value):
+    if abs(value) < 1e15 and value == int(value):
+        return '%d' % (value)
+    return '%.6g' % (value)
+
+def parse_field(line, field):
+    """
+    Returns: a number in field (1 origin) of a line split by whitespaces, or None
+    """
+    fields = line.split()
+    if len(fields) < field:
+        return None
+    try:
+        value = float(fields[field - 1])
+    except ValueError:
+        return None
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return value
+
+class Reducer(object):
+    """
+    A base class of reducers. Sub classes fold output of a host in add and return lines in format_result.
+    """
+    def __init__(self):
+        self.hosts = 0
+        # lines which have no number in field
+        self.ignored = 0
+
+    def format(self):
+        """
+        Returns: lines of the result
+        """
+        lines = self.format_result()
+        if self.ignored > 0:
+            lines.append('(%d lines without numbers are ignored)' % (self.ignored))
+        return lines
+
+class NumericReducer(Reducer):
+    """
+    A base class of reducers which fold a number in field of each non-empty line of output with add_value.
+    """
+    field = 1
+
+    def add(self, host, output):
+        self.hosts += 1
+        for line in output.splitlines():
+            if line.strip() == '':
+                continue
+            value = parse_field(line, self.field)
+            if value is None:
+                self.ignored += 1
+                continue
+            self.add_value(host, value, line)
+
+class CountDistinctReducer(Reducer):
+    """
+    Count hosts by distinct output.
+    """
+    def __init__(self):
+        super(CountDistinctReducer, self).__init__()
+        self.counts = {}
+
+    def add(self, host, output):
+        self.hosts += 1
+        output = output.replace('\r\n', '\n').strip()
+        self.counts[output] = self.counts.get(output, 0) + 1
+
+    def format_result(self):
+        counts = sorted(self.counts.items(), key = lambda c: (-c[1], c[0]))
+        width = len(str(self.hosts))
+        lines = []
+        for output, count in counts:
+            # indent lines of multi-line output
+            lines.append('%*d  %s' % (width, count, output.replace('\n', '\n' + ' ' * (width + 2))))
+        return lines
+
+class HistogramReducer(NumericReducer):
+    """
+    Count values in buckets of width, or of powers of 2 when width is not specified.
+    """
+    def __init__(self, width = None):
+        super(HistogramReducer, self).__init__()
+        self.width = width
+        # lower bound -> count
+        self.counts = {}
+
+    def bucket(self, value):
+        """
+        Returns: (lower bound, upper bound) of a bucket of value
+        """
+        if self.width is not None:
+            lower = math.floor(value / self.width) * self.width
+            return lower, lower + self.width
+        if value < 0:
+            return float('-inf'), 0
+        if value < 1:
+            return 0, 1
+        lower = 2 ** int(math.floor(math.log(value, 2)))
+        if lower * 2 <= value:
+            # an error of floating point numbers
+            lower *= 2
+        return lower, lower * 2
+
+    def add_value(self, host, value, line):
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def format_result(self):
+        if len(self.counts) == 0:
+            return []
+        labels = [ '[%s, %s)' % (format_number(l), format_number(u)) for l, u in sorted(self.counts.keys()) ]
+        label_width = max([ len(l) for l in labels ])
+        max_count = max(self.counts.values())
+        count_width = len(str(max_count))
+        lines = []
+        for label, bucket in zip(labels, sorted(self.counts.keys())):
+            count = self.counts[bucket]
+            bar = '#' * int(math.ceil(float(count) * HISTOGRAM_BAR_WIDTH / max_count))
+            lines.append('%-*s  %*d  %s' % (label_width, label, count_width, count, bar))
+        return lines
+
+class SumReducer(NumericReducer):
+    def __init__(self):
+        super(SumReducer, self).__init__()
+        self.sum = 0.0
+        self.count = 0
+
+    def add_value(self, host, value, line):
+        self.sum += value
+        self.count += 1
+
+    def format_result(self):
+        return [ 'sum: %s (%d values)' % (format_number(self.sum), self.count) ]
+
+class MinReducer(NumericReducer):
+    name = 'min'
+
+    def __init__(self):
+        super(MinReducer, self).__init__()
+        self.value = None
+        self.host = None
+
+    def better(self, value):
+        return value < self.value
+
+    def add_value(self, host, value, line):
+        if self.value is None or self.better(value):
+            self.value = value
+            self.host = host
+
+    def format_result(self):
+        if self.value is None:
+            return [ '%s: no values' % (self.name) ]
+        return [ '%s: %s (%s)' % (self.name, format_number(self.value), self.host) ]
+
+class MaxReducer(MinReducer):
+    name = 'max'
+
+    def better(self, value):
+        return value > self.value
+
+class TopReducer(NumericReducer):
+    """
+    Keep k lines with the largest numbers in field with a heap.
+    """
+    def __init__(self, k, field = 1):
+        super(TopReducer, self).__init__()
+        self.k = k
+        self.field = field
+        # a min-heap of (value, sequence, host, line)
+        self.heap = []
+        self.sequence = 0
+
+    def add_value(self, host, value, line):
+        # sequence keeps the first line when values are the same
+        item = (value, -self.sequence, host, line)
+        self.sequence += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def format_result(self):
+        items = sorted(self.heap, reverse = True)
+        width = max([ len(h) for v, s, h, l in items ] + [ 0 ])
+        return [ '%-*s  %s' % (width, host, line) for value, sequence, host, line in items ]
+
+def parse_positive_integer(text):
+    if not text.isdigit() or int(text) == 0:
+        raise ValueError('a positive integer required: ' + text)
+    return int(text)
+
+def create_reducer(spec):
+    """
+    Create a reducer from a spec of --reduce.
+    count-distinct, histogram[:WIDTH], sum, min, max, top:K[:FIELD]
+
+    Returns: Reducer
+    """
+    name, separator, argument = spec.partition(':')
+    arguments = []
+    if separator:
+        arguments = argument.split(':')
+    if name in ('count-distinct', 'sum', 'min', 'max') and len(arguments) == 0:
+        return {
+            'count-distinct': CountDistinctReducer,
+            'sum': SumReducer,
+            'min': MinReducer,
+            'max': MaxReducer,
+        }[name]()
+    if name == 'histogram' and len(arguments) <= 1:
+        if len(arguments) == 0:
+            return HistogramReducer()
+        width = float(arguments[0])
+        if not width > 0:
+            raise ValueError('Width of histogram must be positive: ' + arguments[0])
+        return HistogramReducer(width)
+    if name == 'top' and 1 <= len(arguments) <= 2:
+        k = parse_positive_integer(arguments[0])
+        field = 1
+        if len(arguments) == 2:
+            field = parse_positive_integer(arguments[1])
+        return TopReducer(k, field)
+    raise ValueError('Invalid reducer: ' + spec)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from six.moves import shlex_quote
+
+from tomahawk.constants import (
+    CONNECTION_ERROR_EXIT_STATUS,
+    TimeoutError
+)
+from tomahawk.pipe import READ_SIZE
+
+RESULT_HEADER = 'TOMAHAWK-RELAY-RESULT'
+# the last field of a result header
+RESULT_EXITED = 'exited'
+RESULT_TIMED_OUT = 'timeout'
+# seconds to wait for the relay host itself in addition to timeouts of its hosts
+RELAY_DEADLINE_MARGIN = 30
+
+# A sub fan-out executed by "sh -s" on a relay host.
+# Each result is sent back as "TOMAHAWK-RELAY-RESULT <index> <status> <bytes> <exited|timeout>\n<output>"
+# A watchdog kills ssh to a host after timeout seconds and leaves a marker,
+# so that a timeout is not confused with a command which exits with 124.
+RELAY_SCRIPT_TEMPLATE = """\
+remote_command=%(remote_command)s
+parallel=%(parallel)d
+tmp=$(mktemp -d /tmp/tomahawk-relay.XXXXXX) || exit 255
+trap 'rm -rf "$tmp"' EXIT
+mkfifo "$tmp/done" || exit 255
+exec 3<>"$tmp/done"
+run() {
+  %(ssh)s "$1" "$remote_command" > "$tmp/$2" 2>&1 < /dev/null &
+  pid=$!
+  (
+    trap 'kill $sleep_pid 2>/dev/null; exit 0' TERM
+    sleep %(timeout)d &
+    sleep_pid=$!
+    wait $sleep_pid
+    touch "$tmp/$2.timeout"
+    kill $pid
+  ) 2>/dev/null &
+  watchdog=$!
+  wait $pid
+  status=$?
+  kill $watchdog 2>/dev/null
+  wait $watchdog
+  result=%(exited)s
+  if [ -e "$tmp/$2.timeout" ]; then
+    result=%(timed_out)s
+  fi
+  echo "$2 $status $result" >&3
+}
+emit() {
+  read done_index done_status done_result <&3
+  echo "%(header)s $done_index $done_status $(wc -c < "$tmp/$done_index" | tr -d ' ') $done_result"
+  cat "$tmp/$done_index"
+  rm -f "$tmp/$done_index" "$tmp/$done_index.timeout"
+  running=$((running - 1))
+}
+set -- %(hosts)s
+index=0
+running=0
+for host in "$@"; do
+  if [ $running -ge $parallel ]; then
+    emit
+  fi
+  run "$host" $index &
+  index=$((index + 1))
+  running=$((running + 1))
+done
+while [ $running -gt 0 ]; do
+  emit
+done
+"""
+
+def read_relays_file(path):
+    """
+    Read a relays file. Each line is a relay host and hosts behind it.
+
+      bastion.dc1 web01.dc1 web02.dc1
+      bastion.dc2 web01.dc2
+
+    Returns: a dict which maps a host to its relay host
+    """
+    relays = {}
+    for line in open(path):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        fields = line.split()
+        for host in fields[1:]:
+            relays[host] = fields[0]
+    return relays
+
+def group_hosts_by_relay(hosts, relays):
+    """
+    Returns: (a list of (relay, hosts behind the relay), hosts executed directly)
+    """
+    groups = []
+    relay_hosts = {}
+    direct_hosts = []
+    for host in hosts:
+        relay = relays.get(host)
+        if relay is None:
+            direct_hosts.append(host)
+            continue
+        if relay not in relay_hosts:
+            relay_hosts[relay] = []
+            groups.append((relay, relay_hosts[relay]))
+        relay_hosts[relay].append(host)
+    return groups, direct_hosts
+
+def create_relay_script(hosts, remote_command, ssh_options, parallel, timeout):
+    ssh = ' '.join([ 'ssh', '-n', '-o', 'BatchMode=yes' ] + [ shlex_quote(o) for o in ssh_options ])
+    return RELAY_SCRIPT_TEMPLATE % {
+        'remote_command': shlex_quote(remote_command),
+        'parallel': parallel,
+        'timeout': timeout,
+        'ssh': ssh,
+        'header': RESULT_HEADER,
+        'exited': RESULT_EXITED,
+        'timed_out': RESULT_TIMED_OUT,
+        'hosts': ' '.join([ shlex_quote(h) for h in hosts ]),
+    }
+
+class RelayResultParser(object):
+    """
+    Parse results streamed from a relay host.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header = None
+
+    def feed(self, data):
+        """
+        Returns: a list of (index, exit_status, timed_out, output bytes) completed by data
+        """
+        self.buffer += data
+        results = []
+        while True:
+            if self.header is None:
+                end = self.buffer.find(b'\n')
+                if end == -1:
+                    break
+                fields = bytes(self.buffer[:end]).decode('utf-8', 'replace').split()
+                del self.buffer[:end + 1]
+                if len(fields) != 5 or fields[0] != RESULT_HEADER:
+                    # not a result (e.g. motd of the relay)
+                    continue
+                self.header = (int(fields[1]), int(fields[2]), fields[4] == RESULT_TIMED_OUT, int(fields[3]))
+            index, exit_status, timed_out, size = self.header
+            if len(self.buffer) < size:
+                break
+            results.append((index, exit_status, timed_out, bytes(self.buffer[:size])))
+            del self.buffer[:size]
+            self.header = None
+        return results
+
+class RelayExecution(threading.Thread):
+    """
+    Execute a command on hosts behind a relay host through one ssh connection
+    to the relay. Results of hosts are available as soon as they are received.
+    """
+    def __init__(
+        self, relay, hosts, remote_command, ssh_options,
+        parallel, timeout, log
+    ):
+        super(RelayExecution, self).__init__()
+        self.daemon = True
+        self.relay = relay
+        self.hosts = hosts
+        self.remote_command = remote_command
+        self.ssh_options = ssh_options
+        self.parallel = parallel
+        self.timeout = timeout
+        self.log = log
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def deadline(self):
+        """
+        Returns: time when the relay is killed. Connecting to the relay takes up to timeout seconds,
+        hosts are executed in rounds of parallel and each host is killed on the relay after timeout seconds.
+        """
+        rounds = (len(self.hosts) + self.parallel - 1) // self.parallel
+        return time.time() + self.timeout * (rounds + 1) + RELAY_DEADLINE_MARGIN
+
+    def run(self):
+        script = create_relay_script(
+            self.hosts, self.remote_command, self.ssh_options,
+            self.parallel, self.timeout
+        )
+        deadline = self.deadline()
+        error = None
+        timed_out = False
+        # stderr is drained to a file, so the relay never blocks on writing it
+        stderr = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen(
+                [ 'ssh' ] + self.ssh_options
+                + [ '-o', 'ConnectTimeout=%d' % (self.timeout), '-T', self.relay, '/bin/sh', '-s' ],
+                stdin = subprocess.PIPE,
+                stdout = subprocess.PIPE,
+                stderr = stderr,
+                close_fds = True
+            )
+            process.stdin.write(script.encode('utf-8'))
+            process.stdin.close()
+            parser = RelayResultParser()
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                try:
+                    readable, writable, exceptional = select.select([ process.stdout ], [], [], remaining)
+                except (select.error, OSError):
+                    e = sys.exc_info()[1]
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not readable:
+                    continue
+                data = os.read(process.stdout.fileno(), READ_SIZE)
+                if not data:
+                    break
+                for index, exit_status, host_timed_out, output in parser.feed(data):
+                    self.set_result(self.hosts[index], exit_status, output, host_timed_out)
+            if timed_out:
+                self.log.debug("relay = %s timed out" % (self.relay))
+                process.kill()
+            exit_status = process.wait()
+            process.stdout.close()
+            self.log.debug("relay = %s, exit_status = %d" % (self.relay, exit_status))
+            stderr.seek(0)
+            error = stderr.read().decode('utf-8', 'replace').strip()
+        except (OSError, IOError):
+            error = str(sys.exc_info()[1])
+        finally:
+            stderr.close()
+
+        # hosts which have no result because of a relay failure
+        message = 'Failed to execute through relay "%s"' % (self.relay)
+        if error:
+            message += ': ' + error
+        for host in self.hosts:
+            if host not in self.results:
+                self.set_result(host, CONNECTION_ERROR_EXIT_STATUS, message.encode('utf-8'), timed_out)
+
+    def set_result(self, host, exit_status, output, timed_out = False):
+        self.lock.acquire()
+        try:
+            self.results[host] = (exit_status, output.decode('utf-8', 'replace').rstrip('\n'), timed_out)
+        finally:
+            self.lock.release()
+
+    def get_result(self, host):
+        self.lock.acquire()
+        try:
+            return self.results.get(host)
+        finally:
+            self.lock.release()
+
+class RelayHostResult(object):
+    """
+    A result of a host behind a relay.
+    It behaves like multiprocessing.pool.AsyncResult.
+    """
+    def __init__(self, execution, host):
+        self.execution = execution
+        self.host = host
+
+    def ready(self):
+        return self.execution.get_result(self.host) is not None
+
+    def get(self, timeout = None):
+        exit_status, output, timed_out = self.execution.get_result(self.host)
+        if timed_out:
+            raise TimeoutError("Execution is timed out after %d seconds" % (self.execution.timeout))
+        return exit_status, output
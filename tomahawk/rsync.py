@@ -1,20 +1,44 @@
 # -*- coding: utf-8 -*-
 import argparse
 import getpass
+import json
 import os
+import shlex
 import signal
 import sys
+import shutil
+import tempfile
+import threading
 import time
 
-from tomahawk.base import BaseContext, BaseMain, BaseExecutor
+from six import print_
+from six.moves import shlex_quote
+
+from tomahawk.base import BaseContext, BaseMain, BaseExecutor, FinishedResult
 from tomahawk.color import (
     create_coloring_object
 )
 from tomahawk.constants import (
+    CONNECTION_ERROR_EXIT_STATUS,
+    DEFAULT_HASH_CACHE_FILE,
     DEFAULT_RSYNC_OUTPUT_FORMAT,
     DEFAULT_RSYNC_OPTIONS,
 )
 from tomahawk.expect import CommandWithExpect
+from tomahawk.pipe import CommandWithPipe
+from tomahawk.stats import (
+    aggregate_stats,
+    format_summary,
+    parse_rsync_stats
+)
+from tomahawk.stamp import (
+    HashCache,
+    create_read_stamps_command,
+    create_stamp,
+    create_write_stamps_command,
+    parse_stamps
+)
+from tomahawk.streams import list_files, partition_files, write_file_lists
 from tomahawk.utils import (
     shutdown_by_signal,
     check_required_command
@@ -35,6 +59,12 @@ class RsyncMain(BaseMain):
 
     def __init__(self, file):
         super(RsyncMain, self).__init__(file)
+        if not getattr(self.options, 'manifest', None) \
+                and (self.options.source is None or self.options.destination is None):
+            self.arg_parser.error('source and destination are required without --manifest')
+        streams = getattr(self.options, 'streams', None) or 1
+        if streams < 1:
+            self.arg_parser.error('--streams must be positive')
         self.log.debug("options = " + str(self.options))
         self.log.debug(
             "source = %s, destination = %s" % \
@@ -49,14 +79,19 @@ class RsyncMain(BaseMain):
             sys.stdout,
             sys.stderr
         )
+        if self.context.options.get('breaker_report'):
+            return self.report_circuit_breaker()
         check_required_command('rsync')
         hosts = self.check_hosts()
 
-        rsync_command = 'rsync %s %s %s' % (
-            self.context.options['rsync_options'],
-            self.context.source,
-            self.context.destination
-        )
+        if self.context.options.get('manifest'):
+            rsync_command = 'rsync --manifest %s' % (self.context.options['manifest'])
+        else:
+            rsync_command = 'rsync %s %s %s' % (
+                self.context.options['rsync_options'],
+                self.context.source,
+                self.context.destination
+            )
         color = create_coloring_object(sys.stdout)
         # prompt when production environment
         self.confirm_execution_on_production(
@@ -75,10 +110,30 @@ class RsyncMain(BaseMain):
             conflict_handler = 'resolve'
         )
         parser.add_argument(
-            'source', metavar='source', help='source',
+            'source', metavar='source', nargs='?', help='source',
         )
         parser.add_argument(
-            'destination', metavar='destination', help='destination',
+            'destination', metavar='destination', nargs='?', help='destination',
+        )
+        parser.add_argument(
+            '--manifest', metavar='FILE',
+            help='Execute rsync for each "source destination [rsync options]" line of FILE on each host.'
+        )
+        parser.add_argument(
+            '--skip-synced', action='store_true',
+            help='Skip hosts whose source is not changed since the last rsync, by stamp files on hosts. (push only)'
+        )
+        parser.add_argument(
+            '--streams', metavar='NUM', type=int, default=1,
+            help='Split files of the source directory into NUM partitions balanced by size and execute NUM rsync to each host concurrently. (push only, up to --parallel)'
+        )
+        parser.add_argument(
+            '--stats', action='store_true',
+            help='Execute rsync with --stats and show a summary of transfers of all hosts.'
+        )
+        parser.add_argument(
+            '--stats-json', metavar='FILE',
+            help='Write transfer stats of each host and the summary to FILE as JSON. ("-" means stdout)'
         )
         parser.add_argument(
             '-u', '--rsync-user', help='rsync user.'
@@ -121,6 +176,150 @@ def _rsync(command, login_password, timeout, expect_delay, debug_enabled):
         print_tb(sys.exc_info()[2])
         raise
 
+def _rsync_with_pipe(command, timeout, debug_enabled):
+    """
+    Execute rsync without pty and expect.
+    """
+    # Trap SIGINT(Ctrl-C) to quit executing a command
+    signal.signal(signal.SIGINT, shutdown_by_signal)
+
+    try:
+        args = shlex.split(command)
+        return CommandWithPipe(
+            args[0], args[1:], timeout, debug_enabled
+        ).execute()
+    except:
+        from traceback import print_tb
+        print("""%s: %s""" % (sys.exc_info()[0], sys.exc_info()[1]))
+        print_tb(sys.exc_info()[2])
+        raise
+
+def _rsync_manifest(
+    commands, login_password, timeout, expect_delay, debug_enabled,
+    use_pipe, exit_command, ssh_command = None, stamps = None):
+    """
+    Execute rsync commands in order and stop at the first failure.
+    exit_command stops the ssh master connection shared by the commands.
+    With stamps (a list of (key, value) for each command), commands whose stamp on
+    the host is the same are skipped, and stamps are written after rsync succeeds.
+    ssh_command is used to read and write stamps.
+
+    Returns: exit status of the failed command or 0, outputs of commands
+    """
+    def execute_ssh(remote_command):
+        args = ssh_command[1:] + [ remote_command ]
+        if use_pipe:
+            return CommandWithPipe(ssh_command[0], args, timeout, debug_enabled).execute()
+        return CommandWithExpect(
+            ssh_command[0], args, login_password, None,
+            timeout, expect_delay, debug_enabled
+        ).execute()
+
+    outputs = []
+    exit_status = 0
+    try:
+        pending = [ (c, None) for c in commands ]
+        if stamps is not None:
+            status, output = execute_ssh(create_read_stamps_command([ k for k, v in stamps ]))
+            remote_stamps = {}
+            if status == 0:
+                remote_stamps = parse_stamps(output)
+            pending = [ (c, s) for c, s in zip(commands, stamps) if remote_stamps.get(s[0]) != s[1] ]
+            if len(pending) == 0:
+                return 0, 'Already synced. (skipped by stamps)'
+            if len(pending) < len(commands):
+                outputs.append('%d of %d entries are already synced. (skipped by stamps)' \
+                    % (len(commands) - len(pending), len(commands)))
+
+        synced = []
+        for command, stamp in pending:
+            if use_pipe:
+                status, output = _rsync_with_pipe(command, timeout, debug_enabled)
+            else:
+                status, output = _rsync(command, login_password, timeout, expect_delay, debug_enabled)
+            if output != '':
+                outputs.append(output)
+            if status != 0:
+                exit_status = status
+                break
+            synced.append(stamp)
+
+        if exit_status == 0 and stamps is not None:
+            status, output = execute_ssh(create_write_stamps_command(synced))
+            if status != 0:
+                outputs.append('Failed to write stamps: ' + output)
+    finally:
+        if exit_command is not None:
+            CommandWithPipe(exit_command[0], exit_command[1:], timeout, debug_enabled).execute()
+    return exit_status, '\n'.join(outputs)
+
+def _rsync_streams(commands, login_password, timeout, expect_delay, debug_enabled, use_pipe):
+    """
+    Execute rsync commands concurrently.
+
+    Returns: exit status of the first failed command or 0, outputs of commands
+    """
+    # Trap SIGINT(Ctrl-C) to quit executing a command
+    signal.signal(signal.SIGINT, shutdown_by_signal)
+
+    results = [ None ] * len(commands)
+    errors = []
+    def execute(index):
+        command = commands[index]
+        try:
+            if use_pipe:
+                args = shlex.split(command)
+                results[index] = CommandWithPipe(args[0], args[1:], timeout, debug_enabled).execute()
+            else:
+                results[index] = CommandWithExpect(
+                    command, [], login_password, None,
+                    timeout, expect_delay, debug_enabled
+                ).execute()
+        except Exception:
+            errors.append(sys.exc_info()[1])
+
+    threads = [ threading.Thread(target = execute, args = (i,)) for i in range(len(commands)) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        # e.g. TimeoutError
+        raise errors[0]
+
+    exit_status = 0
+    outputs = []
+    for status, output in results:
+        if output != '':
+            outputs.append(output)
+        if status != 0 and exit_status == 0:
+            exit_status = status
+    return exit_status, '\n'.join(outputs)
+
+def read_manifest(path, rsync_options):
+    """
+    Read a manifest file. Each line is source, destination and rsync options (optional).
+
+      /srv/app/releases/ /srv/app/releases/
+      conf/nginx.conf /etc/nginx/nginx.conf -av --checksum
+
+    Returns: a list of (source, destination, rsync options)
+    """
+    pairs = []
+    for line in open(path):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        fields = shlex.split(line)
+        if len(fields) < 2:
+            raise RuntimeError('[error] source and destination are required in manifest: ' + line)
+        options = rsync_options
+        if len(fields) > 2:
+            options = ' '.join([ shlex_quote(f) for f in fields[2:] ])
+        pairs.append((fields[0], fields[1], options))
+    if len(pairs) == 0:
+        raise RuntimeError('[error] No entries in manifest "%s"' % (path))
+    return pairs
 
 class RsyncExecutor(BaseExecutor):
     """
@@ -132,68 +331,109 @@ class RsyncExecutor(BaseExecutor):
     
     Returns: when rsync succeeds, return 0. When errors, return 1
     """
-    def execute(self, source, destination):
-        if source is None:
-            raise RuntimeError('1st argument "source" must not be None')
-        if destination is None:
-            raise RuntimeError('2nd argument "destination" must not be None')
+    # 12: error in rsync protocol data stream, 30: timeout in data send/receive,
+    # 35: timeout waiting for daemon connection
+    TRANSIENT_EXIT_STATUSES = ( 12, 30, 35, CONNECTION_ERROR_EXIT_STATUS )
+    metrics_name = 'rsync'
+    # a directory of ssh control sockets shared by rsync commands in a manifest
+    control_dir = None
+    # a list of (host, stats) with --stats
+    host_stats = None
+    # a directory of file lists of --streams
+    streams_dir = None
 
+    def is_transient_failure(self, exit_status):
+        return exit_status in self.TRANSIENT_EXIT_STATUSES
+
+    def execute(self, source, destination):
         options = self.context.options
-        rsync_user = options.get('rsync_user') or ''
         rsync_options = options.get('rsync_options') or DEFAULT_RSYNC_OPTIONS
         mirror_mode = options.get('mirror_mode') or 'push'
         if mirror_mode not in ('push', 'pull'):
             raise RuntimeError('Invalid mirror_mode: ' + mirror_mode)
 
-        rsync_template = ''
-        if mirror_mode == 'push':
-            if rsync_user:
-                rsync_template = 'rsync %s %s %s@%%s:%s' % (
-                    rsync_options, source,
-                    rsync_user or '[user]', destination)
-            else:
-                rsync_template = 'rsync %s %s %%s:%s' % (
-                    rsync_options, source, destination)
+        if options.get('manifest'):
+            pairs = read_manifest(options['manifest'], rsync_options)
         else:
-            if rsync_user:
-                rsync_template = 'rsync %s %s@%%s:%s %%s' % (
-                    rsync_options, rsync_user, source)
-            else:
-                rsync_template = 'rsync %s %%s:%s %%s' % (
-                    rsync_options, source)
+            if source is None:
+                raise RuntimeError('1st argument "source" must not be None')
+            if destination is None:
+                raise RuntimeError('2nd argument "destination" must not be None')
+            pairs = [ (source, destination, rsync_options) ]
+        if options.get('stats') or options.get('stats_json'):
+            self.host_stats = []
+            pairs = [ (s, d, add_stats_option(o)) for s, d, o in pairs ]
+        stamps = None
+        if options.get('skip_synced'):
+            if mirror_mode != 'push':
+                raise RuntimeError('[error] --skip-synced can be used only in push mode')
+            cache = HashCache(DEFAULT_HASH_CACHE_FILE)
+            stamps = [ create_stamp(s, d, o, cache) for s, d, o in pairs ]
+            cache.save()
+        # (base directory, paths of file lists) of --streams
+        streams = None
+        if (options.get('streams') or 1) > 1:
+            streams = self.create_streams(pairs, mirror_mode, stamps)
+        if (len(pairs) > 1 or stamps is not None) \
+                and len([ o for s, d, o in pairs if has_rsh_option(o) ]) == 0:
+            # rsync commands and stamps for a host share one ssh connection
+            self.control_dir = tempfile.mkdtemp(prefix = 'tomahawk-rsync.')
 
+        skipped_hosts = self.find_skipped_hosts()
         async_results = []
         for host in self.hosts:
-            c = None
-            if mirror_mode == 'push':
-                c = rsync_template % (host)
-            else: # pull
-                dest = destination
-                if os.path.exists(destination):
-                    if os.path.isdir(destination):
-                        # if destination is a directory, gets a source filename and appends a host suffix
-                        file_name = os.path.basename(source)
-                        if not destination.endswith('/'):
-                            dest += '/'
-                        dest += '%s__%s' % (host, file_name)
-                    else:
-                        # if destination is a file, simply appends a host suffix
-                        dest = host + '__' + dest
-                else:
-                     # if file doesn't exist
-                    source_name = os.path.basename(source)
-                    if source.endswith('/'):
-                        os.path.basename(source[0:len(source)-1])
-                    dest += host + '__' + source_name
-                c = rsync_template % (host, dest)
-            
+            commands = [ self.create_rsync_command(host, s, d, o) for s, d, o in pairs ]
+            c = ' && '.join(commands)
+            if self.control_dir is not None:
+                # a path of the control socket is not shown because it changes every time
+                commands = [ self.add_control_options(command) for command in commands ]
+            if streams is not None:
+                # paths of file lists are not shown because they change every time
+                c = '%s (%d streams)' % (c, len(streams[1]))
             self.log.debug('command = "%s"' % (c))
 
-            async_result = self.process_pool.apply_async(
-                _rsync,
-                ( c, self.login_password, options['timeout'], options['expect_delay'], options['debug'] )
-            )
-            async_results.append({ 'host': host, 'command': c, 'async_result': async_result })
+            resumed = self.find_resumed_result(host, c)
+            if resumed is not None:
+                async_results.append({ 'host': host, 'command': c, 'async_result': FinishedResult(resumed) })
+                continue
+            if host in skipped_hosts:
+                async_result = FinishedResult(skipped_hosts[host])
+                async_results.append({ 'host': host, 'command': c, 'async_result': async_result })
+                continue
+
+            if streams is not None:
+                base, file_lists = streams
+                s, d, o = pairs[0]
+                commands = [
+                    self.create_rsync_command(host, base, d, '%s --from0 --files-from=%s' % (o, shlex_quote(f)))
+                    for f in file_lists
+                ]
+                async_results.append(self.submit(
+                    host, c, _rsync_streams,
+                    ( commands, self.login_password, options['timeout'], options['expect_delay'], options['debug'],
+                      self.use_pipe )
+                ))
+            elif len(commands) > 1 or stamps is not None:
+                exit_command = None
+                ssh_command = [ 'ssh', self.remote_host(host) ]
+                if self.control_dir is not None:
+                    exit_command = [ 'ssh', '-o', 'ControlPath=' + self.control_path(), '-O', 'exit', self.remote_host(host) ]
+                    ssh_command = [ 'ssh' ] + self.control_options() + [ self.remote_host(host) ]
+                async_results.append(self.submit(
+                    host, c, _rsync_manifest,
+                    ( commands, self.login_password, options['timeout'], options['expect_delay'], options['debug'],
+                      self.use_pipe, exit_command, ssh_command, stamps )
+                ))
+            elif self.use_pipe:
+                async_results.append(self.submit(
+                    host, c, _rsync_with_pipe,
+                    ( c, options['timeout'], options['debug'] )
+                ))
+            else:
+                async_results.append(self.submit(
+                    host, c, _rsync,
+                    ( c, self.login_password, options['timeout'], options['expect_delay'], options['debug'] )
+                ))
 
             if options['delay'] != 0:
                 time.sleep(options['delay'])
@@ -216,7 +456,7 @@ class RsyncExecutor(BaseExecutor):
             return output
 
         def create_timeout_raise_error_message(color, command, host, timeout):
-            return '"%s" timed out on host "%s" after %d seconds.' % (c, host, timeout)
+            return '"%s" timed out on host "%s" after %d seconds.' % (command, host, timeout)
 
         def create_failure_message(color, output, exit_status):
             output += 'rsync failed ! (status = %d)' % exit_status
@@ -226,15 +466,13 @@ class RsyncExecutor(BaseExecutor):
             return '"%s" failed on host "%s"' % (command, host)
 
         def create_failure_last_message(color, command, hosts):
-            rsync = None
-            if mirror_mode == 'push':
-                rsync = rsync_template % ('REMOTE_HOST')
-            else:
-                rsync = rsync_template % ('REMOTE_HOST', 'LOCAL')
+            rsync = ' && '.join([
+                self.create_rsync_command('REMOTE_HOST', s, d, o, 'LOCAL') for s, d, o in pairs
+            ])
             return '"%s" failed on following hosts\n%s' % (rsync, hosts)
 
         # Call BaseExectuor#process_async_results with callbacks
-        return self.process_async_results(
+        exit_status = self.process_async_results(
             async_results,
             create_output,
             create_timeout_message,
@@ -243,4 +481,134 @@ class RsyncExecutor(BaseExecutor):
             create_failure_raise_error_message,
             create_failure_last_message
         )
+        if self.host_stats is not None:
+            self.report_stats()
+        return exit_status
+
+    def create_streams(self, pairs, mirror_mode, stamps):
+        """
+        Split files of the source into partitions for --streams.
+        Each task of a host executes rsync of all partitions, so number of tasks executed
+        at once is limited to keep number of rsync within --parallel.
+
+        Returns: (base directory of files, paths of file lists)
+        """
+        options = self.context.options
+        parallel = options.get('parallel') or 1
+        if options['streams'] > parallel:
+            raise RuntimeError('[error] --streams %d requires --parallel %d or more' % (options['streams'], options['streams']))
+        if len(pairs) > 1 or options.get('manifest') or stamps is not None:
+            raise RuntimeError('[error] --streams cannot be used with --manifest and --skip-synced')
+        if mirror_mode != 'push':
+            raise RuntimeError('[error] --streams can be used only in push mode')
+        source, destination, rsync_options = pairs[0]
+        if len([ o for o in shlex.split(rsync_options) if o.startswith('--delete') ]) > 0:
+            # rsync doesn't delete files in directories which are not transferred recursively
+            raise RuntimeError('[error] --streams cannot be used with --delete')
+
+        base, files = list_files(source)
+        partitions = partition_files(files, options['streams'])
+        self.streams_dir = tempfile.mkdtemp(prefix = 'tomahawk-streams.')
+        file_lists = write_file_lists(partitions, self.streams_dir)
+        self.log.debug('%d files are split into %d streams' % (len(files), len(file_lists)))
+        self.max_running = max(1, parallel // len(file_lists))
+        return base, file_lists
+
+    def record_result(self, host, command, exit_status, command_output, timed_out):
+        super(RsyncExecutor, self).record_result(host, command, exit_status, command_output, timed_out)
+        if self.host_stats is None or timed_out:
+            return
+        # --streams runs rsync of a host concurrently
+        stats = parse_rsync_stats(command_output, concurrent = self.streams_dir is not None)
+        if stats is not None:
+            self.host_stats.append((host, stats))
+
+    def report_stats(self):
+        """
+        Print a summary of transfer stats, and write stats as JSON with --stats-json.
+        """
+        options = self.context.options
+        out = self.context.out
+        summary = aggregate_stats(self.host_stats)
+        if options.get('stats'):
+            print_(format_summary(summary), file=out)
+        if options.get('stats_json'):
+            stats = {
+                'hosts': dict(self.host_stats),
+                'summary': summary,
+            }
+            if options['stats_json'] == '-':
+                print_(json.dumps(stats, indent = 2, sort_keys = True), file=out)
+            else:
+                f = open(options['stats_json'], 'w')
+                try:
+                    json.dump(stats, f, indent = 2, sort_keys = True)
+                finally:
+                    f.close()
+
+    def remote_host(self, host):
+        rsync_user = self.context.options.get('rsync_user')
+        if rsync_user:
+            return '%s@%s' % (rsync_user, host)
+        return host
+
+    def control_path(self):
+        return os.path.join(self.control_dir, '%r@%h:%p')
+
+    def control_options(self):
+        return [
+            '-o', 'ControlMaster=auto', '-o', 'ControlPath=' + self.control_path(),
+            '-o', 'ControlPersist=60'
+        ]
+
+    def add_control_options(self, rsync_command):
+        return "rsync -e '%s' %s" % (' '.join([ 'ssh' ] + self.control_options()), rsync_command[len('rsync '):])
+
+    def create_rsync_command(self, host, source, destination, rsync_options, local = None):
+        """
+        Args:
+        local -- local file/dir in pull mode. (default: destination with a host suffix)
+
+        Returns: a rsync command for host
+        """
+        if (self.context.options.get('mirror_mode') or 'push') == 'push':
+            return 'rsync %s %s %s:%s' % (rsync_options, source, self.remote_host(host), destination)
+
+        dest = local
+        if dest is None:
+            dest = destination
+            if os.path.exists(destination):
+                if os.path.isdir(destination):
+                    # if destination is a directory, gets a source filename and appends a host suffix
+                    file_name = os.path.basename(source)
+                    if not destination.endswith('/'):
+                        dest += '/'
+                    dest += '%s__%s' % (host, file_name)
+                else:
+                    # if destination is a file, simply appends a host suffix
+                    dest = host + '__' + dest
+            else:
+                 # if file doesn't exist
+                source_name = os.path.basename(source)
+                if source.endswith('/'):
+                    os.path.basename(source[0:len(source)-1])
+                dest += host + '__' + source_name
+        return 'rsync %s %s:%s %s' % (rsync_options, self.remote_host(host), source, dest)
+
+    def finish_execution(self):
+        if self.control_dir is not None:
+            shutil.rmtree(self.control_dir, ignore_errors = True)
+        if self.streams_dir is not None:
+            shutil.rmtree(self.streams_dir, ignore_errors = True)
+        super(RsyncExecutor, self).finish_execution()
+
+def add_stats_option(rsync_options):
+    if '--stats' in shlex.split(rsync_options):
+        return rsync_options
+    return rsync_options + ' --stats'
 
+def has_rsh_option(rsync_options):
+    for option in shlex.split(rsync_options):
+        if option in ('-e', '--rsh') or option.startswith('--rsh='):
+            return True
+    return False
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from six.moves import shlex_quote
+
+def read_items(path):
+    """
+    Returns: a list of non-empty lines of a work list file
+    """
+    f = open(path)
+    try:
+        return [ line.rstrip('\r\n') for line in f if line.strip() != '' ]
+    finally:
+        f.close()
+
+def split_items(items, count):
+    """
+    Split items into count contiguous chunks whose sizes differ at most by one.
+
+    Returns: a list of chunks
+    """
+    size, remainder = divmod(len(items), count)
+    chunks = []
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < remainder else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+def create_shard_command(command, host, index, count, items = None):
+    """
+    Returns: command which is executed with environment variables of a shard
+    """
+    variables = [
+        ('TOMAHAWK_HOST', host),
+        ('TOMAHAWK_SHARD_INDEX', str(index)),
+        ('TOMAHAWK_SHARD_COUNT', str(count)),
+    ]
+    if items is not None:
+        variables.append(('TOMAHAWK_SHARD_ITEMS', '\n'.join(items)))
+    return 'export %s; %s' % (
+        ' '.join([ '%s=%s' % (name, shlex_quote(value)) for name, value in variables ]),
+        command
+    )
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+
+from six.moves import shlex_quote
+
+# stamps of synced sources on remote hosts, relative to the home directory
+REMOTE_STAMP_DIR = '.tomahawk/stamps'
+STAMP_REGEX = re.compile(r'^TOMAHAWK-STAMP ([0-9a-f]+) ([0-9a-f]*)$', re.M)
+
+class HashCache(object):
+    """
+    A local cache of sha256 of files keyed by (path, size, mtime),
+    so unchanged files are not read again.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.entries = {}
+        self.modified = False
+        try:
+            f = open(self.path)
+            try:
+                self.entries = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+
+    def file_hash(self, path, st):
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return entry[2]
+        h = hashlib.sha256()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                h.update(data)
+        finally:
+            f.close()
+        self.entries[path] = [ st.st_size, st.st_mtime, h.hexdigest() ]
+        self.modified = True
+        return h.hexdigest()
+
+    def save(self):
+        if not self.modified:
+            return
+        for path in list(self.entries.keys()):
+            if not os.path.exists(path):
+                del self.entries[path]
+        dir = os.path.dirname(self.path)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        fd, tmp_path = tempfile.mkstemp(dir = dir, prefix = '.hashes')
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(self.entries, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
+        self.modified = False
+
+def tree_hash(source, cache):
+    """
+    Returns: sha256 of names, modes and contents of files under source
+    """
+    h = hashlib.sha256()
+    root = os.path.abspath(source)
+    def add(path):
+        st = os.lstat(path)
+        name = os.path.relpath(path, root)
+        if stat.S_ISLNK(st.st_mode):
+            content = os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            content = cache.file_hash(path, st)
+        else:
+            content = ''
+        h.update(('%s\0%o\0%s\n' % (name, st.st_mode, content)).encode('utf-8', 'replace'))
+
+    add(root)
+    if os.path.isdir(root) and not os.path.islink(root):
+        for dir, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                add(os.path.join(dir, name))
+    return h.hexdigest()
+
+def create_stamp(source, destination, rsync_options, cache):
+    """
+    Returns: (key of the stamp on remote hosts, value of the stamp)
+    """
+    key = hashlib.sha1(destination.encode('utf-8')).hexdigest()
+    value = hashlib.sha256(
+        '\0'.join([ tree_hash(source, cache), source, destination, rsync_options ]).encode('utf-8')
+    ).hexdigest()
+    return key, value
+
+def create_read_stamps_command(keys):
+    return 'for k in %s; do echo "TOMAHAWK-STAMP $k $(cat %s/$k 2>/dev/null)"; done' \
+        % (' '.join(keys), REMOTE_STAMP_DIR)
+
+def parse_stamps(output):
+    """
+    Returns: a dict which maps a key to a value of stamps
+    """
+    return dict(STAMP_REGEX.findall(output.replace('\r\n', '\n')))
+
+def create_write_stamps_command(stamps):
+    commands = [ 'mkdir -p %s' % (REMOTE_STAMP_DIR) ]
+    for key, value in stamps:
+        commands.append('echo %s > %s' % (shlex_quote(value), shlex_quote('%s/%s' % (REMOTE_STAMP_DIR, key))))
+    return ' && '.join(commands)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import re
+
+# a host whose literal ratio exceeds the median of the fleet by this is reported
+ABNORMAL_LITERAL_RATIO_MARGIN = 0.25
+SLOWEST_HOSTS = 5
+
+NUMBER = r'([\d,.]+[KMGTP]?)'
+STATS_REGEXES = {
+    'files': re.compile(r'^Number of files: ' + NUMBER, re.M),
+    # "Number of files transferred" before rsync 3.1
+    'files_transferred': re.compile(r'^Number of (?:regular )?files transferred: ' + NUMBER, re.M),
+    'total_file_size': re.compile(r'^Total file size: ' + NUMBER, re.M),
+    'transferred_file_size': re.compile(r'^Total transferred file size: ' + NUMBER, re.M),
+    'literal_bytes': re.compile(r'^Literal data: ' + NUMBER, re.M),
+    'matched_bytes': re.compile(r'^Matched data: ' + NUMBER, re.M),
+    'sent_bytes': re.compile(r'^Total bytes sent: ' + NUMBER, re.M),
+    'received_bytes': re.compile(r'^Total bytes received: ' + NUMBER, re.M),
+}
+RATE_REGEX = re.compile(r'^sent \S+ bytes\s+received \S+ bytes\s+' + NUMBER + r' bytes/sec', re.M)
+UNITS = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4, 'P': 1024 ** 5 }
+
+def parse_number(text):
+    """
+    Parse a number printed by rsync. (e.g. "1,234", "1.23M" with --human-readable)
+    """
+    text = text.replace(',', '')
+    unit = 1
+    if text[-1] in UNITS:
+        unit = UNITS[text[-1]]
+        text = text[:-1]
+    return float(text) * unit
+
+def parse_rsync_stats(output, concurrent = False):
+    """
+    Parse output of "rsync --stats". Stats of multiple rsync (e.g. --manifest) are summed up.
+
+    Args:
+    concurrent -- True if multiple rsync ran at the same time (--streams),
+                  so seconds is the longest of them instead of the sum
+
+    Returns: a dict of stats, or None if output doesn't contain stats
+    """
+    output = output.replace('\r\n', '\n')
+    stats = {}
+    for name, regex in STATS_REGEXES.items():
+        values = regex.findall(output)
+        if len(values) == 0:
+            return None
+        stats[name] = int(sum([ parse_number(v) for v in values ]))
+
+    # seconds of transfers are computed from rates because rsync doesn't print them
+    rates = [ parse_number(v) for v in RATE_REGEX.findall(output) ]
+    sent = [ parse_number(v) for v in STATS_REGEXES['sent_bytes'].findall(output) ]
+    received = [ parse_number(v) for v in STATS_REGEXES['received_bytes'].findall(output) ]
+    durations = [ 0.0 ]
+    for rate, sent_bytes, received_bytes in zip(rates, sent, received):
+        if rate > 0:
+            durations.append((sent_bytes + received_bytes) / rate)
+    if concurrent:
+        seconds = max(durations)
+    else:
+        seconds = sum(durations)
+    stats['seconds'] = round(seconds, 3)
+    stats['bytes_per_second'] = 0.0
+    if seconds > 0:
+        stats['bytes_per_second'] = round((stats['sent_bytes'] + stats['received_bytes']) / seconds, 2)
+    stats['speedup'] = 0.0
+    if stats['sent_bytes'] + stats['received_bytes'] > 0:
+        stats['speedup'] = round(
+            float(stats['total_file_size']) / (stats['sent_bytes'] + stats['received_bytes']), 2
+        )
+    stats['literal_ratio'] = literal_ratio(stats)
+    return stats
+
+def literal_ratio(stats):
+    """
+    Returns: ratio of data sent in full instead of deltas, or None when nothing is transferred
+    """
+    data = stats['literal_bytes'] + stats['matched_bytes']
+    if data == 0:
+        return None
+    return round(float(stats['literal_bytes']) / data, 4)
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def aggregate_stats(host_stats, slowest = SLOWEST_HOSTS):
+    """
+    Aggregate stats of hosts into a fleet summary.
+
+    Args:
+    host_stats -- a list of (host, stats)
+
+    Returns: a dict of totals, the slowest hosts and hosts with abnormal literal ratios
+    """
+    totals = {}
+    for name in STATS_REGEXES.keys():
+        totals[name] = sum([ stats[name] for host, stats in host_stats ])
+    totals['literal_ratio'] = literal_ratio(totals)
+
+    slowest_hosts = sorted(
+        [ (stats['seconds'], host) for host, stats in host_stats if stats['seconds'] > 0 ],
+        reverse = True
+    )[0:slowest]
+
+    ratios = [ (host, stats['literal_ratio']) for host, stats in host_stats if stats['literal_ratio'] is not None ]
+    median_ratio = None
+    abnormal_hosts = []
+    if len(ratios) > 0:
+        median_ratio = median([ r for h, r in ratios ])
+        abnormal_hosts = [
+            { 'host': h, 'literal_ratio': r } for h, r in ratios
+            if r - median_ratio > ABNORMAL_LITERAL_RATIO_MARGIN
+        ]
+    return {
+        'hosts': len(host_stats),
+        'totals': totals,
+        'slowest_hosts': [ { 'host': h, 'seconds': s } for s, h in slowest_hosts ],
+        'median_literal_ratio': median_ratio,
+        'abnormal_literal_ratio_hosts': abnormal_hosts,
+    }
+
+def format_bytes(size):
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if abs(size) < 1024 or unit == 'T':
+            break
+        size /= 1024.0
+    if unit == '':
+        return '%d bytes' % (size)
+    return '%.2f%sB' % (size, unit)
+
+def format_summary(summary):
+    totals = summary['totals']
+    lines = [
+        'rsync stats of %d hosts' % (summary['hosts']),
+        '  files transferred: %d / %d' % (totals['files_transferred'], totals['files']),
+        '  literal data: %s, matched data: %s' % (format_bytes(totals['literal_bytes']), format_bytes(totals['matched_bytes'])),
+        '  sent: %s, received: %s' % (format_bytes(totals['sent_bytes']), format_bytes(totals['received_bytes'])),
+    ]
+    if len(summary['slowest_hosts']) > 0:
+        lines.append('  slowest hosts:')
+        for h in summary['slowest_hosts']:
+            lines.append('    %s (%.2f seconds)' % (h['host'], h['seconds']))
+    if len(summary['abnormal_literal_ratio_hosts']) > 0:
+        lines.append('  hosts with high literal ratio (median: %.2f%%):' % (summary['median_literal_ratio'] * 100))
+        for h in summary['abnormal_literal_ratio_hosts']:
+            lines.append('    %s (%.2f%%)' % (h['host'], h['literal_ratio'] * 100))
+    return '\n'.join(lines)
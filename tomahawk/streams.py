@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import heapq
+import os
+import stat
+
+def list_files(source):
+    """
+    List files under a source directory as rsync transfers them.
+    A source with a trailing slash means its contents, without it means the directory itself.
+
+    Returns: (base directory, a list of (path relative to the base, size))
+    """
+    if source.endswith('/'):
+        base, prefix = source, ''
+    else:
+        base, prefix = os.path.dirname(source) or '.', os.path.basename(source)
+    root = os.path.join(base, prefix)
+    if not os.path.isdir(root) or os.path.islink(root):
+        raise RuntimeError('[error] Source must be a directory with --streams: ' + source)
+
+    files = []
+    if prefix != '':
+        files.append((prefix, 0))
+    for dir, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in sorted(dirs + names):
+            path = os.path.join(dir, name)
+            st = os.lstat(path)
+            size = 0
+            if stat.S_ISREG(st.st_mode):
+                size = st.st_size
+            files.append((os.path.relpath(path, base), size))
+    return base, files
+
+def partition_files(files, count):
+    """
+    Split files into count partitions whose total sizes are balanced.
+    Larger files are assigned first to the partition with the smallest total (LPT).
+    Files without size (e.g. directories, symlinks) are assigned to the first partition.
+
+    Returns: a list of sorted lists of paths. Empty partitions are removed.
+    """
+    partitions = [ [] for i in range(count) ]
+    # a min-heap of (total size, index of partition)
+    heap = [ (0, i) for i in range(count) ]
+    for path, size in sorted(files, key = lambda f: -f[1]):
+        if size == 0:
+            partitions[0].append(path)
+            continue
+        total, index = heapq.heappop(heap)
+        partitions[index].append(path)
+        heapq.heappush(heap, (total + size, index))
+    return [ sorted(p) for p in partitions if len(p) > 0 ]
+
+def write_file_lists(partitions, dir):
+    """
+    Write partitions to files for "rsync --from0 --files-from".
+    Paths are separated by NUL because a file name may contain newlines.
+
+    Returns: a list of paths of files
+    """
+    paths = []
+    for index, partition in enumerate(partitions):
+        path = os.path.join(dir, 'files.%d' % (index))
+        f = open(path, 'wb')
+        try:
+            for name in partition:
+                if not isinstance(name, bytes):
+                    name = name.encode('utf-8', 'surrogateescape')
+                f.write(name + b'\0')
+        finally:
+            f.close()
+        paths.append(path)
+    return paths
@@ -5,6 +5,8 @@ from six.moves import configparser
 #import ConfigParser
 from getpass import getpass, getuser
 import os
+import resource
+import select
 import sys
 import shlex
 
@@ -88,10 +90,11 @@ def check_hosts(options, log, usage_func):
         print_(usage_func(), file=sys.stderr)
         sys.exit(1)
 
-    # Adjust parallel execution numbers with count of hosts
+    # Adjust parallel execution numbers with count of hosts (and rsync streams of each host)
     parallel = options.get('parallel', 1)
-    if len(hosts) < parallel:
-        options['parallel'] = len(hosts)
+    max_parallel = len(hosts) * (options.get('streams') or 1)
+    if max_parallel < parallel:
+        options['parallel'] = max_parallel
     
     return hosts
 
@@ -118,3 +121,43 @@ def check_required_command(command):
                 return
     print_('Program "%s" is not executable. Check installation.' % (command), file=sys.stderr)
     sys.exit(1)
+
+def raise_file_limit(required):
+    """
+    Raise the soft limit of file descriptors up to required, but not over the hard limit.
+
+    Returns: the soft limit, or None if it's unlimited
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    if required <= soft:
+        return soft
+    if hard != resource.RLIM_INFINITY:
+        required = min(required, hard)
+        if required <= soft:
+            return soft
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (required, hard))
+    except (ValueError, OSError):
+        return soft
+    return required
+
+def wait_writable(fds, timeout):
+    """
+    Returns: fds which are writable or have errors in timeout seconds
+    """
+    # select() cannot handle fds larger than FD_SETSIZE, so use poll() if available
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLOUT)
+        try:
+            return [ fd for fd, event in poller.poll(timeout * 1000) ]
+        except (select.error, OSError):
+            return []
+    try:
+        readable, writable, exceptional = select.select([], fds, fds, timeout)
+    except (select.error, OSError):
+        return []
+    return list(set(writable + exceptional))